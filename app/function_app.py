@@ -1,14 +1,70 @@
 import azure.functions as func
+import asyncio
 import logging
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import parse_qs
 
-from wrapped import get_wrapped
+from slack_http import DeliveryError, ResponseUrlClient
+from wrapped import get_top_response, get_wrapped_response, no_data_text, response_payload
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 
+# Slack gives up on a slash command 3 seconds after sending it, and the time the
+# request spent getting here (cold start, queueing) counts against that. If the
+# message isn't ready by this deadline, acknowledge and deliver it through the
+# response_url instead; the deadline shrinks so the acknowledgement still goes
+# out ACK_MARGIN before Slack's timeout by the request's X-Slack-Request-Timestamp.
+SLACK_TIMEOUT = 3.0
+INLINE_DEADLINE = 0.5
+ACK_MARGIN = 1.0  # The timestamp is in whole seconds, and clocks drift
+
+# Lookups from every invocation share this many threads; during a burst the
+# rest wait their turn (and are followed up via response_url past the deadline)
+LOOKUP_THREADS = 8
+_lookup_executor = ThreadPoolExecutor(max_workers=LOOKUP_THREADS, thread_name_prefix="wrapped-lookup")
+
+# Replaceable, e.g. with ResponseUrlClient(allowed_hosts=None) to post to a local stub of Slack
+response_client = ResponseUrlClient()
+
+# Follow-ups still being delivered (the event loop only keeps weak references to tasks)
+_follow_ups = set()
+
+
+def inline_deadline(headers, now=None):
+    """Seconds to wait for the message before acknowledging a request with these headers."""
+    try:
+        sent = float(headers.get("X-Slack-Request-Timestamp", ""))
+    except ValueError:
+        return INLINE_DEADLINE
+    elapsed = max(0.0, (time.time() if now is None else now) - sent)
+    return max(0.0, min(INLINE_DEADLINE, SLACK_TIMEOUT - ACK_MARGIN - elapsed))
+
+
+def build_response(user_id, text=""):
+    """Return the JSON body of the ephemeral response for a user (or for a subcommand such as `top replies`)."""
+    body = get_top_response(text)
+    if body is not None:
+        return body
+    body = get_wrapped_response(user_id)
+    if body is None:
+        logging.warning(f"No data found for user: {user_id}")
+        body = json.dumps(response_payload(no_data_text(user_id)))
+    return body
+
+
+async def _follow_up(lookup, response_url, user_id):
+    try:
+        payload = json.loads(await lookup)
+        payload["replace_original"] = True  # Replace the acknowledgement
+        await response_client.post(response_url, payload)
+    except Exception:
+        logging.exception(f"Could not deliver the Slack Wrapped for user: {user_id}")
+
+
 @app.route(route="slack_command")
-def slack_command(req: func.HttpRequest) -> func.HttpResponse:
+async def slack_command(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Received Slack slash command request.')
 
     # Parse the application/x-www-form-urlencoded payload
@@ -20,6 +76,8 @@ def slack_command(req: func.HttpRequest) -> func.HttpResponse:
 
     # Extract the user_id from the parsed payload
     user_id = payload.get("user_id", [""])[0]  # Extract 'user_id', fallback to empty string
+    response_url = payload.get("response_url", [""])[0]
+    text = payload.get("text", [""])[0].strip()
 
     if user_id:
         #if user_id not in ['U02PXAJBJ0L','U04SERE52HL']:
@@ -27,38 +85,31 @@ def slack_command(req: func.HttpRequest) -> func.HttpResponse:
         #        "Shh!! This isn't ready yet... Coming soon!",
         #        status_code=200
         #    )
-        
+
         logging.info(f"Slash command invoked by user: {user_id}")
-        wrapped = get_wrapped(user_id)
-        if not wrapped:
-            logging.warning(f"No data found for user: {user_id}")
-            response_payload = {
-                "response_type": "ephemeral",
-                "blocks": [
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"Sorry, <@{user_id}>, we don't seem to have any data for you. :thinking_face: Maybe you weren't very active, or maybe we made a mistake somewhere."
-                        }
-                    }
-                ]
-            }
-        else:
-            response_payload = {
-                "response_type": "ephemeral",
-                "blocks": [
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": wrapped
-                        }
-                    }
-                ]
-            }
+        lookup = asyncio.get_running_loop().run_in_executor(_lookup_executor, build_response, user_id, text)
+
+        if response_url:
+            deadline = inline_deadline(req.headers)
+            done, _ = await asyncio.wait({lookup}, timeout=deadline)
+            if not done:
+                try:
+                    response_client.check_url(response_url)
+                except DeliveryError as e:
+                    logging.warning(f"Not following up on a slow lookup: {e}")
+                else:
+                    logging.info(f"Stats not ready in {deadline:.2f}s, following up via response_url for user: {user_id}")
+                    task = asyncio.ensure_future(_follow_up(lookup, response_url, user_id))
+                    _follow_ups.add(task)
+                    task.add_done_callback(_follow_ups.discard)
+                    return func.HttpResponse(
+                        json.dumps({"response_type": "ephemeral", "text": "Wrapping up your year... :gift:"}),
+                        status_code=200,
+                        mimetype="application/json"
+                    )
+
         return func.HttpResponse(
-            json.dumps(response_payload),
+            await lookup,
             status_code=200,
             mimetype="application/json"  # Important: Tell Slack you're sending JSON
         )
@@ -0,0 +1,150 @@
+import asyncio
+import http.client
+import json
+import random
+import threading
+from urllib.parse import urlsplit
+
+# Statuses worth retrying: rate limited or a temporary failure on Slack's side
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class DeliveryError(Exception):
+    """A response_url message that could not be delivered."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class PooledTransport:
+    """HTTP(S) POSTs over keep-alive connections that are reused across invocations.
+
+    http.client is blocking, so requests run on worker threads; post_json() is
+    the awaitable entry point. Any object with the same post_json() coroutine
+    can be used instead, e.g. a client for a local stub server.
+    """
+
+    def __init__(self, max_idle_per_host=4, timeout=5.0):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._idle = {}  # (scheme, host, port) -> idle connections
+        self._lock = threading.Lock()
+        self._ssl_context = None
+
+    def _connect(self, scheme, host, port):
+        if scheme == "https":
+            if self._ssl_context is None:
+                # Loading the CA bundle takes tens of milliseconds, so not at import time
+                import ssl
+
+                self._ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self._ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _checkout(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(*key), False
+
+    def _checkin(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """Send one request and return (status, headers, body)."""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Unsupported URL: {url}")
+        key = (parts.scheme, parts.hostname, parts.port)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+        while True:
+            connection, reused = self._checkout(key)
+            try:
+                connection.request(method, target, body=body, headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                if reused:
+                    continue  # The server dropped this idle connection; try the next one, or a new one
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._checkin(key, connection)
+            return response.status, response.headers, data
+
+    async def post_json(self, url, payload):
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        return await asyncio.to_thread(self.request, "POST", url, body, headers)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class ResponseUrlClient:
+    """Deliver messages to a slash command's response_url, retrying with exponential backoff.
+
+    Only HTTPS URLs on allowed_hosts are accepted, since the URL arrives in the
+    request payload; pass allowed_hosts=None to post anywhere (e.g. to a stub server).
+    """
+
+    def __init__(self, transport=None, retries=3, backoff=0.5, max_backoff=8.0, allowed_hosts=("hooks.slack.com",), sleep=asyncio.sleep):
+        self.transport = transport if transport is not None else PooledTransport()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.allowed_hosts = allowed_hosts
+        self.sleep = sleep
+
+    def check_url(self, response_url):
+        if self.allowed_hosts is None:
+            return
+        parts = urlsplit(response_url)
+        if parts.scheme != "https" or parts.hostname not in self.allowed_hosts:
+            raise DeliveryError(f"Refusing to post to {response_url!r}")
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return retry_after
+        # Full jitter, so retries from many invocations don't line up
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def post(self, response_url, payload):
+        """POST payload as JSON to response_url, raising DeliveryError once the retries are used up."""
+        self.check_url(response_url)
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                status, headers, body = await self.transport.post_json(response_url, payload)
+            except (OSError, http.client.HTTPException) as e:
+                error = DeliveryError(f"Could not reach {response_url}: {e}")
+            else:
+                if status < 300:
+                    return
+                error = DeliveryError(f"{response_url} answered {status}: {body[:200]!r}", status)
+                if status not in RETRY_STATUSES:
+                    raise error
+                if status == 429:
+                    try:
+                        retry_after = float(headers.get("Retry-After", ""))
+                    except ValueError:
+                        pass
+
+            if attempt == self.retries:
+                raise error
+            await self.sleep(self._delay(attempt, retry_after))
@@ -0,0 +1,156 @@
+import json
+import os
+import sys
+import threading
+
+from stats_store import APP_DIR, CHECK_INTERVAL, STATS_FILE, IndexedRecords, StatsStore, index_source, write_index
+
+QUERY_FILE = os.path.join(APP_DIR, "final_query.idx")
+CHANNEL_POSTS_FILE = os.path.join(APP_DIR, "channel_posts.json")
+
+# Metrics ranked across the workspace; channels are ranked by posts
+METRICS = ("threads_started", "replies", "engagement_received")
+CHANNEL_METRICS = ("posts",)
+
+# Entries kept per leaderboard, i.e. the largest k a query can return
+QUERY_LIMIT = 100
+
+# Users left out of every leaderboard (e.g. bots): the excluded_user_ids of prep_stats.py.
+# Rebuild final_query.idx after changing it.
+EXCLUDED_USER_IDS = []
+
+# Stands in for a missing channel_posts.json (always the same object, so leaderboards computed without it are kept)
+_NO_CHANNEL_POSTS = {}
+
+
+def _ranked(entries, limit):
+    return sorted(entries, key=lambda entry: (-entry[1], entry[0]))[:limit]
+
+
+def load_channel_posts(channel_posts_file=CHANNEL_POSTS_FILE):
+    """The channel_posts.json mapping of channel name -> [[user ID, posts], ...], or {} if there is none."""
+    if not channel_posts_file or not os.path.exists(channel_posts_file):
+        return {}
+    with open(channel_posts_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def query_records(stats, channel_posts=None, excluded_user_ids=(), limit=QUERY_LIMIT):
+    """Yield (key, [[user ID, value], ...]) leaderboards for a final_stats mapping, each sorted best first.
+
+    Keys are "top:<metric>" for the workspace, "top:posts:<channel>" for the
+    posters of a channel (from channel_posts, which counts every poster) and
+    "co:<user ID>" for the users who shared threads with a user. final_stats
+    only keeps each user's top co-posters, so a user's co-posters are their
+    own top co-posters plus everyone who has them among theirs. Excluded
+    users appear in none of them.
+    """
+    excluded = set(excluded_user_ids)
+    ranked_stats = [(user_id, user_stats) for user_id, user_stats in stats.items() if user_id not in excluded]
+    for metric in METRICS:
+        yield f"top:{metric}", _ranked(((user_id, user_stats[metric]) for user_id, user_stats in ranked_stats), limit)
+
+    for channel_name, posters in (channel_posts or {}).items():
+        posters = [(user_id, posts) for user_id, posts in posters if user_id not in excluded]
+        if posters:
+            yield f"top:posts:{channel_name}", _ranked(posters, limit)
+
+    co_posters = {}  # user ID -> {co-poster: threads together}
+    for user_id, user_stats in ranked_stats:
+        for co_poster, threads in user_stats["top_co_posters"]:
+            if co_poster in excluded:
+                continue
+            co_posters.setdefault(user_id, {})[co_poster] = threads
+            co_posters.setdefault(co_poster, {})[user_id] = threads
+    for user_id, threads_with in co_posters.items():
+        yield f"co:{user_id}", _ranked(threads_with.items(), limit)
+
+
+def build_query_index(
+    stats_file=STATS_FILE, query_file=QUERY_FILE, channel_posts_file=CHANNEL_POSTS_FILE, excluded_user_ids=EXCLUDED_USER_IDS,
+):
+    """Write the leaderboards of a final_stats.json (and channel_posts.json, if there is one) to a query index."""
+    sources = [index_source(stats_file), index_source(channel_posts_file) if channel_posts_file else None]
+    with open(stats_file, "r", encoding="utf-8") as f:
+        stats = json.load(f)
+    records = query_records(stats, load_channel_posts(channel_posts_file), excluded_user_ids)
+    return write_index(
+        ((key, json.dumps(entries, separators=(",", ":")).encode("utf-8")) for key, entries in records),
+        query_file,
+        sources,
+    )
+
+
+class StatsQuery:
+    """Leaderboard lookups over the prepared stats: top users per metric, per channel, and co-posters.
+
+    Each query is a single lookup in final_query.idx returning a pre-sorted
+    list, so it costs the same however many users there are. Without the
+    index (or with one built from older files), the leaderboards are computed
+    from final_stats.json and channel_posts.json once per load of either.
+    """
+
+    def __init__(
+        self, stats_file=STATS_FILE, query_file=QUERY_FILE, channel_posts_file=CHANNEL_POSTS_FILE,
+        excluded_user_ids=EXCLUDED_USER_IDS, check_interval=CHECK_INTERVAL,
+    ):
+        self._store = StatsStore(stats_file, query_file, check_interval, source_files=[stats_file, channel_posts_file])
+        self._channel_posts = StatsStore(channel_posts_file, None, check_interval)
+        self._excluded_user_ids = excluded_user_ids
+        self._lock = threading.Lock()
+        self._computed = (None, None, None)  # (stats mapping, channel posts mapping, their leaderboards)
+
+    def _current_channel_posts(self):
+        try:
+            return self._channel_posts.stats()
+        except FileNotFoundError:
+            return _NO_CHANNEL_POSTS
+
+    def _lookup(self, key):
+        source = self._store.stats()
+        if isinstance(source, IndexedRecords):
+            return source.get(key) or []
+        channel_posts = self._current_channel_posts()
+        stats, posts, records = self._computed
+        if stats is not source or posts is not channel_posts:
+            with self._lock:
+                # Look again: while we waited, another thread may have computed newer files than the ones we saw
+                source = self._store.stats()
+                if isinstance(source, IndexedRecords):
+                    return source.get(key) or []
+                channel_posts = self._current_channel_posts()
+                stats, posts, records = self._computed
+                if stats is not source or posts is not channel_posts:
+                    records = dict(query_records(source, channel_posts, self._excluded_user_ids))
+                    self._computed = (source, channel_posts, records)
+        return records.get(key, [])
+
+    def top(self, metric, k=10, channel=None):
+        """Return up to k (user ID, value) pairs ranked by a metric, or by posts in a channel."""
+        if metric not in (CHANNEL_METRICS if channel else METRICS):
+            raise ValueError(f"Unknown metric: {metric}")
+        key = f"top:{metric}:{channel.lstrip('#')}" if channel else f"top:{metric}"
+        return [tuple(entry) for entry in self._lookup(key)[:k]]
+
+    def co_posters(self, user_id, k=10):
+        """Return up to k (user ID, threads together) pairs for the users who posted most in threads with a user."""
+        return [tuple(entry) for entry in self._lookup(f"co:{user_id}")[:k]]
+
+
+_default_query = StatsQuery()
+
+
+def get_top(metric, k=10, channel=None):
+    return _default_query.top(metric, k, channel)
+
+
+def get_co_posters(user_id, k=10):
+    return _default_query.co_posters(user_id, k)
+
+
+if __name__ == "__main__":
+    stats_file = sys.argv[1] if len(sys.argv) > 1 else STATS_FILE
+    stats_dir = os.path.dirname(os.path.abspath(stats_file))
+    query_file = sys.argv[2] if len(sys.argv) > 2 else os.path.join(stats_dir, "final_query.idx")
+    count = build_query_index(stats_file, query_file, os.path.join(stats_dir, "channel_posts.json"))
+    print(f"Indexed {count} leaderboards into {query_file}")
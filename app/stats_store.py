@@ -0,0 +1,307 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STATS_FILE = os.path.join(APP_DIR, "final_stats.json")
+INDEX_FILE = os.path.join(APP_DIR, "final_stats.idx")
+
+# Index layout: header, the size, mtime and SHA-1 of each JSON file the index
+# was built from (so an index left behind by a replaced file isn't served),
+# then one fixed-width entry per user sorted by user ID, then the compact JSON
+# record of every user back to back.
+INDEX_MAGIC = b"SWIDX003"
+HEADER = struct.Struct("<8sIII")  # magic, user count, key width, source count
+SOURCE = struct.Struct("<qq20s")  # source size (-1 if it didn't exist), mtime_ns, SHA-1
+ENTRY_TAIL = struct.Struct("<QI")  # record offset, record length
+MISSING_SOURCE = (-1, 0, bytes(20))
+
+# Seconds between checks for a replaced stats file, so requests don't stat it every time
+CHECK_INTERVAL = 1.0
+
+# path -> ((mtime_ns, size), SHA-1) of the files hashed so far, shared by every store in the process
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def index_source(path):
+    """(size, mtime_ns, SHA-1) of a file an index is built from, or None if there is no such file.
+
+    Take it before reading the file.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns, _digest_of(path, (st.st_mtime_ns, st.st_size))
+
+
+def read_index_sources(index_file):
+    """The index_source() of every file an index was built from, as recorded in its header."""
+    with open(index_file, "rb") as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size or header[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError(f"{index_file} is not a stats index file.")
+        source_count = HEADER.unpack(header)[3]
+        data = f.read(source_count * SOURCE.size)
+    if len(data) < source_count * SOURCE.size:
+        raise ValueError(f"{index_file} is truncated.")
+    sources = [SOURCE.unpack_from(data, number * SOURCE.size) for number in range(source_count)]
+    return [None if source == MISSING_SOURCE else source for source in sources]
+
+
+def write_index(records, index_file, sources=()):
+    """Write (key, record bytes) pairs to an index file that maps each key to its record.
+
+    sources are the index_source()s of the files the records were read from.
+    """
+    records = sorted((key.encode("utf-8"), record) for key, record in records)
+    key_width = max((len(key) for key, _ in records), default=1)
+
+    offset = 0
+    entries = []
+    for key, record in records:
+        entries.append(key.ljust(key_width, b"\0") + ENTRY_TAIL.pack(offset, len(record)))
+        offset += len(record)
+
+    tmp_file = f"{index_file}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(HEADER.pack(INDEX_MAGIC, len(records), key_width, len(sources)))
+        f.writelines(SOURCE.pack(*(source or MISSING_SOURCE)) for source in sources)
+        f.writelines(entries)
+        f.writelines(record for _, record in records)
+    os.replace(tmp_file, index_file)
+    return len(records)
+
+
+def build_index(stats_file=STATS_FILE, index_file=INDEX_FILE):
+    """Write the per-user offset index for a final_stats.json file."""
+    source = index_source(stats_file)
+    with open(stats_file, "r", encoding="utf-8") as f:
+        stats = json.load(f)
+    return write_index(
+        ((user_id, json.dumps(user_stats, separators=(",", ":")).encode("utf-8")) for user_id, user_stats in stats.items()),
+        index_file,
+        [source],
+    )
+
+
+def _same_source(path, signature, source):
+    """Whether a file with this (mtime_ns, size) signature is the one index_source() recorded as source."""
+    if source is None:
+        return False
+    size, mtime_ns, digest = source
+    mtime, current_size = signature
+    # A copy can keep the contents but not the mtime, so only hash when the size matches
+    return size == current_size and (mtime_ns == mtime or digest == _digest_of(path, signature))
+
+
+def _digest_of(path, signature):
+    """SHA-1 of a file with this (mtime_ns, size) signature, hashed once per signature however many stores ask."""
+    with _digests_lock:
+        cached = _digests.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = _file_digest(path)
+        _digests[path] = (signature, digest)
+        return digest
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+class IndexedRecords:
+    """Per-key lookups against a memory-mapped index file such as final_stats.idx."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.key_width, source_count = HEADER.unpack_from(self.buffer, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} is not a stats index file.")
+        self.entry_size = self.key_width + ENTRY_TAIL.size
+        self.entries_start = HEADER.size + source_count * SOURCE.size
+        self.records_start = self.entries_start + self.count * self.entry_size
+
+    def _key_at(self, position):
+        start = self.entries_start + position * self.entry_size
+        return self.buffer[start:start + self.key_width]
+
+    def get_raw(self, user_id):
+        """Return the record bytes for a key, or None."""
+        key = user_id.encode("utf-8")
+        if len(key) > self.key_width:
+            return None
+        key = key.ljust(self.key_width, b"\0")
+
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count or self._key_at(low) != key:
+            return None
+
+        offset, length = ENTRY_TAIL.unpack_from(self.buffer, self.entries_start + low * self.entry_size + self.key_width)
+        start = self.records_start + offset
+        return self.buffer[start:start + length]
+
+    def get(self, user_id):
+        record = self.get_raw(user_id)
+        return None if record is None else json.loads(record)
+
+    def __contains__(self, user_id):
+        return self.get_raw(user_id) is not None
+
+    def __len__(self):
+        return self.count
+
+
+class StatsStore:
+    """Process-level cache of the prepared stats, reloaded only when the file changes.
+
+    Uses the offset index when one exists next to the stats file so a lookup
+    only decodes the requested user's record; otherwise the whole JSON file is
+    loaded once and kept in memory. With stats_file=None only the index is used.
+    An index that wasn't built from the current source_files ([stats_file] by
+    default) is stale: the JSON file is served instead, or nothing at all.
+    The loaded stats are shared read-only by every thread; a replaced file is
+    noticed within check_interval seconds.
+    """
+
+    def __init__(self, stats_file=STATS_FILE, index_file=INDEX_FILE, check_interval=CHECK_INTERVAL, source_files=None):
+        self.stats_file = stats_file
+        self.index_file = index_file
+        self.source_files = list(source_files) if source_files is not None else [stats_file]
+        self.check_interval = check_interval
+        self._fresh = (None, None)  # ((index signature, source signatures), whether the index is fresh)
+        self._lock = threading.Lock()
+        self._checked = (None, None)  # (monotonic time of the last check, its (path, signature) or None)
+        self._path = None
+        self._signature = None
+        self._digest = None
+        self._stats = None
+
+    @staticmethod
+    def _signature_of(path):
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _current_source(self):
+        signature = self._signature_of(self.index_file)
+        if signature is not None and self._index_fresh(signature):
+            return self.index_file, signature
+        signature = self._signature_of(self.stats_file)
+        if signature is not None:
+            return self.stats_file, signature
+        return None
+
+    def _index_fresh(self, index_signature):
+        """Whether the index was built from the current source_files.
+
+        A source file that is gone can't be compared, so it doesn't count
+        against the index; one that appeared since the index was built does.
+        """
+        source_signatures = [self._signature_of(path) for path in self.source_files]
+        signatures, fresh = self._fresh
+        if signatures == (index_signature, source_signatures):
+            return fresh
+
+        try:
+            recorded = read_index_sources(self.index_file)
+        except (OSError, ValueError):
+            recorded = None  # Unreadable, or written by an older version
+        if recorded is None or len(recorded) != len(self.source_files):
+            stale = self.source_files
+        else:
+            stale = [
+                path for path, signature, source in zip(self.source_files, source_signatures, recorded)
+                if signature is not None and not _same_source(path, signature, source)
+            ]
+        fresh = not stale
+        if not fresh:
+            logging.warning(f"{self.index_file} wasn't built from the current {', '.join(map(str, stale))}; rebuild it.")
+        self._fresh = ((index_signature, source_signatures), fresh)
+        return fresh
+
+    def _source(self):
+        """The (path, signature) to serve, looked up at most once every check_interval seconds."""
+        now = time.monotonic()
+        checked_at, source = self._checked
+        if checked_at is None or now - checked_at >= self.check_interval:
+            source = self._current_source()
+            self._checked = (now, source)
+        if source is None:
+            raise FileNotFoundError(f"No stats file found at {self.stats_file or self.index_file}.")
+        return source
+
+    def _load(self, path):
+        if path == self.index_file:
+            return IndexedRecords(path)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def stats(self):
+        """Return the loaded stats mapping, reloading it if the file has changed."""
+        path, signature = self._source()
+        if path == self._path and signature == self._signature:
+            return self._stats
+
+        with self._lock:
+            # Look again, so a thread that waited doesn't reload a file another thread has already seen replaced
+            path, signature = self._source()
+            if path == self._path and signature == self._signature:
+                return self._stats  # Reloaded by another thread while we waited
+
+            # Mapping an index costs far less than hashing it, so only the JSON file is hashed
+            digest = None if path == self.index_file else _digest_of(path, signature)
+            if digest is not None and path == self._path and digest == self._digest:
+                # Touched but not rewritten: keep what is already loaded
+                self._signature = signature
+                return self._stats
+
+            self._stats = self._load(path)
+            self._path = path
+            self._signature = signature
+            self._digest = digest
+            return self._stats
+
+    def get(self, user_id):
+        """Return the stats for one user, or None if the user has no data."""
+        return self.stats().get(user_id)
+
+    def get_raw(self, user_id):
+        """Return the undecoded record for one user from the index, or None."""
+        return self.stats().get_raw(user_id)
+
+
+_default_store = StatsStore()
+
+
+def get_user_stats(user_id):
+    return _default_store.get(user_id)
+
+
+if __name__ == "__main__":
+    stats_file = sys.argv[1] if len(sys.argv) > 1 else STATS_FILE
+    index_file = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(stats_file)[0] + ".idx"
+    count = build_index(stats_file, index_file)
+    print(f"Indexed {count} users into {index_file}")
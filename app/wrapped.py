@@ -1,5 +1,16 @@
 import json
+import os
 import random
+import re
+import sys
+
+from stats_query import get_top
+from stats_store import APP_DIR, STATS_FILE, StatsStore, get_user_stats, index_source, write_index
+
+MESSAGES_FILE = os.path.join(APP_DIR, "final_messages.idx")
+
+# Seeds each user's pick of title and closing line, so a user gets the same message every time
+RENDER_SEED = 2024
 
 title_choices = [
     "Hey <@USERID>! Here's your Slack Wrapped for 2024:",
@@ -48,39 +59,141 @@ def buddy_line_for(count):
 
     return "crossed paths"
 
-def get_wrapped(user_id):
-    stats_file = open('final_stats.json', 'r')
-    stats = json.load(stats_file)
-    stats_file.close()
-
-    if user_id not in stats:
+def get_wrapped(user_id, seed=RENDER_SEED):
+    stats = get_user_stats(user_id)
+    if stats is None:
         return None
-    
-    stats = stats[user_id]
+    return render_seeded(user_id, stats, seed)
+
+def render_seeded(user_id, stats, seed=RENDER_SEED):
+    """Build the Wrapped message for one user with the title and closing line picked for them by the seed."""
+    rng = random.Random(f"{seed}:{user_id}")
+    return render_wrapped(user_id, stats, rng.choice(title_choices), rng.choice(closing_line_choices))
 
-    title = random.choice(title_choices)
+def render_wrapped(user_id, stats, title, closing_line):
+    """Build the Wrapped message for one user's stats with the given title and closing line."""
     title = title.replace('<@USERID>', f'<@{user_id}>')
 
     message = f"{title}\n\n"
     message += f"You were in the top *{stats['threads_started_percentile']}%* of conversation starters, creating *{stats['threads_started']} threads*. {emoji_for(stats['threads_started_percentile'])} \n"
     message += f"You replied to other members *{stats['replies']} times*, putting you in the top *{stats['replies_percentile']}%* of repliers. {emoji_for(stats['replies_percentile'])} \n"
 
-    if stats['most_reactions_received'] != None:
-        if stats['most_reactions_received'][0][0] == stats['most_used_reaction'][0][0]:
+    if stats['most_reactions_received']:
+        if stats['most_used_reaction'] and stats['most_reactions_received'][0][0] == stats['most_used_reaction'][0][0]:
             message += f"\nYou're posts received a :{stats['most_reactions_received'][0][0]}: more than any other reaction, and you gave it right back, using it *{stats['most_used_reaction'][0][1]} times*!\n"
         else:
             message += f"\nYou're posts received a :{stats['most_reactions_received'][0][0]}: more than any other reaction.\n"
-            if stats['most_used_reaction'][0][0] != None:
+            if stats['most_used_reaction']:
                 message += f"But you preferred :{stats['most_used_reaction'][0][0]}: and used it *{stats['most_used_reaction'][0][1]} times*.\n"
 
     message += f"\nYour favorite channels to post in were: "
     for channel in stats['top_channels'][:3]:
         message += f"\n- #{channel[0]} ({channel[1]} posts)"
     
-    if stats['top_co_posters'][0][1] >= 5:
+    if stats['top_co_posters'] and stats['top_co_posters'][0][1] >= 5:
         message += f"\n\nYou and <@{stats['top_co_posters'][0][0]}> {buddy_line_for(stats['top_co_posters'][0][1])}, posting in the same thread *{stats['top_co_posters'][0][1]} times*.\n"
 
     message += f"\nAs far as engagement goes, your threads received a total of *{stats['engagement_received']} reactions & replies*, putting you in the top *{stats['engagement_received_percentile']}%*. {emoji_for(stats['engagement_received_percentile'])} \n"
     
-    message += f"\n{random.choice(closing_line_choices).replace('<@USERID>', f'<@{user_id}>')}\nThanks for being one of us! :sparkles:"
-    return message
\ No newline at end of file
+    message += f"\n{closing_line.replace('<@USERID>', f'<@{user_id}>')}\nThanks for being one of us! :sparkles:"
+    return message
+
+def no_data_text(user_id):
+    return f"Sorry, <@{user_id}>, we don't seem to have any data for you. :thinking_face: Maybe you weren't very active, or maybe we made a mistake somewhere."
+
+# /wrapped top <metric>, or /wrapped top posts #channel: metric name -> (ranked metric, leaderboard title, unit)
+top_metrics = {
+    "threads": ("threads_started", "Top conversation starters", "threads"),
+    "replies": ("replies", "Top repliers", "replies"),
+    "engagement": ("engagement_received", "Most engagement received", "reactions & replies"),
+    "posts": ("posts", "Top posters", "posts"),
+}
+
+TOP_COUNT = 10
+
+# Slack escapes channel mentions as <#C0123|name> when the command asks for it
+CHANNEL_MENTION = re.compile(r"^<#\w+\|([^>]*)>$")
+
+def top_usage_text():
+    workspace_metrics = '|'.join(name for name, (metric, _, _) in top_metrics.items() if metric != "posts")
+    return f"Try `/wrapped top <{workspace_metrics}>` or `/wrapped top posts #channel`, e.g. `/wrapped top replies`."
+
+def render_top(title, unit, entries, channel=None):
+    """Build the leaderboard message for (user ID, value) pairs."""
+    message = f"*{title}{f' in #{channel}' if channel else ''}*\n"
+    for rank, (user_id, value) in enumerate(entries, 1):
+        message += f"\n{rank}. <@{user_id}> ({value} {unit})"
+    return message
+
+def get_top_response(text):
+    """Return the JSON body for a `top` subcommand, or None if the text isn't one."""
+    words = text.split()
+    if not words or words[0].lower() != "top":
+        return None
+    if len(words) not in (2, 3) or words[1].lower() not in top_metrics:
+        return json.dumps(response_payload(top_usage_text()))
+
+    metric, title, unit = top_metrics[words[1].lower()]
+    channel = None
+    if (len(words) == 3) != (metric == "posts"):  # Only posts are ranked per channel, and only per channel
+        return json.dumps(response_payload(top_usage_text()))
+    if len(words) == 3:
+        mention = CHANNEL_MENTION.match(words[2])
+        channel = mention.group(1) if mention else words[2].lstrip("#")
+
+    entries = get_top(metric, TOP_COUNT, channel)
+    if not entries:
+        return json.dumps(response_payload(f"No leaderboard for {f'#{channel}' if channel else words[1]} yet. :thinking_face:"))
+    return json.dumps(response_payload(render_top(title, unit, entries, channel)))
+
+def response_payload(text):
+    """The ephemeral slash command response showing a message."""
+    return {
+        "response_type": "ephemeral",
+        "blocks": [
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": text
+                }
+            }
+        ]
+    }
+
+def render_messages(stats_file=STATS_FILE, messages_file=MESSAGES_FILE, seed=RENDER_SEED):
+    """Pre-render every user's response payload into an index file served by get_wrapped_response.
+
+    Messages are rendered by render_seeded, so re-rendering the same stats gives
+    the same file, and the same payloads get_wrapped_response renders without it.
+    """
+    source = index_source(stats_file)
+    with open(stats_file, "r", encoding="utf-8") as f:
+        stats = json.load(f)
+
+    def records():
+        for user_id, user_stats in stats.items():
+            message = render_seeded(user_id, user_stats, seed)
+            yield user_id, json.dumps(response_payload(message), separators=(",", ":")).encode("utf-8")
+
+    return write_index(records(), messages_file, [source])
+
+_messages_store = StatsStore(stats_file=None, index_file=MESSAGES_FILE, source_files=[STATS_FILE])
+
+def get_wrapped_response(user_id):
+    """Return the JSON body of a user's response, or None if they have no data.
+
+    Served straight from final_messages.idx when it exists and was rendered from the
+    current final_stats.json; otherwise the same message is rendered now.
+    """
+    try:
+        return _messages_store.get_raw(user_id)
+    except FileNotFoundError:
+        wrapped = get_wrapped(user_id)
+        return None if wrapped is None else json.dumps(response_payload(wrapped))
+
+if __name__ == "__main__":
+    stats_file = sys.argv[1] if len(sys.argv) > 1 else STATS_FILE
+    messages_file = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.dirname(os.path.abspath(stats_file)), "final_messages.idx")
+    count = render_messages(stats_file, messages_file)
+    print(f"Rendered messages for {count} users into {messages_file}")
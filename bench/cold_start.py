@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "app")
+
+# Modules that must never load in the function worker
+FORBIDDEN_MODULES = ("numpy", "scipy", "pandas")
+
+# Runs in a fresh interpreter with the app directory as its working directory
+PROBE = """
+import asyncio, json, os, sys, time
+start = time.perf_counter()
+import azure.functions as func
+azure_done = time.perf_counter()
+import stats_store, wrapped
+stats_file, messages_file = sys.argv[1], sys.argv[2]
+index_file = os.path.splitext(stats_file)[0] + ".idx"
+stats_store._default_store = stats_store.StatsStore(stats_file, index_file)
+wrapped._messages_store = stats_store.StatsStore(None, messages_file, source_files=[stats_file])
+import function_app
+import_done = time.perf_counter()
+
+def call(user_id):
+    req = func.HttpRequest(method="POST", url="/api/slack_command", body=f"user_id={user_id}".encode("utf-8"))
+    started = time.perf_counter()
+    response = asyncio.run(function_app.slack_command(req))
+    assert response.status_code == 200
+    return time.perf_counter() - started
+
+first = call(sys.argv[3])
+second = call(sys.argv[3])
+print(json.dumps({
+    "azure_functions_ms": (azure_done - start) * 1000,
+    "app_import_ms": (import_done - azure_done) * 1000,
+    "first_request_ms": first * 1000,
+    "warm_request_ms": second * 1000,
+    "forbidden_modules": [name for name in sys.argv[4:] if name in sys.modules],
+}))
+"""
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def slowest_imports(count=10):
+    """Modules imported by function_app (beyond azure.functions itself) with the largest self time, via -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import azure.functions; import function_app"],
+        cwd=APP_DIR, capture_output=True, text=True, check=True,
+    )
+    after_azure = result.stderr.split("| azure.functions\n", 1)[-1]
+    imports = []
+    for match in IMPORTTIME_LINE.finditer(after_azure):
+        self_us, cumulative_us, _, name = match.groups()
+        imports.append({"module": name, "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    return sorted(imports, key=lambda item: -item["self_ms"])[:count]
+
+
+def cold_start_report(stats_file, messages_file=None, user_id=None, runs=5):
+    """Measure import and first-request times of the function in `runs` fresh interpreters."""
+    stats_file = os.path.abspath(stats_file)
+    if user_id is None:
+        with open(stats_file, "r", encoding="utf-8") as f:
+            user_id = next(iter(json.load(f)), "UNKNOWN")
+    messages_file = os.path.abspath(messages_file) if messages_file else os.path.join(tempfile.gettempdir(), "no-final-messages.idx")
+
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE, stats_file, messages_file, user_id, *FORBIDDEN_MODULES],
+            cwd=APP_DIR, capture_output=True, text=True, check=True,
+        )
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    report = {
+        key: statistics.median(sample[key] for sample in samples)
+        for key in ("azure_functions_ms", "app_import_ms", "first_request_ms", "warm_request_ms")
+    }
+    report["cold_start_ms"] = report["app_import_ms"] + report["first_request_ms"]
+    report["forbidden_modules"] = sorted({name for sample in samples for name in sample["forbidden_modules"]})
+    report["slowest_imports"] = slowest_imports()
+    report["runs"] = runs
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report the function's import time and first-request latency, failing on regressions."
+    )
+    parser.add_argument("stats_file", help="final_stats.json to serve (final_stats.idx next to it is used if present)")
+    parser.add_argument("--messages", help="pre-rendered final_messages.idx to serve")
+    parser.add_argument("--user", help="user ID to request (default: the first user in the stats)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, help="fail if app import + first request takes longer (median)")
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    report = cold_start_report(args.stats_file, args.messages, args.user, args.runs)
+    print(f"azure.functions import  {report['azure_functions_ms']:8.1f} ms (paid by the worker either way)")
+    print(f"app import              {report['app_import_ms']:8.1f} ms")
+    print(f"first request           {report['first_request_ms']:8.1f} ms")
+    print(f"warm request            {report['warm_request_ms']:8.1f} ms")
+    print(f"cold start (app)        {report['cold_start_ms']:8.1f} ms, median of {report['runs']} runs")
+    print("slowest imports after azure.functions:")
+    for item in report["slowest_imports"]:
+        print(f"  {item['module']:<40} {item['self_ms']:7.2f} ms self  {item['cumulative_ms']:7.2f} ms total")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if report["forbidden_modules"]:
+        failures.append(f"loaded {', '.join(report['forbidden_modules'])} on the request path")
+    if args.budget_ms is not None and report["cold_start_ms"] > args.budget_ms:
+        failures.append(f"cold start {report['cold_start_ms']:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+    if failures:
+        sys.exit("FAIL: " + "; ".join(failures))
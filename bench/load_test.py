@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import http.client
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from http import HTTPStatus
+from urllib.parse import urlencode
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "app")
+
+# Subcommands mixed into the burst (/wrapped top ...)
+TOP_COMMANDS = ("top replies", "top threads", "top engagement")
+
+# The text of the acknowledgement sent when a lookup misses INLINE_DEADLINE
+ACKNOWLEDGEMENT = b"Wrapping up your year"
+
+
+def slack_payloads(user_ids, count, top_share=0.05, unknown_share=0.05, seed=0):
+    """Form-encoded /wrapped payloads as Slack sends them, for random users (some of them without stats)."""
+    rng = random.Random(seed)
+    team_id = "T0000000001"
+    payloads = []
+    for number in range(count):
+        if user_ids and rng.random() >= unknown_share:
+            user_id = rng.choice(user_ids)
+        else:
+            user_id = f"U{rng.randrange(10**9):09d}X"
+        payloads.append(urlencode({
+            "token": "gIkuvaNzQIHg97ATvDxqgjtO",
+            "team_id": team_id,
+            "team_domain": "example",
+            "channel_id": f"C{rng.randrange(10**8):08d}",
+            "channel_name": "general",
+            "user_id": user_id,
+            "user_name": user_id.lower(),
+            "command": "/wrapped",
+            "text": rng.choice(TOP_COMMANDS) if rng.random() < top_share else "",
+            "api_app_id": "A0000000001",
+            "is_enterprise_install": "false",
+            "response_url": f"https://hooks.slack.com/commands/{team_id}/{number}/{rng.getrandbits(64):016x}",
+            "trigger_id": f"{number}.{rng.getrandbits(40)}.{rng.getrandbits(64):016x}",
+        }).encode("utf-8"))
+    return payloads
+
+
+def load_payloads(payloads_file, count):
+    """Captured payloads, one form-encoded body per line, repeated up to count."""
+    with open(payloads_file, "rb") as f:
+        bodies = [line.strip() for line in f if line.strip()]
+    return [bodies[number % len(bodies)] for number in range(count)]
+
+
+class StubTransport:
+    """Stands in for Slack's response_url endpoint, counting the follow-ups instead of sending them."""
+
+    def __init__(self):
+        self.posts = 0
+
+    async def post_json(self, url, payload):
+        self.posts += 1
+        return 200, {}, b"ok"
+
+
+def setup_app(stats_file, messages_file=None):
+    """Import the function app and point it at the given stats, with follow-ups going to a StubTransport."""
+    sys.path.insert(0, APP_DIR)
+    import stats_query
+    import stats_store
+    import wrapped
+    import function_app
+    from slack_http import ResponseUrlClient
+
+    logging.getLogger().addHandler(logging.NullHandler())  # keep the handler's log calls, drop the output
+    stats_file = os.path.abspath(stats_file)
+    stats_dir = os.path.dirname(stats_file)
+    stats_store._default_store = stats_store.StatsStore(stats_file, os.path.join(stats_dir, "final_stats.idx"))
+    stats_query._default_query = stats_query.StatsQuery(
+        stats_file, os.path.join(stats_dir, "final_query.idx"), os.path.join(stats_dir, "channel_posts.json")
+    )
+    messages_file = os.path.abspath(messages_file) if messages_file else os.path.join(stats_dir, "final_messages.idx")
+    wrapped._messages_store = stats_store.StatsStore(None, messages_file, source_files=[stats_file])
+    transport = StubTransport()
+    function_app.response_client = ResponseUrlClient(transport=transport)
+    return function_app, transport
+
+
+def _percentile(sorted_values, percent):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+
+def summarize(mode, latencies, wall, outcomes, concurrency, follow_ups):
+    latencies = sorted(latencies)
+    summary = {
+        "mode": mode,
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "wall_s": wall,
+        "requests_per_s": len(latencies) / wall if wall else None,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+    for percent in (50, 90, 99, 99.9):
+        summary[f"p{percent:g}_ms"] = _percentile(latencies, percent) * 1000
+    summary["max_ms"] = latencies[-1] * 1000
+    summary["outcomes"] = dict(outcomes)
+    summary["follow_ups"] = follow_ups
+    return summary
+
+
+def _outcome(status, body):
+    if status != 200:
+        return str(status)
+    return "acknowledged" if ACKNOWLEDGEMENT in body else "ok"
+
+
+async def _burst_in_process(function_app, bodies, concurrency):
+    import azure.functions as func
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    outcomes = Counter()
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+    async def invoke(body):
+        async with semaphore:
+            req = func.HttpRequest(method="POST", url="/api/slack_command", body=body, headers=headers)
+            start = time.perf_counter()
+            response = await function_app.slack_command(req)
+            latencies.append(time.perf_counter() - start)
+            outcomes[_outcome(response.status_code, response.get_body())] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(invoke(body) for body in bodies))
+    wall = time.perf_counter() - start
+    await asyncio.gather(*list(function_app._follow_ups))
+    return latencies, wall, outcomes
+
+
+def run_in_process(stats_file, bodies, concurrency, messages_file=None):
+    """Fire the payloads at slack_command on one event loop, at most `concurrency` in flight."""
+    function_app, transport = setup_app(stats_file, messages_file)
+    latencies, wall, outcomes = asyncio.run(_burst_in_process(function_app, bodies, concurrency))
+    return summarize("in-process", latencies, wall, outcomes, concurrency, transport.posts)
+
+
+async def _serve(function_app, transport):
+    """A minimal HTTP/1.1 stand-in for the Functions host, routing POSTs to slack_command on one event loop."""
+    import azure.functions as func
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if target == "/follow-ups":
+                    status, mimetype, data = 200, "application/json", json.dumps(transport.posts).encode("utf-8")
+                else:
+                    req = func.HttpRequest(method=method, url=target, body=body, headers=headers)
+                    response = await function_app.slack_command(req)
+                    status, mimetype, data = response.status_code, response.mimetype or "text/plain", response.get_body()
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                    f"Content-Type: {mimetype}\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0, backlog=1024)
+    print(server.sockets[0].getsockname()[1], flush=True)
+    # Serve until the parent closes our stdin
+    await asyncio.get_running_loop().run_in_executor(None, sys.stdin.read)
+    server.close()
+
+
+def run_http(stats_file, bodies, concurrency, messages_file=None):
+    """Serve the handler from a stand-in HTTP server in a child process and send it the payloads from `concurrency` connections."""
+    command = [sys.executable, os.path.abspath(__file__), stats_file, "--serve"]
+    if messages_file:
+        command += ["--messages", messages_file]
+    server = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(server.stdout.readline())
+        pending = iter(bodies)
+        lock = threading.Lock()
+        latencies = []
+        outcomes = Counter()
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+        def client():
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            try:
+                while True:
+                    with lock:
+                        body = next(pending, None)
+                    if body is None:
+                        return
+                    start = time.perf_counter()
+                    connection.request("POST", "/api/slack_command", body, headers)
+                    response = connection.getresponse()
+                    data = response.read()
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        latencies.append(elapsed)
+                        outcomes[_outcome(response.status, data)] += 1
+            finally:
+                connection.close()
+
+        clients = [threading.Thread(target=client) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        wall = time.perf_counter() - start
+
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        connection.request("GET", "/follow-ups")
+        follow_ups = json.loads(connection.getresponse().read())
+        connection.close()
+    finally:
+        server.stdin.close()
+        server.wait()
+    return summarize("http", latencies, wall, outcomes, concurrency, follow_ups)
+
+
+def format_summary(summary):
+    return (
+        f"{summary['mode']:<11} {summary['requests']} requests, {summary['concurrency']} in flight: "
+        f"{summary['requests_per_s']:.0f} req/s, p50 {summary['p50_ms']:.2f} ms, p90 {summary['p90_ms']:.2f} ms, "
+        f"p99 {summary['p99_ms']:.2f} ms, p99.9 {summary['p99.9_ms']:.2f} ms, max {summary['max_ms']:.2f} ms; "
+        f"{', '.join(f'{outcome} {count}' for outcome, count in sorted(summary['outcomes'].items()))}; "
+        f"{summary['follow_ups']} follow-ups"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay a burst of /wrapped slash commands against slack_command and report throughput and tail latency."
+    )
+    parser.add_argument("stats_file", help="final_stats.json to serve (final_stats.idx and final_query.idx next to it are used if present)")
+    parser.add_argument("--messages", help="pre-rendered final_messages.idx to serve")
+    parser.add_argument("--mode", choices=("in-process", "http", "both"), default="both")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100, help="requests in flight at once")
+    parser.add_argument("--payloads", help="replay these form-encoded bodies (one per line) instead of generated ones")
+    parser.add_argument("--top-share", type=float, default=0.05, help="share of generated requests that are /wrapped top")
+    parser.add_argument("--unknown-share", type=float, default=0.05, help="share of generated requests from users without stats")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--budget-ms", type=float, help="fail if any mode's p99 latency is over this")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        asyncio.run(_serve(*setup_app(args.stats_file, args.messages)))
+        sys.exit()
+
+    if args.payloads:
+        bodies = load_payloads(args.payloads, args.requests)
+    else:
+        with open(args.stats_file, "r", encoding="utf-8") as f:
+            user_ids = list(json.load(f))
+        bodies = slack_payloads(user_ids, args.requests, args.top_share, args.unknown_share, args.seed)
+
+    results = []
+    if args.mode in ("in-process", "both"):
+        results.append(run_in_process(args.stats_file, bodies, args.concurrency, args.messages))
+        print(format_summary(results[-1]))
+    if args.mode in ("http", "both"):
+        results.append(run_http(args.stats_file, bodies, args.concurrency, args.messages))
+        print(format_summary(results[-1]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    over = [result["mode"] for result in results if args.budget_ms is not None and result["p99_ms"] > args.budget_ms]
+    if over:
+        sys.exit(f"FAIL: p99 latency over the {args.budget_ms:.0f} ms budget ({', '.join(over)})")
@@ -0,0 +1,172 @@
+import argparse
+import bisect
+import itertools
+import json
+import random
+import zipfile
+from datetime import datetime, timedelta, timezone
+
+EMOJI = [
+    "+1", "heart", "joy", "tada", "eyes", "pray", "fire", "white_check_mark", "raised_hands", "100",
+    "rocket", "thinking_face", "clap", "laughing", "muscle", "sob", "star-struck", "wave", "sparkles", "ok_hand",
+]
+
+# Zipf-like popularity: the first emoji is the most common
+EMOJI_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(EMOJI) + 1)))
+
+# Fixed timestamp for every zip member, so the same settings always produce the same bytes
+ZIP_DATE = (2025, 1, 1, 0, 0, 0)
+
+
+def _weights(rng, count, shape):
+    """Heavy-tailed (Pareto) activity weights as cumulative sums, for bisect sampling."""
+    return list(itertools.accumulate(rng.paretovariate(shape) for _ in range(count)))
+
+
+def _pick(rng, cum_weights):
+    return bisect.bisect(cum_weights, rng.random() * cum_weights[-1], 0, len(cum_weights) - 1)
+
+
+def _filler(rng, user_id):
+    """Payload the stats never read but real exports are full of."""
+    words = " ".join(rng.choice(("the", "deploy", "ticket", "lunch", "meeting", "ship", "bug", "idea")) for _ in range(rng.randint(3, 40)))
+    return {
+        "text": words,
+        "blocks": [
+            {
+                "type": "rich_text",
+                "block_id": f"b{rng.getrandbits(24):06x}",
+                "elements": [{"type": "rich_text_section", "elements": [{"type": "text", "text": words}]}],
+            }
+        ],
+        "user_profile": {"real_name": f"User {user_id}", "display_name": user_id.lower(), "image_72": f"https://avatars.example.com/{user_id}_72.png"},
+    }
+
+
+def _reactions(rng, users, user_weights, density):
+    if rng.random() >= density:
+        return None
+    names = {EMOJI[_pick(rng, EMOJI_WEIGHTS)] for _ in range(1 + min(int(rng.expovariate(1.5)), 4))}
+    reactions = []
+    for name in sorted(names, key=EMOJI.index):
+        reactors = {users[_pick(rng, user_weights)]["id"] for _ in range(1 + int(rng.expovariate(0.4)))}
+        reactions.append({"name": name, "users": sorted(reactors), "count": len(reactors)})
+    return reactions
+
+
+def _message(rng, ts, user_id, thread_ts, reactions, with_payload):
+    message = {"type": "message", "ts": ts}
+    if user_id is None:
+        message.update(subtype="bot_message", bot_id="B0000BOT", username="deploy-bot")
+    else:
+        message["user"] = user_id
+    if thread_ts is not None:
+        message["thread_ts"] = thread_ts
+    if reactions:
+        message["reactions"] = reactions
+    if with_payload:
+        message.update(_filler(rng, user_id or "B0000BOT"))
+    return message
+
+
+def make_export(
+    path,
+    users=500,
+    channels=40,
+    days=365,
+    messages_per_day=400,
+    thread_rate=0.35,
+    thread_fanout=4.0,
+    busy_thread_rate=0.002,
+    busy_thread_size=400,
+    reaction_density=0.3,
+    bot_rate=0.02,
+    payload=True,
+    start=datetime(2024, 1, 1, tzinfo=timezone.utc),
+    seed=2024,
+):
+    """Write a synthetic Slack export zip and return the number of messages in it.
+
+    User and channel activity follow Pareto distributions, thread sizes are
+    geometric around `thread_fanout` with a `busy_thread_rate` share of
+    heavy-tailed threads of up to `busy_thread_size` replies, and replies can
+    land on later days than their parent, as in real exports.
+    """
+    rng = random.Random(seed)
+    user_list = [{"id": f"U{index:08X}", "name": f"user{index}", "real_name": f"User {index}"} for index in range(users)]
+    channel_list = [{"id": f"C{index:08X}", "name": f"channel-{index}", "created": int(start.timestamp())} for index in range(channels)]
+    user_weights = _weights(rng, users, 1.2)
+    channel_weights = _weights(rng, channels, 1.1)
+
+    # Spread the daily volume over channels by popularity
+    daily = [0] * channels
+    for _ in range(messages_per_day):
+        daily[_pick(rng, channel_weights)] += 1
+
+    total = 0
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        def write(name, data):
+            zip_ref.writestr(zipfile.ZipInfo(name, ZIP_DATE), json.dumps(data, indent=4), zipfile.ZIP_DEFLATED)
+
+        write("users.json", user_list)
+        write("channels.json", channel_list)
+
+        for channel, mean_messages in zip(channel_list, daily):
+            by_day = {}
+            for day in range(days):
+                day_start = start + timedelta(days=day)
+                for _ in range(int(rng.expovariate(1 / mean_messages)) if mean_messages else 0):
+                    posted = day_start + timedelta(seconds=rng.uniform(0, 86400))
+                    ts = f"{posted.timestamp():.6f}"
+                    author = None if rng.random() < bot_rate else user_list[_pick(rng, user_weights)]["id"]
+
+                    replies = 0
+                    if rng.random() < thread_rate:
+                        if rng.random() < busy_thread_rate:
+                            replies = min(int(rng.paretovariate(1.1) * 20), busy_thread_size)
+                        else:
+                            replies = 1 + int(rng.expovariate(1 / thread_fanout))
+                    reactions = _reactions(rng, user_list, user_weights, reaction_density)
+                    by_day.setdefault(day, []).append(
+                        (ts, _message(rng, ts, author, ts if replies else None, reactions, payload))
+                    )
+
+                    reply_time = posted
+                    for _ in range(replies):
+                        reply_time += timedelta(seconds=rng.expovariate(1 / 900))
+                        reply_day = (reply_time - start).days
+                        if reply_day >= days:
+                            break
+                        reply_ts = f"{reply_time.timestamp():.6f}"
+                        replier = user_list[_pick(rng, user_weights)]["id"]
+                        reactions = _reactions(rng, user_list, user_weights, reaction_density / 2)
+                        by_day.setdefault(reply_day, []).append(
+                            (reply_ts, _message(rng, reply_ts, replier, ts, reactions, payload))
+                        )
+
+            for day in sorted(by_day):
+                messages = [message for _, message in sorted(by_day[day], key=lambda item: float(item[0]))]
+                write(f"{channel['name']}/{(start + timedelta(days=day)):%Y-%m-%d}.json", messages)
+                total += len(messages)
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic Slack export zip for benchmarking.")
+    parser.add_argument("path", help="zip file to write")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--channels", type=int, default=40)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--messages-per-day", type=int, default=400, help="top-level messages per day across all channels")
+    parser.add_argument("--thread-rate", type=float, default=0.35, help="share of top-level messages that get replies")
+    parser.add_argument("--thread-fanout", type=float, default=4.0, help="mean replies per ordinary thread")
+    parser.add_argument("--busy-thread-rate", type=float, default=0.002, help="share of threads that are heavy-tailed")
+    parser.add_argument("--busy-thread-size", type=int, default=400, help="reply cap for busy threads")
+    parser.add_argument("--reaction-density", type=float, default=0.3, help="share of top-level messages with reactions")
+    parser.add_argument("--bot-rate", type=float, default=0.02, help="share of top-level messages posted by a bot")
+    parser.add_argument("--no-payload", dest="payload", action="store_false", help="leave out text/blocks/profile payloads")
+    parser.add_argument("--seed", type=int, default=2024)
+    args = vars(parser.parse_args())
+    path = args.pop("path")
+    count = make_export(path, **args)
+    print(f"Wrote {count} messages to {path}")
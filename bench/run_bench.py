@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+PREP_DIR = os.path.join(REPO_DIR, "prep")
+APP_DIR = os.path.join(REPO_DIR, "app")
+
+# Pipeline stages in run order, with the stage whose output each one reads
+STAGES = {
+    "base_stats": None,
+    "percentiles": "base_stats",
+    "wrapped_reports": None,
+    "top_contributors": None,
+    "slack_command": "percentiles",
+}
+
+
+def _peak_rss_mb():
+    """Peak RSS of this process or any of its (pool worker) children, in MB."""
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # bytes on macOS, KB elsewhere
+    return max(self_rss, children_rss) / scale
+
+
+def _percentile(sorted_values, percent):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+
+def _slack_command_stage(work_dir, options):
+    sys.path.insert(0, APP_DIR)
+    import_start = time.perf_counter()
+    import azure.functions as func
+    import stats_store
+    import wrapped
+    import function_app
+    import_ms = (time.perf_counter() - import_start) * 1000
+    logging.getLogger().addHandler(logging.NullHandler())  # keep the handler's log calls, drop the output
+    from load_test import StubTransport
+    from slack_http import ResponseUrlClient
+
+    # Lookups that miss the deadline are acknowledged; their follow-ups are counted, not sent to Slack
+    transport = StubTransport()
+    function_app.response_client = ResponseUrlClient(transport=transport)
+
+    stats_file = os.path.join(work_dir, "final_stats.json")
+    index_file = os.path.join(work_dir, "final_stats.idx")
+    messages_file = os.path.join(work_dir, "final_messages.idx")
+    if options["index"]:
+        stats_store.build_index(stats_file, index_file)
+    if options["prerender"]:
+        wrapped.render_messages(stats_file, messages_file)
+    stats_store._default_store = stats_store.StatsStore(stats_file, index_file)
+    wrapped._messages_store = stats_store.StatsStore(None, messages_file, source_files=[stats_file])
+
+    with open(stats_file, "r", encoding="utf-8") as f:
+        user_ids = list(json.load(f))
+    rng = random.Random(options["seed"])
+    loop = asyncio.new_event_loop()
+
+    def request(user_id):
+        body = f"user_id={user_id}&command=%2Fwrapped&response_url=https%3A%2F%2Fhooks.slack.com%2Fx".encode("utf-8")
+        req = func.HttpRequest(method="POST", url="/api/slack_command", body=body)
+        start = time.perf_counter()
+        response = function_app.slack_command(req)
+        if inspect.isawaitable(response):
+            response = loop.run_until_complete(response)
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise RuntimeError(f"slack_command returned {response.status_code} for {user_id}")
+        return elapsed
+
+    def next_user():
+        # Mostly known users, with some who have no stats
+        return rng.choice(user_ids) if user_ids and rng.random() < 0.95 else f"UNKNOWN{rng.randrange(10**6)}"
+
+    cold_ms = request(next_user()) * 1000
+    start = time.perf_counter()
+    latencies = sorted(request(next_user()) for _ in range(options["requests"]))
+    wall = time.perf_counter() - start
+
+    async def drain_follow_ups():
+        await asyncio.gather(*list(function_app._follow_ups))
+
+    loop.run_until_complete(drain_follow_ups())
+    return {
+        "wall_s": wall,
+        "items": len(latencies),
+        "unit": "requests",
+        "import_ms": import_ms,
+        "cold_request_ms": cold_ms,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "follow_ups": transport.posts,
+    }
+
+
+def run_stage(stage, zip_file_path, work_dir, options):
+    """Run one stage in this process (a fresh interpreter per stage) and return its measurements."""
+    os.chdir(work_dir)
+    if stage == "slack_command":
+        return _slack_command_stage(work_dir, options)
+
+    sys.path.insert(0, PREP_DIR)
+    import prep_stats
+
+    start = time.perf_counter()
+    if stage == "base_stats":
+        prep_stats.calculate_base_stats(zip_file_path, [], options["workers"])
+    elif stage == "percentiles":
+        prep_stats.calculate_percentiles("base_stats.json", [])
+    elif stage == "wrapped_reports":
+        prep_stats.generate_wrapped_reports(zip_file_path)
+    elif stage == "top_contributors":
+        prep_stats.find_top_contributors(zip_file_path)
+    wall = time.perf_counter() - start
+
+    if stage == "percentiles":
+        with open("final_stats.json", "r", encoding="utf-8") as f:
+            return {"wall_s": wall, "items": len(json.load(f)), "unit": "users"}
+    return {"wall_s": wall, "items": options["messages"], "unit": "messages"}
+
+
+def _child_main(stage, zip_file_path, work_dir, options_json):
+    result = run_stage(stage, zip_file_path, work_dir, json.loads(options_json))
+    result["peak_rss_mb"] = _peak_rss_mb()
+    with open(os.path.join(work_dir, f"{stage}.result.json"), "w") as f:
+        json.dump(result, f)
+
+
+def _count_messages(zip_file_path):
+    sys.path.insert(0, PREP_DIR)
+    from slack_export import SlackExport
+
+    with SlackExport(zip_file_path) as export:
+        return sum(len(messages) for _, _, messages in export.iter_messages(fields=("ts",)))
+
+
+def _git_revision():
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ("-dirty" if dirty else "")
+
+
+def _with_prerequisites(stages):
+    selected = set()
+    for stage in stages:
+        while stage and stage not in selected:
+            selected.add(stage)
+            stage = STAGES[stage]
+    return [stage for stage in STAGES if stage in selected]
+
+
+def run_benchmarks(zip_file_path, stages=tuple(STAGES), repeat=1, workers=1, requests=2000, index=False, prerender=False, seed=0):
+    """Run each stage in a fresh interpreter `repeat` times and keep the fastest run of each."""
+    zip_file_path = os.path.abspath(zip_file_path)
+    options = {
+        "workers": workers,
+        "requests": requests,
+        "index": index,
+        "prerender": prerender,
+        "seed": seed,
+        "messages": _count_messages(zip_file_path),
+    }
+    results = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+        "export": {"path": zip_file_path, "bytes": os.path.getsize(zip_file_path), "messages": options["messages"]},
+        "options": {key: value for key, value in options.items() if key != "messages"},
+        "stages": {},
+    }
+
+    for _ in range(repeat):
+        work_dir = tempfile.mkdtemp(prefix="slack-wrapped-bench-")
+        try:
+            for stage in _with_prerequisites(stages):
+                subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--child", stage, zip_file_path, work_dir, json.dumps(options)],
+                    check=True,
+                    stdout=subprocess.DEVNULL,
+                )
+                with open(os.path.join(work_dir, f"{stage}.result.json")) as f:
+                    result = json.load(f)
+                result["per_sec"] = result["items"] / result["wall_s"] if result["wall_s"] else None
+                best = results["stages"].get(stage)
+                if best is None or result["wall_s"] < best["wall_s"]:
+                    results["stages"][stage] = result
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def format_results(results, baseline=None):
+    lines = [f"revision {results['revision']}, Python {results['python']}, {results['machine']}"]
+    lines.append(f"export {results['export']['path']}: {results['export']['messages']} messages")
+    for stage, result in results["stages"].items():
+        line = (
+            f"{stage:<17} {result['wall_s']:8.3f}s  {result['peak_rss_mb']:7.1f} MB peak  "
+            f"{result['per_sec'] or 0:12.0f} {result['unit']}/s"
+        )
+        if stage == "slack_command":
+            line += f"  p50 {result['p50_ms']:.3f} ms  p99 {result['p99_ms']:.3f} ms  import {result['import_ms']:.0f} ms"
+            line += f"  {result['follow_ups']} follow-ups"
+        if baseline and stage in baseline["stages"]:
+            line += f"  ({result['wall_s'] / baseline['stages'][stage]['wall_s']:.2f}x time vs {baseline['revision']})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        _child_main(*sys.argv[2:6])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmark the prep pipeline and the slash command handler.")
+    parser.add_argument("zip_file_path", help="export to benchmark, e.g. one written by make_export.py")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage; the fastest is kept")
+    parser.add_argument("--workers", type=int, default=1, help="workers for calculate_base_stats")
+    parser.add_argument("--requests", type=int, default=2000, help="slack_command requests to time")
+    parser.add_argument("--index", action="store_true", help="serve slack_command from a final_stats.idx index")
+    parser.add_argument("--prerender", action="store_true", help="serve slack_command from pre-rendered final_messages.idx")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON, to compare later runs against")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.zip_file_path, args.stages, args.repeat, args.workers, args.requests, args.index, args.prerender, args.seed)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(format_results(results, baseline))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,429 @@
+from array import array
+from itertools import groupby
+
+import numpy as np
+
+from cooccurrence import CoPosterCounter
+
+KEY_BITS = 32
+KEY_MASK = (1 << KEY_BITS) - 1
+
+# Buffered histogram events before they are folded into the sorted columns
+COMPACT_EVENTS = 1 << 18
+
+# Rows ranked at a time when listing each user's top keys
+TOP_ROWS_PER_CHUNK = 1 << 16
+
+# Activity histograms: messages per month of the year, weekday (Monday first)
+# and hour of the day, counted in UTC shifted by ACTIVITY_UTC_OFFSET seconds
+ACTIVITY_BUCKETS = {"month": 12, "weekday": 7, "hour": 24}
+ACTIVITY_UTC_OFFSET = 0
+
+
+class Interner:
+    """Map strings to dense integer IDs, in first-seen order."""
+
+    def __init__(self, values=()):
+        self.ids = {}
+        self.values = []
+        for value in values:
+            self.intern(value)
+
+    def intern(self, value):
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def __len__(self):
+        return len(self.values)
+
+
+class SparseCounts:
+    """A per-user histogram stored as sorted (user << 32 | key, count, first_seen) columns.
+
+    add() only appends to flat buffers; they are folded into the columns in
+    batches. first_seen is the number of the event that created each pair, so
+    iter_top() breaks ties exactly like Counter.most_common on counters filled in
+    the same order.
+    """
+
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.first_seen = np.empty(0, dtype=np.int64)
+        self.events = 0
+        self._pending_keys = array("Q")
+        self._pending_amounts = array("q")
+        self._batches = []
+        self._batched = 0
+
+    def add(self, user_id, key_id, amount=1):
+        self._pending_keys.append(user_id << KEY_BITS | key_id)
+        self._pending_amounts.append(amount)
+
+    def add_events(self, user_ids, key_ids, amounts):
+        """add() a whole batch of events at once, numbered in array order (after any add() so far)."""
+        self._flush_pending()
+        keys = (np.asarray(user_ids).astype(np.uint64) << np.uint64(KEY_BITS)) | np.asarray(key_ids).astype(np.uint64)
+        self._queue(keys, np.asarray(amounts, dtype=np.int64), self.events + np.arange(len(keys), dtype=np.int64))
+        self.events += len(keys)
+        self.maybe_compact()
+
+    def _flush_pending(self):
+        """Number the buffered add() events in arrival order and queue them for folding."""
+        count = len(self._pending_keys)
+        if not count:
+            return
+        self._queue(
+            np.frombuffer(self._pending_keys, dtype=np.uint64),
+            np.frombuffer(self._pending_amounts, dtype=np.int64),
+            self.events + np.arange(count, dtype=np.int64),
+        )
+        self.events += count
+        self._pending_keys = array("Q")
+        self._pending_amounts = array("q")
+
+    def _queue(self, keys, counts, first_seen):
+        if not len(keys):
+            return  # compact() assumes every batch has rows
+        self._batches.append((keys, counts, first_seen))
+        self._batched += len(keys)
+
+    def maybe_compact(self):
+        if len(self._pending_keys) + self._batched >= COMPACT_EVENTS:
+            self.compact()
+
+    def compact(self):
+        self._flush_pending()
+        if not self._batches:
+            return
+        keys = np.concatenate([batch[0] for batch in self._batches])
+        counts = np.concatenate([batch[1] for batch in self._batches])
+        first_seen = np.concatenate([batch[2] for batch in self._batches])
+        self._batches = []
+        self._batched = 0
+
+        # Reduce the batch to one row per key
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        keys = keys[starts]
+        counts = np.add.reduceat(counts[order], starts)
+        first_seen = np.minimum.reduceat(first_seen[order], starts)
+
+        # Update rows that already exist in place and insert the rest, keeping the columns sorted
+        positions = np.searchsorted(self.keys, keys)
+        existing = positions < len(self.keys)
+        existing[existing] = self.keys[positions[existing]] == keys[existing]
+        rows = positions[existing]
+        self.counts[rows] += counts[existing]
+        self.first_seen[rows] = np.minimum(self.first_seen[rows], first_seen[existing])
+
+        added = ~existing
+        self.keys = np.insert(self.keys, positions[added], keys[added])
+        self.counts = np.insert(self.counts, positions[added], counts[added])
+        self.first_seen = np.insert(self.first_seen, positions[added], first_seen[added])
+
+    def merge(self, other, user_map, key_map):
+        """Add another histogram's counts after this one's, translating its IDs through the maps."""
+        self._flush_pending()
+        other.compact()
+        if len(other.keys):
+            users = user_map[(other.keys >> np.uint64(KEY_BITS)).astype(np.int64)]
+            keys = key_map[(other.keys & np.uint64(KEY_MASK)).astype(np.int64)]
+            packed = (users.astype(np.uint64) << np.uint64(KEY_BITS)) | keys.astype(np.uint64)
+            self._queue(packed, other.counts, other.first_seen + self.events)
+        self.events += other.events
+        self.maybe_compact()
+
+    def totals(self, user_count):
+        """Sum of counts per user ID."""
+        self.compact()
+        users = (self.keys >> np.uint64(KEY_BITS)).astype(np.int64)
+        return np.bincount(users, weights=self.counts, minlength=user_count).astype(np.int64)
+
+    def iter_top(self, count, names):
+        """Yield (user_id, [(name, count), ...]) with the `count` largest keys of each user, by user ID."""
+        self.compact()
+        start = 0
+        while start < len(self.keys):
+            end = self._user_boundary(start, start + TOP_ROWS_PER_CHUNK)
+            users = (self.keys[start:end] >> np.uint64(KEY_BITS)).astype(np.int64)
+            order = np.lexsort((self.first_seen[start:end], -self.counts[start:end], users))
+            users = users[order]
+            rank = np.arange(len(order)) - np.searchsorted(users, users, side="left")
+            order = order[rank < count] + start
+
+            rows = zip(self.keys[order].tolist(), self.counts[order].tolist())
+            for user_id, user_rows in groupby(rows, key=lambda row: row[0] >> KEY_BITS):
+                yield user_id, [(names[key & KEY_MASK], total) for key, total in user_rows]
+            start = end
+
+    def _user_boundary(self, start, end):
+        """First row at or after `end` that starts a new user (rows of one user are contiguous)."""
+        if end >= len(self.keys):
+            return len(self.keys)
+        user_id = int(self.keys[end]) >> KEY_BITS
+        boundary = int(np.searchsorted(self.keys, np.uint64(user_id << KEY_BITS)))
+        if boundary <= start:
+            boundary = int(np.searchsorted(self.keys, np.uint64((user_id + 1) << KEY_BITS)))
+        return boundary
+
+    def to_arrays(self, prefix):
+        self.compact()
+        return {
+            f"{prefix}_keys": self.keys,
+            f"{prefix}_counts": self.counts,
+            f"{prefix}_first_seen": self.first_seen,
+            f"{prefix}_events": np.array(self.events, dtype=np.int64),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        counts = cls()
+        counts.keys = arrays[f"{prefix}_keys"]
+        counts.counts = arrays[f"{prefix}_counts"]
+        counts.first_seen = arrays[f"{prefix}_first_seen"]
+        counts.events = int(arrays[f"{prefix}_events"])
+        return counts
+
+
+class ActivityHistograms:
+    """Posts per user and per channel by month, weekday and hour, as (users, 43) and (channels, 43) arrays.
+
+    add() only appends the IDs and ts to flat buffers; compact() buckets a
+    whole batch with integer arithmetic and adds it with bincount, so no
+    datetime objects are created and memory is fixed per user and channel.
+    """
+
+    WIDTH = sum(ACTIVITY_BUCKETS.values())
+
+    def __init__(self):
+        self.users = np.zeros((0, self.WIDTH), dtype=np.int64)
+        self.channels = np.zeros((0, self.WIDTH), dtype=np.int64)
+        self._pending_ids = array("q")  # user ID, channel ID, ...
+        self._pending_ts = array("d")
+
+    def add(self, user_id, channel_id, ts):
+        self._pending_ids.append(user_id)
+        self._pending_ids.append(channel_id)
+        self._pending_ts.append(float(ts))
+
+    def add_events(self, user_ids, channel_ids, seconds):
+        """add() for arrays of user IDs, channel IDs and whole epoch seconds."""
+        self._add(np.asarray(user_ids, dtype=np.int64), np.asarray(channel_ids, dtype=np.int64), np.asarray(seconds, dtype=np.int64))
+
+    def maybe_compact(self):
+        if len(self._pending_ts) >= COMPACT_EVENTS:
+            self.compact()
+
+    def compact(self):
+        if not len(self._pending_ts):
+            return
+        ids = np.frombuffer(self._pending_ids, dtype=np.int64).reshape(-1, 2)
+        seconds = np.floor(np.frombuffer(self._pending_ts, dtype=np.float64)).astype(np.int64)
+        self._pending_ids = array("q")
+        self._pending_ts = array("d")
+        self._add(ids[:, 0], ids[:, 1], seconds)
+
+    def _add(self, user_ids, channel_ids, seconds):
+        if not len(seconds):
+            return
+        seconds = seconds + ACTIVITY_UTC_OFFSET
+        columns = np.concatenate((
+            seconds.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64) % 12,  # months since 1970-01
+            (seconds // 86400 + 3) % 7 + 12,  # 1970-01-01 was a Thursday
+            seconds // 3600 % 24 + 19,
+        ))
+        self.users = self._added(self.users, np.tile(user_ids, 3), columns)
+        self.channels = self._added(self.channels, np.tile(channel_ids, 3), columns)
+
+    @classmethod
+    def _added(cls, counts, rows, columns):
+        row_count = max(len(counts), int(rows.max()) + 1)
+        added = np.bincount(rows * cls.WIDTH + columns, minlength=row_count * cls.WIDTH).reshape(row_count, cls.WIDTH)
+        added[:len(counts)] += counts
+        return added
+
+    def merge(self, other, user_map, channel_map):
+        """Add another store's histograms, translating its IDs through the maps."""
+        other.compact()
+        for name, id_map in (("users", user_map), ("channels", channel_map)):
+            counts = getattr(other, name)
+            if len(counts):
+                merged = getattr(self, name)
+                if int(id_map.max()) >= len(merged):
+                    merged = np.concatenate((merged, np.zeros((int(id_map.max()) + 1 - len(merged), self.WIDTH), dtype=np.int64)))
+                np.add.at(merged, id_map[:len(counts)], counts)
+                setattr(self, name, merged)
+
+    def histograms(self, name, row):
+        """{"month": [...], "weekday": [...], "hour": [...]} of one user or channel ID (name is "users" or "channels")."""
+        self.compact()
+        counts = getattr(self, name)
+        values = counts[row].tolist() if row < len(counts) else [0] * self.WIDTH
+        result, offset = {}, 0
+        for bucket, size in ACTIVITY_BUCKETS.items():
+            result[bucket] = values[offset:offset + size]
+            offset += size
+        return result
+
+    def to_arrays(self):
+        self.compact()
+        return {"user_activity": self.users, "channel_activity": self.channels}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        activity = cls()
+        if "user_activity" in arrays:  # State files from before the histograms start empty
+            activity.users = np.array(arrays["user_activity"], dtype=np.int64)
+            activity.channels = np.array(arrays["channel_activity"], dtype=np.int64)
+        return activity
+
+
+class AggregateStore:
+    """Compact, column-oriented replacement for the per-user dicts of Counters.
+
+    Users, channels and emoji are interned to integer IDs. The scalar stats
+    are arrays indexed by user ID, each histogram is a SparseCounts of
+    (user, channel or emoji, count) rows, and the activity over time of every
+    user and channel is in an ActivityHistograms.
+    """
+
+    HISTOGRAMS = ("top_channels", "reactions_received", "reactions_given")
+
+    def __init__(self):
+        self.users = Interner()
+        self.channels = Interner()
+        self.emoji = Interner()
+        self.threads_started = array("q")
+        self.replies = array("q")
+        self.top_channels = SparseCounts()
+        self.reactions_received = SparseCounts()
+        self.reactions_given = SparseCounts()
+        self.activity = ActivityHistograms()
+        self.co_posters = CoPosterCounter()
+
+    def user_id(self, user):
+        user_id = self.users.ids.get(user)
+        if user_id is None:
+            user_id = self.users.intern(user)
+            self.threads_started.append(0)
+            self.replies.append(0)
+        return user_id
+
+    def maybe_compact(self):
+        for name in self.HISTOGRAMS:
+            getattr(self, name).maybe_compact()
+        self.activity.maybe_compact()
+
+    def merge(self, other):
+        """Add the stats of a store built over later messages (e.g. by a pool worker)."""
+        user_map = np.array([self.user_id(user) for user in other.users.values], dtype=np.int64)
+        channel_map = np.array([self.channels.intern(channel) for channel in other.channels.values], dtype=np.int64)
+        emoji_map = np.array([self.emoji.intern(emoji) for emoji in other.emoji.values], dtype=np.int64)
+
+        for other_id, user_id in enumerate(user_map.tolist()):
+            self.threads_started[user_id] += other.threads_started[other_id]
+            self.replies[user_id] += other.replies[other_id]
+
+        self.top_channels.merge(other.top_channels, user_map, channel_map)
+        self.reactions_received.merge(other.reactions_received, user_map, emoji_map)
+        self.reactions_given.merge(other.reactions_given, user_map, emoji_map)
+        self.activity.merge(other.activity, user_map, channel_map)
+        self.co_posters.merge(other.co_posters)
+
+    def to_arrays(self):
+        """Return every aggregate as NumPy arrays, e.g. for np.savez."""
+        arrays = {
+            "users": np.array(self.users.values, dtype=str),
+            "channels": np.array(self.channels.values, dtype=str),
+            "emoji": np.array(self.emoji.values, dtype=str),
+            "threads_started": np.frombuffer(self.threads_started, dtype=np.int64).copy(),
+            "replies": np.frombuffer(self.replies, dtype=np.int64).copy(),
+        }
+        for name in self.HISTOGRAMS:
+            arrays.update(getattr(self, name).to_arrays(name))
+        arrays.update(self.activity.to_arrays())
+        co_poster_users, co_poster_members, co_poster_thread_ends = self.co_posters.to_arrays()
+        arrays.update(
+            co_poster_users=co_poster_users,
+            co_poster_members=co_poster_members,
+            co_poster_thread_ends=co_poster_thread_ends,
+        )
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        store = cls()
+        store.users = Interner(arrays["users"].tolist())
+        store.channels = Interner(arrays["channels"].tolist())
+        store.emoji = Interner(arrays["emoji"].tolist())
+        store.threads_started = array("q", arrays["threads_started"].tobytes())
+        store.replies = array("q", arrays["replies"].tobytes())
+        for name in cls.HISTOGRAMS:
+            setattr(store, name, SparseCounts.from_arrays(arrays, name))
+        store.activity = ActivityHistograms.from_arrays(arrays)
+        store.co_posters = CoPosterCounter.from_arrays(
+            arrays["co_poster_users"], arrays["co_poster_members"], arrays["co_poster_thread_ends"]
+        )
+        return store
+
+    def iter_finalized(self, excluded_user_ids):
+        """Yield (user, stats) for base_stats.json in first-seen user order, one user at a time."""
+        user_count = len(self.users)
+        top_channels = _fill_users(self.top_channels.iter_top(5, self.channels.values), user_count)
+        most_reactions_received = _fill_users(self.reactions_received.iter_top(1, self.emoji.values), user_count)
+        most_used_reaction = _fill_users(self.reactions_given.iter_top(1, self.emoji.values), user_count)
+        reactions_received = self.reactions_received.totals(user_count).tolist()
+        top_co_posters = self.co_posters.top_co_posters(excluded_user_ids)
+
+        for user_id, user in enumerate(self.users.values):
+            yield user, {
+                "threads_started": self.threads_started[user_id],
+                "replies": self.replies[user_id],
+                # Total engagement (replies + reactions received)
+                "engagement_received": self.replies[user_id] + reactions_received[user_id],
+                "top_channels": next(top_channels),
+                "most_reactions_received": next(most_reactions_received),
+                "most_used_reaction": next(most_used_reaction),
+                "top_co_posters": top_co_posters.get(user, []),
+            }
+
+    def iter_channel_posts(self):
+        """Yield (channel, [(user, posts), ...]) with every poster of each channel, most posts first, in first-seen channel order."""
+        counts = self.top_channels
+        counts.compact()
+        users = (counts.keys >> np.uint64(KEY_BITS)).astype(np.int64)
+        channels = (counts.keys & np.uint64(KEY_MASK)).astype(np.int64)
+        order = np.lexsort((counts.first_seen, -counts.counts, channels))
+        bounds = np.searchsorted(channels[order], np.arange(len(self.channels) + 1)).tolist()
+        names = [self.users.values[user_id] for user_id in users[order].tolist()]
+        posts = counts.counts[order].tolist()
+        for channel_id, channel in enumerate(self.channels.values):
+            start, end = bounds[channel_id], bounds[channel_id + 1]
+            yield channel, list(zip(names[start:end], posts[start:end]))
+
+    def iter_user_activity(self):
+        """Yield (user, {"month": [...], "weekday": [...], "hour": [...]}) in first-seen user order."""
+        for user_id, user in enumerate(self.users.values):
+            yield user, self.activity.histograms("users", user_id)
+
+    def iter_channel_activity(self):
+        """Yield (channel, {"month": [...], "weekday": [...], "hour": [...]}) in first-seen channel order."""
+        for channel_id, channel in enumerate(self.channels.values):
+            yield channel, self.activity.histograms("channels", channel_id)
+
+
+def _fill_users(rows, user_count):
+    """Expand (user_id, value) rows sorted by user ID into one value per user, [] where missing."""
+    rows = iter(rows)
+    row = next(rows, None)
+    for user_id in range(user_count):
+        if row is not None and row[0] == user_id:
+            yield row[1]
+            row = next(rows, None)
+        else:
+            yield []
@@ -0,0 +1,470 @@
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from aggregate_store import AggregateStore, Interner
+from cooccurrence import CoPosterCounter
+from message_table import first_seen_order, ranges
+
+
+class Aggregator:
+    """One analysis on the shared scan of an export.
+
+    The scan groups every day file's messages into threads once and hands each
+    thread to every registered aggregator. A thread that carries on into later
+    day files arrives in several parts; for the later parts, earlier is the
+    (owner, participants) of the parts before, from the scan's ThreadIndex,
+    and None for a part that starts a thread. To run in a process pool an
+    aggregator must be picklable, empty() must return a fresh instance with the
+    same settings, and merge() must add a partial built over later day files.
+    """
+
+    def start(self, export, channel_names, user_mappings):
+        """Called once before the scan with the scanned channel names (by position) and users.json."""
+
+    def empty(self):
+        return type(self)()
+
+    def add_thread(self, position, channel_name, thread_ts, thread_messages, earlier=None):
+        raise NotImplementedError
+
+    def add_table(self, parts):
+        """Add every thread part of a scan over a MessageTable (a ThreadParts), in scan order.
+
+        Aggregators with a vectorized version override this; the rest get the
+        parts replayed through add_thread.
+        """
+        for position, channel_name, thread_ts, thread_messages, earlier in parts.iter_threads():
+            self.add_thread(position, channel_name, thread_ts, thread_messages, earlier)
+        self.end_day_file()
+
+    def end_day_file(self):
+        """Called after every day file, e.g. to compact buffered counts."""
+
+    def merge(self, other):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class BaseStats(Aggregator):
+    """Per-user stats for base_stats.json, kept in an AggregateStore."""
+
+    def __init__(self, store=None):
+        self.store = AggregateStore() if store is None else store
+
+    def add_thread(self, position, channel_name, thread_ts, thread_messages, earlier=None):
+        store = self.store
+        channel_id = store.channels.intern(channel_name)
+
+        thread_owner = thread_messages[0].get("user", "")
+        if thread_owner and earlier is None:
+            owner_id = store.user_id(thread_owner)
+            store.threads_started[owner_id] += 1
+            store.top_channels.add(owner_id, channel_id)
+
+        # A dict rather than a set so co-poster ties break the same way in every process
+        thread_users = {}
+        for message in thread_messages:
+            user = message.get("user", "")
+            if user:
+                user_id = store.user_id(user)
+                thread_users[user] = None
+                store.replies[user_id] += 1
+                store.top_channels.add(user_id, channel_id)
+                store.activity.add(user_id, channel_id, message["ts"])
+
+            # Track reactions received
+            for reaction in message.get("reactions", []):
+                if user:
+                    store.reactions_received.add(user_id, store.emoji.intern(reaction["name"]), len(reaction["users"]))
+
+            # Track reactions given
+            for reaction in message.get("reactions", []):
+                for reactor in reaction.get("users", []):
+                    store.reactions_given.add(store.user_id(reactor), store.emoji.intern(reaction["name"]))
+
+        # Track co-posters
+        store.co_posters.add_thread(thread_users, earlier[1] if earlier else ())
+
+    def add_table(self, parts):
+        # The same stats as add_thread on every part, as group-bys over the table
+        self.store.merge(_table_store(parts))
+
+    def end_day_file(self):
+        self.store.maybe_compact()
+
+    def merge(self, other):
+        self.store.merge(other.store)
+
+    def result(self, excluded_user_ids=()):
+        """Yield (user, stats) for base_stats.json, one user at a time."""
+        return self.store.iter_finalized(excluded_user_ids)
+
+    def user_activity(self):
+        """Yield (user, activity histograms) for user_activity.json."""
+        return self.store.iter_user_activity()
+
+    def channel_activity(self):
+        """Yield (channel, activity histograms) for channel_activity.json."""
+        return self.store.iter_channel_activity()
+
+    def channel_posts(self):
+        """Yield (channel, [(user, posts), ...]) for channel_posts.json."""
+        return self.store.iter_channel_posts()
+
+
+class TopContributors(Aggregator):
+    """Workspace leaderboards of thread creators and repliers."""
+
+    def __init__(self, ignored_users=(), count=5):
+        self.ignored_users = list(ignored_users)
+        self.count = count
+        self.user_mappings = {}
+        self.thread_creators = Counter()
+        self.repliers = Counter()
+
+    def start(self, export, channel_names, user_mappings):
+        self.user_mappings = user_mappings
+
+    def empty(self):
+        return TopContributors(self.ignored_users, self.count)
+
+    def add_thread(self, position, channel_name, thread_ts, thread_messages, earlier=None):
+        replies = thread_messages
+        if earlier is None:
+            thread_owner = thread_messages[0].get("user", "")
+            if thread_owner and thread_owner not in self.ignored_users:
+                self.thread_creators[thread_owner] += 1
+            replies = thread_messages[1:]  # Exclude the thread starter
+
+        for message in replies:
+            user = message.get("user", "")
+            if user and user not in self.ignored_users:
+                self.repliers[user] += 1
+
+    def add_table(self, parts):
+        table = parts.table
+        message_users = table.user[parts.messages]
+        ignored = np.isin(table.users, self.ignored_users)
+        thread_starts = np.zeros(len(message_users), dtype=bool)
+        thread_starts[parts.message_starts[:-1][parts.started]] = True
+
+        creators = message_users[thread_starts]
+        repliers = message_users[~thread_starts]
+        self.thread_creators.update(_ordered_counts(creators[creators >= 0], ignored, table.users))
+        self.repliers.update(_ordered_counts(repliers[repliers >= 0], ignored, table.users))
+
+    def merge(self, other):
+        self.thread_creators.update(other.thread_creators)
+        self.repliers.update(other.repliers)
+
+    def result(self):
+        return {
+            "top_thread_creators": [
+                (self.user_mappings.get(user, user), count)
+                for user, count in self.thread_creators.most_common(self.count)
+            ],
+            "top_repliers": [
+                (self.user_mappings.get(user, user), count)
+                for user, count in self.repliers.most_common(self.count)
+            ],
+        }
+
+
+def _ordered_counts(users, ignored, names):
+    """{name: count} of table user IDs in first-seen order, like a Counter filled one by one."""
+    users = users[~ignored[users]]
+    order, index = first_seen_order(users)
+    return dict(zip(names[order].tolist(), np.bincount(index, minlength=len(order)).tolist()))
+
+
+def _table_store(parts):
+    """An AggregateStore equal to BaseStats.add_thread over every part of a ThreadParts, in order.
+
+    Interned IDs and the first_seen of every histogram row follow the order in
+    which add_thread would have met them, so ties break the same way.
+    """
+    table = parts.table
+    store = AggregateStore()
+    ranks = np.arange(len(parts.messages))
+    message_users = table.user[parts.messages].astype(np.int64)
+    posted = message_users >= 0
+    reactions, reaction_ranks = parts.reactions()
+    reactors, reactor_ranks = parts.reactors()
+
+    # Thread starts: the first message of a started part, when it has a user
+    owner_parts = np.flatnonzero(parts.started)
+    owner_ranks = parts.message_starts[:-1][owner_parts]
+    owners = message_users[owner_ranks]
+    owner_parts, owner_ranks, owners = owner_parts[owners >= 0], owner_ranks[owners >= 0], owners[owners >= 0]
+
+    # Users in the order add_thread interns them: the owner, each poster, then the message's reactors
+    reactor_users = table.reactor_user[reactors].astype(np.int64)
+    order = np.lexsort((
+        np.concatenate((np.zeros(len(owners) + posted.sum(), dtype=np.int64), reactors)),
+        np.concatenate((np.zeros(len(owners), dtype=np.int64), np.ones(posted.sum(), dtype=np.int64), np.full(len(reactors), 2))),
+        np.concatenate((owner_ranks, ranks[posted], reactor_ranks)),
+    ))
+    user_order, _ = first_seen_order(np.concatenate((owners, message_users[posted], reactor_users))[order])
+    for user in table.users[user_order].tolist():
+        store.user_id(user)
+    store_ids = np.full(len(table.users), -1, dtype=np.int64)
+    store_ids[user_order] = np.arange(len(user_order))
+    store.threads_started = array("q", np.bincount(store_ids[owners], minlength=len(user_order)).astype(np.int64).tobytes())
+    store.replies = array("q", np.bincount(store_ids[message_users[posted]], minlength=len(user_order)).astype(np.int64).tobytes())
+
+    # Channels are interned at each part
+    channel_order, part_channels = first_seen_order(parts.positions)
+    store.channels = Interner(parts.channel_names[position] for position in channel_order.tolist())
+    message_channels = part_channels[parts.message_parts()]
+
+    # top_channels: the owner's start, then each post
+    order = np.lexsort((
+        np.concatenate((np.zeros(len(owners), dtype=np.int64), np.ones(posted.sum(), dtype=np.int64))),
+        np.concatenate((owner_ranks, ranks[posted])),
+    ))
+    store.top_channels.add_events(
+        store_ids[np.concatenate((owners, message_users[posted]))[order]],
+        np.concatenate((part_channels[owner_parts], message_channels[posted]))[order],
+        np.ones(len(order), dtype=np.int64),
+    )
+
+    # Emoji in the order add_thread interns them: reactions received by a poster, then each reactor's
+    received = reactions[posted[reaction_ranks]]
+    received_ranks = reaction_ranks[posted[reaction_ranks]]
+    reactor_emoji = table.reaction_emoji[table.reactor_reaction[reactors]].astype(np.int64)
+    order = np.lexsort((
+        np.concatenate((received, reactors)),
+        np.concatenate((np.zeros(len(received), dtype=np.int64), np.ones(len(reactors), dtype=np.int64))),
+        np.concatenate((received_ranks, reactor_ranks)),
+    ))
+    emoji_order, _ = first_seen_order(np.concatenate((table.reaction_emoji[received].astype(np.int64), reactor_emoji))[order])
+    store.emoji = Interner(table.emoji[emoji_order].tolist())
+    emoji_ids = np.full(len(table.emoji), -1, dtype=np.int64)
+    emoji_ids[emoji_order] = np.arange(len(emoji_order))
+
+    store.reactions_received.add_events(
+        store_ids[message_users[received_ranks]], emoji_ids[table.reaction_emoji[received]], table.reaction_size[received]
+    )
+    store.reactions_given.add_events(store_ids[reactor_users], emoji_ids[reactor_emoji], np.ones(len(reactors), dtype=np.int64))
+
+    # Activity over time of each post
+    store.activity.add_events(store_ids[message_users[posted]], message_channels[posted], table.seconds(table.ts[parts.messages[posted]]))
+
+    store.co_posters = _table_co_posters(parts)
+    return store
+
+
+def _table_co_posters(parts):
+    """A CoPosterCounter equal to recording every part's posters in order, as BaseStats.add_thread does."""
+    names = parts.table.users.tolist()
+    codes = {name: code for code, name in enumerate(names)}
+    part_users, user_starts = parts.part_users, parts.part_user_starts
+    sizes = np.diff(user_starts)
+
+    # Started threads with two or more posters are recorded whole
+    whole = parts.started & (sizes >= 2)
+    segment_parts = [np.repeat(np.flatnonzero(whole), sizes[whole])]
+    segment_users = [part_users[ranges(user_starts[:-1][whole], user_starts[1:][whole])].astype(np.int64)]
+
+    # Continued threads: their earlier posters as ~ID anchors, then the new ones
+    continued_parts, continued_users = [], []
+    for part in np.flatnonzero(~parts.started).tolist():
+        earlier_users = parts.earlier[part][1]
+        earlier_set = set(earlier_users)
+        new_users = [user for user in part_users[user_starts[part]:user_starts[part + 1]].tolist() if names[user] not in earlier_set]
+        if not new_users:
+            continue
+        for user in earlier_users:
+            code = codes.get(user)
+            if code is None:  # Only known from the thread index of an earlier run
+                code = codes[user] = len(names)
+                names.append(user)
+            continued_users.append(~code)
+        continued_users.extend(new_users)
+        continued_parts.extend([part] * (len(earlier_users) + len(new_users)))
+    segment_parts.append(np.array(continued_parts, dtype=np.int64))
+    segment_users.append(np.array(continued_users, dtype=np.int64))
+
+    segment_parts = np.concatenate(segment_parts)
+    order = np.argsort(segment_parts, kind="stable")
+    members = np.concatenate(segment_users)[order]
+    thread_ends = np.cumsum(np.bincount(segment_parts)[np.unique(segment_parts)])
+
+    anchored = members < 0
+    user_order, members = first_seen_order(np.where(anchored, ~members, members))
+    members = np.where(anchored, ~members, members)
+    return CoPosterCounter.from_arrays(np.array([names[user] for user in user_order.tolist()], dtype=str), members, thread_ends)
+
+
+class _UserActivity:
+    """Running per-user totals for WrappedReports."""
+
+    def __init__(self):
+        self.channel_posts = Counter()  # keyed by position in the scanned channel list
+        self.threads_started = 0
+        self.replies = 0
+        self.reactions_given = Counter()
+        self.reactions_received = Counter()
+        self.co_posters = Counter()
+        self.replies_per_thread = {}  # (channel position, thread_ts) -> follow-ups in own threads
+        self.thread_starts = set()  # keys of replies_per_thread reset by the thread's first message
+
+    def merge(self, other):
+        self.channel_posts.update(other.channel_posts)
+        self.threads_started += other.threads_started
+        self.replies += other.replies
+        self.reactions_given.update(other.reactions_given)
+        self.reactions_received.update(other.reactions_received)
+        self.co_posters.update(other.co_posters)
+        for thread_key, replies in other.replies_per_thread.items():
+            if thread_key not in other.thread_starts:
+                replies += self.replies_per_thread.get(thread_key, 0)
+            self.replies_per_thread[thread_key] = replies
+        self.thread_starts |= other.thread_starts
+
+
+def _top_channels(channel_posts, channel_names, first_positions, count=5):
+    """Top channels by posts, padded with unposted channels like a zero-filled Counter."""
+    posts_by_name = Counter()
+    for position, posts in channel_posts.items():
+        posts_by_name[channel_names[position]] += posts
+
+    top_channels = sorted(posts_by_name.items(), key=lambda item: (-item[1], first_positions[item[0]]))[:count]
+    for channel_name in first_positions:
+        if len(top_channels) >= count:
+            break
+        if channel_name not in posts_by_name:
+            top_channels.append((channel_name, 0))
+    return top_channels
+
+
+class WrappedReports(Aggregator):
+    """Per-user generate_wrapped reports.
+
+    With user_ids=None every user in users.json (and any other message author) gets a report.
+    """
+
+    def __init__(self, user_ids=None, ignored_users=()):
+        self.user_ids = None if user_ids is None else list(user_ids)
+        self.ignored_users = list(ignored_users)
+        self.ignored_ids = set(self.ignored_users)
+        self.user_mappings = {}
+        self.channel_names = []
+        self.first_positions = {}
+        self.activity = {} if user_ids is None else {user_id: _UserActivity() for user_id in self.user_ids}
+
+    def start(self, export, channel_names, user_mappings):
+        self.user_mappings = user_mappings
+        self.channel_names = channel_names
+        # Ignored users are given by name, or by ID for users missing from users.json
+        self.ignored_ids = {user_id for user_id, name in user_mappings.items() if name in self.ignored_users}
+        self.ignored_ids.update(user for user in self.ignored_users if user not in user_mappings)
+        for position, channel_name in enumerate(channel_names):
+            if channel_name in export.day_files:
+                self.first_positions.setdefault(channel_name, position)
+        if self.user_ids is None:
+            for user_id in user_mappings:
+                self.activity.setdefault(user_id, _UserActivity())
+
+    def empty(self):
+        partial = WrappedReports(self.user_ids, self.ignored_users)
+        partial.ignored_ids = self.ignored_ids
+        return partial
+
+    def _activity_for(self, user):
+        user_activity = self.activity.get(user)
+        if user_activity is None and self.user_ids is None and user:
+            user_activity = self.activity[user] = _UserActivity()
+        return user_activity
+
+    def add_thread(self, position, channel_name, thread_ts, thread_messages, earlier=None):
+        thread_users = {}
+        thread_owner = earlier[0] if earlier else thread_messages[0].get("user", "")
+        owner_activity = self._activity_for(thread_owner)
+        thread_key = (position, thread_ts)
+
+        for message in thread_messages:
+            user = message.get("user", "")
+            if user:
+                thread_users[user] = None
+
+            user_activity = self._activity_for(user)
+            if user_activity is not None:
+                user_activity.channel_posts[position] += 1
+                if user == thread_owner and message["ts"] == thread_ts:
+                    user_activity.threads_started += 1
+                    user_activity.replies_per_thread[thread_key] = 0  # Track replies to this thread
+                    user_activity.thread_starts.add(thread_key)
+                elif user == thread_owner:
+                    user_activity.replies_per_thread[thread_key] = user_activity.replies_per_thread.get(thread_key, 0) + 1
+                else:
+                    user_activity.replies += 1
+
+                # Track reactions given by the user
+                for reaction in message.get("reactions", []):
+                    for reactor in reaction.get("users", []):
+                        if reactor == user:
+                            user_activity.reactions_given[reaction["name"]] += 1
+
+            # Track reactions received on the owner's threads
+            if owner_activity is not None and "reactions" in message:
+                for reaction in message["reactions"]:
+                    owner_activity.reactions_received[reaction["name"]] += len(reaction["users"])
+
+        # Track co-posters, ignoring specific users; in a continued thread only pairs with a new poster count
+        earlier_users = earlier[1] if earlier else ()
+        earlier_set = set(earlier_users)
+        new_users = [user for user in thread_users if user not in earlier_set]
+        if not new_users:
+            return
+        all_users = [*earlier_users, *new_users]
+        for user in all_users:
+            user_activity = self._activity_for(user)
+            if user_activity is None:
+                continue
+            for co_user in new_users if user in earlier_set else all_users:
+                if co_user != user and co_user not in self.ignored_ids:
+                    user_activity.co_posters[co_user] += 1
+
+    def merge(self, other):
+        for user_id, user_activity in other.activity.items():
+            if user_id in self.activity:
+                self.activity[user_id].merge(user_activity)
+            else:
+                self.activity[user_id] = user_activity
+
+    def result(self):
+        user_mappings = self.user_mappings
+        reports = {}
+        for user_id, user_activity in self.activity.items():
+            # Calculate average replies to threads started
+            total_replies = sum(user_activity.replies_per_thread.values())
+            threads_started = user_activity.threads_started
+            avg_replies = total_replies / threads_started if threads_started > 0 else 0
+
+            # Generate the report
+            top_reaction_given = user_activity.reactions_given.most_common(1)
+            top_reaction_received = user_activity.reactions_received.most_common(1)
+            top_co_posters = [
+                (user_mappings.get(user, user), count)
+                for user, count in user_activity.co_posters.most_common(3)
+            ]
+
+            reports[user_id] = {
+                "user": user_mappings.get(user_id, user_id),
+                "threads_started": threads_started,
+                "replies": user_activity.replies,
+                "top_channels": _top_channels(user_activity.channel_posts, self.channel_names, self.first_positions),
+                "most_used_reaction": top_reaction_given[0] if top_reaction_given else None,
+                "most_reactions_received": top_reaction_received[0]
+                if top_reaction_received
+                else None,
+                "top_co_posters": top_co_posters,
+                "average_replies_to_threads_started": round(avg_replies, 2),
+                "engagement_received": sum(user_activity.reactions_received.values()) + total_replies,
+            }
+        return reports
@@ -0,0 +1,147 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+from prep_stats import prep_export
+
+
+def parse_jobs(exports):
+    """[(name, zip path)] for "path.zip" or "name=path.zip" arguments; a name defaults to the zip's base name."""
+    jobs = []
+    for export in exports:
+        name, separator, zip_file_path = export.partition("=")
+        if not separator:
+            zip_file_path = export
+            name = os.path.splitext(os.path.basename(export))[0]
+        jobs.append((name, os.path.abspath(zip_file_path)))
+    names = [name for name, _ in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Several exports would be prepped into {', '.join(duplicates)}; name them with name=path.zip")
+    return jobs
+
+
+def run_job(job):
+    """Prep one export into its own directory and return a summary for the batch report.
+
+    The job's message cache (unless turned off) and state file (if
+    incremental) live in its directory, so a re-run reuses the parsed export
+    when the zip is unchanged.
+    Temporary files (e.g. spilled thread groups) go to a scratch directory
+    under it that is removed afterwards.
+    """
+    name, zip_file_path, output_dir, options = job
+    job_dir = os.path.join(output_dir, name)
+    os.makedirs(job_dir, exist_ok=True)
+    summary = {"name": name, "export": zip_file_path, "output_dir": job_dir}
+    start = time.perf_counter()
+
+    # Each pool worker runs one job at a time, so the process-wide temp dir is this job's
+    scratch_dir = tempfile.mkdtemp(prefix="scratch-", dir=job_dir)
+    previous_tempdir, tempfile.tempdir = tempfile.tempdir, scratch_dir
+    try:
+        report = prep_export(
+            zip_file_path, job_dir, options["excluded_user_ids"], options["workers"],
+            os.path.join(job_dir, "base_state.npz") if options["incremental"] else None,
+            os.path.join(job_dir, "messages.npz") if options["message_cache"] else None, verbose=False,
+        )
+    except Exception:
+        summary.update(ok=False, seconds=round(time.perf_counter() - start, 3), error=traceback.format_exc())
+        return summary
+    finally:
+        tempfile.tempdir = previous_tempdir
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    summary.update(
+        ok=True,
+        seconds=round(time.perf_counter() - start, 3),
+        reused_cache=options["message_cache"] and not report.stages["decode"],  # The message table was loaded, not parsed
+        files=report.files,
+        messages=report.messages,
+        peak_rss_mb=report.to_dict()["peak_rss_mb"],
+    )
+    return summary
+
+
+def run_batch(exports, output_dir, excluded_user_ids=(), workers=None, incremental=False, message_cache=True):
+    """Prep many exports over one shared process pool, largest first, and write batch_report.json.
+
+    exports are "path.zip" or "name=path.zip"; each job writes to
+    output_dir/name. With workers=None there is one worker per CPU. A single
+    export gets the workers for its own scan instead. With message_cache=False
+    the jobs scan their export's JSON without keeping a message table.
+    """
+    jobs = parse_jobs(exports)
+    os.makedirs(output_dir, exist_ok=True)
+    output_dir = os.path.abspath(output_dir)
+    workers = workers or os.cpu_count() or 1
+    scan_workers = workers if len(jobs) == 1 else 1  # Pool workers can't start pools of their own
+    options = {
+        "excluded_user_ids": list(excluded_user_ids), "workers": scan_workers,
+        "incremental": incremental, "message_cache": message_cache,
+    }
+
+    # Largest exports first, so the batch doesn't end waiting on one big job
+    jobs.sort(key=lambda job: -os.path.getsize(job[1]) if os.path.exists(job[1]) else 0)
+    tasks = [(name, zip_file_path, output_dir, options) for name, zip_file_path in jobs]
+
+    start = time.perf_counter()
+    results = []
+    if workers == 1 or len(tasks) == 1:
+        completed = map(run_job, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(min(workers, len(tasks)))
+        completed = pool.imap_unordered(run_job, tasks)
+    try:
+        for summary in completed:
+            results.append(summary)
+            if summary["ok"]:
+                cached = ", cached" if summary["reused_cache"] else ""
+                print(f"{summary['name']}: {summary['messages']} messages in {summary['seconds']:.1f}s{cached}")
+            else:
+                print(f"{summary['name']}: FAILED after {summary['seconds']:.1f}s\n{summary['error']}", file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    batch_report = {
+        "wall_seconds": round(time.perf_counter() - start, 3),
+        "workers": workers,
+        "jobs": sorted(results, key=lambda summary: summary["name"]),
+    }
+    with open(os.path.join(output_dir, "batch_report.json"), "w") as f:
+        json.dump(batch_report, f, indent=2)
+    return batch_report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prep several Slack exports (workspaces or years) at once, each into its own directory."
+    )
+    parser.add_argument("exports", nargs="+", help="export zips, as path.zip or name=path.zip")
+    parser.add_argument("--output-dir", default="batch", help="each export is prepped into OUTPUT_DIR/name")
+    parser.add_argument("--workers", type=int, help="worker processes shared by all exports (default: one per CPU)")
+    parser.add_argument("--exclude", nargs="*", default=[], help="user IDs to leave out of percentiles and co-posters")
+    parser.add_argument("--incremental", action="store_true",
+                        help="keep a state file per export so later runs only process new day files (skips top_contributors.json)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="don't keep a message table per export; every run parses the exports again")
+    args = parser.parse_args()
+
+    try:
+        batch_report = run_batch(args.exports, args.output_dir, args.exclude, args.workers, args.incremental, not args.no_cache)
+    except ValueError as e:
+        parser.error(str(e))
+    failed = [summary["name"] for summary in batch_report["jobs"] if not summary["ok"]]
+    print(f"{len(batch_report['jobs']) - len(failed)} of {len(batch_report['jobs'])} exports prepped "
+          f"in {batch_report['wall_seconds']:.1f}s into {os.path.abspath(args.output_dir)}")
+    if failed:
+        sys.exit(f"FAIL: {', '.join(failed)}")
@@ -0,0 +1,147 @@
+from array import array
+
+import numpy as np
+
+
+class CoPosterCounter:
+    """Count how often each pair of users posted in the same thread.
+
+    Users are interned to integer IDs and every thread's participants are
+    appended to one flat array, so recording a thread costs O(participants)
+    no matter how busy it is. Pair counts are only reduced at the end, one
+    user at a time with NumPy, and only each user's top co-posters are ever
+    turned back into Python objects.
+
+    A thread continued in a later day file is recorded as another part, with
+    its earlier participants stored as ~ID anchors: anchors only pair with the
+    part's new posters, so no pair is counted twice for one thread.
+    """
+
+    def __init__(self):
+        self.user_ids = {}
+        self.users = []
+        self.members = array("i")  # participants of every thread, back to back
+        self.thread_ends = array("q")  # end offset of each thread in members
+
+    @classmethod
+    def from_arrays(cls, users, members, thread_ends):
+        """Rebuild a counter from the arrays returned by to_arrays."""
+        counter = cls()
+        for user in users.tolist():
+            counter._intern(user)
+        counter.members.frombytes(np.asarray(members, dtype=np.int32).tobytes())
+        counter.thread_ends.frombytes(np.asarray(thread_ends, dtype=np.int64).tobytes())
+        return counter
+
+    def to_arrays(self):
+        """Return (users, members, thread_ends) as NumPy arrays, e.g. for np.savez."""
+        return (
+            np.array(self.users, dtype=str),
+            np.frombuffer(self.members, dtype=np.int32).copy(),
+            np.frombuffer(self.thread_ends, dtype=np.int64).copy(),
+        )
+
+    def _intern(self, user):
+        user_id = self.user_ids.get(user)
+        if user_id is None:
+            user_id = self.user_ids[user] = len(self.users)
+            self.users.append(user)
+        return user_id
+
+    def add_thread(self, thread_users, earlier_users=()):
+        """Record one thread's participants, in the order they first posted.
+
+        For a thread continued from earlier day files, earlier_users are the
+        participants recorded before; only pairs with a new poster count.
+        """
+        if earlier_users:
+            earlier = set(earlier_users)
+            thread_users = [user for user in thread_users if user not in earlier]
+            if not thread_users:
+                return
+        elif len(thread_users) < 2:
+            return
+        self.members.extend(~self._intern(user) for user in earlier_users)
+        self.members.extend(self._intern(user) for user in thread_users)
+        self.thread_ends.append(len(self.members))
+
+    def merge(self, other):
+        """Append the threads recorded by another counter, after this one's."""
+        if not other.thread_ends:
+            return
+        id_map = np.array([self._intern(user) for user in other.users], dtype=np.int32)
+        offset = len(self.members)
+        members = np.frombuffer(other.members, dtype=np.int32)
+        anchored = members < 0
+        mapped = id_map[np.where(anchored, ~members, members)]
+        self.members.frombytes(np.where(anchored, ~mapped, mapped).astype(np.int32).tobytes())
+        self.thread_ends.frombytes((np.frombuffer(other.thread_ends, dtype=np.int64) + offset).tobytes())
+
+    def top_co_posters(self, excluded_user_ids=(), count=3):
+        """Return {user: [(co_poster, shared_threads), ...]} with each user's top co-posters.
+
+        Ties break by the first thread the pair shared, matching Counter.most_common
+        on per-user counters filled in scan order. Excluded users are never listed
+        as anyone's co-poster.
+        """
+        if not self.thread_ends:
+            return {}
+
+        members = np.frombuffer(self.members, dtype=np.int32)
+        anchored = members < 0
+        has_anchors = anchored.any()
+        if has_anchors:
+            members = np.where(anchored, ~members, members)
+        ends = np.frombuffer(self.thread_ends, dtype=np.int64)
+        starts = np.concatenate(([0], ends[:-1]))
+        sizes = ends - starts
+        thread_of = np.repeat(np.arange(len(ends)), sizes)
+
+        excluded_user_ids = set(excluded_user_ids)
+        excluded = np.array([user in excluded_user_ids for user in self.users], dtype=bool)
+
+        # Group every participation by user, keeping scan order within each user
+        by_user = np.argsort(members, kind="stable")
+        user_bounds = np.concatenate(([0], np.cumsum(np.bincount(members, minlength=len(self.users)))))
+
+        top = {}
+        for user_id, user in enumerate(self.users):
+            participations = by_user[user_bounds[user_id]:user_bounds[user_id + 1]]
+            threads = thread_of[participations]
+
+            # Everyone who posted in those threads, concatenated in scan order
+            lengths = sizes[threads]
+            run_starts = np.cumsum(lengths) - lengths
+            positions = np.repeat(starts[threads] - run_starts, lengths) + np.arange(lengths.sum())
+            others = members[positions]
+            keep = (others != user_id) & ~excluded[others]
+            if has_anchors:
+                # Two anchors of a part were already counted together in an earlier part
+                keep &= ~(np.repeat(anchored[participations], lengths) & anchored[positions])
+            others = others[keep]
+            if not len(others):
+                top[user] = []
+                continue
+
+            co_posters, shared, first_seen = _co_poster_counts(others, len(self.users), count)
+            best = np.lexsort((first_seen, -shared))[:count]
+            top[user] = [(self.users[co_posters[i]], int(shared[i])) for i in best]
+        return top
+
+
+def _co_poster_counts(others, user_count, count):
+    """Return (co_posters, shared_threads, first_seen) covering at least the top `count` co-posters."""
+    if len(others) * 4 < user_count:
+        co_posters, first_seen, shared = np.unique(others, return_index=True, return_counts=True)
+        return co_posters, shared, first_seen
+
+    # Busy threads: count densely and only look up first sightings for the leaders
+    shared_by_user = np.bincount(others, minlength=user_count)
+    co_posters = np.flatnonzero(shared_by_user)
+    if len(co_posters) > count:
+        cutoff = np.partition(shared_by_user[co_posters], -count)[-count]
+        co_posters = co_posters[shared_by_user[co_posters] >= cutoff]
+    leader_positions = np.flatnonzero(shared_by_user[others] >= shared_by_user[co_posters].min())
+    first_seen_by_user = np.full(user_count, len(others), dtype=np.int64)
+    np.minimum.at(first_seen_by_user, others[leader_positions], leader_positions)
+    return co_posters, shared_by_user[co_posters], first_seen_by_user[co_posters]
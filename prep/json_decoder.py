@@ -0,0 +1,172 @@
+import codecs
+import json
+import os
+import re
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The only message fields the stats ever read; blocks, files, etc. are dropped
+MESSAGE_FIELDS = ("ts", "thread_ts", "user", "reactions")
+
+# Bytes read at a time by iter_array
+STREAM_CHUNK = 1 << 20
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_DELIMITERS = " \t\n\r,]"
+
+
+def _project(message, fields):
+    return {field: message[field] for field in fields if field in message}
+
+
+class _StdlibDecoder:
+    name = "json"
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def load_messages(self, data, fields):
+        return [_project(message, fields) for message in self.loads(data)]
+
+
+class _OrjsonDecoder(_StdlibDecoder):
+    name = "orjson"
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class _SimdjsonDecoder(_StdlibDecoder):
+    """Only materializes the requested message fields; everything else is skipped unparsed."""
+
+    name = "simdjson"
+
+    def loads(self, data):
+        return simdjson.loads(data)
+
+    def load_messages(self, data, fields):
+        messages = []
+        for message in simdjson.Parser().parse(data):
+            slim = {}
+            for field in fields:
+                if field in message:
+                    value = message[field]
+                    if isinstance(value, simdjson.Array):
+                        value = value.as_list()
+                    elif isinstance(value, simdjson.Object):
+                        value = value.as_dict()
+                    slim[field] = value
+            messages.append(slim)
+        return messages
+
+
+DECODERS = {"simdjson": _SimdjsonDecoder, "orjson": _OrjsonDecoder, "json": _StdlibDecoder}
+AVAILABLE = {"simdjson": simdjson is not None, "orjson": orjson is not None, "json": True}
+
+
+def get_decoder(name=None):
+    """Return the named decoder, or the fastest installed one.
+
+    SLACK_WRAPPED_JSON overrides the default, e.g. SLACK_WRAPPED_JSON=json to
+    compare against the stdlib.
+    """
+    name = name or os.environ.get("SLACK_WRAPPED_JSON")
+    if name is None:
+        name = next(name for name in DECODERS if AVAILABLE[name])
+    elif name not in DECODERS:
+        raise ValueError(f"Unknown JSON decoder '{name}', expected one of {', '.join(DECODERS)}.")
+    elif not AVAILABLE[name]:
+        raise ImportError(f"JSON decoder '{name}' is not installed.")
+    return DECODERS[name]()
+
+
+decoder = get_decoder()
+
+
+def load(f):
+    return decoder.loads(f.read())
+
+
+def load_messages(f, fields=MESSAGE_FIELDS):
+    """Decode a day file, keeping only `fields` of each message (all of them if None)."""
+    return decode_messages(f.read(), fields)
+
+
+def decode_messages(data, fields=MESSAGE_FIELDS):
+    """Like load_messages, for a day file that has already been read."""
+    if fields is None:
+        return decoder.loads(data)
+    return decoder.load_messages(data, fields)
+
+
+def iter_array(stream, chunk_size=STREAM_CHUNK):
+    """Yield the elements of a top-level JSON array read from a binary stream.
+
+    Only about one chunk plus the element being decoded is held in memory, so
+    the size of the array doesn't matter. Uses the stdlib decoder, which can
+    resume part way through a buffer.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+
+    def peek():
+        nonlocal pos
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if eof:
+                raise ValueError("Truncated JSON array")
+            read_more()
+
+    if peek() != "[":
+        raise ValueError("Expected a JSON array")
+    pos += 1
+    if peek() == "]":
+        return
+
+    while True:
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # A number cut off by the end of the chunk also decodes, so wait for a delimiter
+                if eof or (end < len(buffer) and buffer[end] in _DELIMITERS):
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            read_more()
+        pos = end
+        yield value
+
+        separator = peek()
+        pos += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or ']' in JSON array, found {separator!r}")
+
+
+def iter_messages(stream, fields=MESSAGE_FIELDS):
+    """Stream a day file's messages one at a time, keeping only `fields` of each (all of them if None)."""
+    for message in iter_array(stream):
+        yield message if fields is None else _project(message, fields)
@@ -0,0 +1,473 @@
+import hashlib
+import os
+import time
+from array import array
+
+import numpy as np
+
+import json_decoder
+from aggregate_store import Interner
+from run_report import RunReport
+from slack_export import SlackExport
+from thread_grouping import ThreadIndex
+
+# Bump when the columns change, so caches written by older code are rebuilt
+TABLE_VERSION = 3
+
+COLUMNS = (
+    "user_ids", "user_names",  # users.json
+    "channel_names", "dirs",  # channels.json order; every channel directory in the zip
+    "day_channel", "day_names", "day_checksums", "day_messages", "day_starts",
+    "users", "ts", "thread_ts", "has_thread_ts", "user",
+    "odd_ts",  # ts strings that aren't a Slack ts of the usual form, see ts_micros
+    "emoji", "reaction_message", "reaction_emoji", "reaction_size",
+    "reactor_reaction", "reactor_user",
+)
+
+# The numeric columns, filled as typed arrays while the export is decoded
+ARRAY_COLUMNS = {
+    "day_channel": "i", "day_checksums": "q", "day_messages": "q", "day_starts": "q",
+    "ts": "q", "thread_ts": "q", "has_thread_ts": "b", "user": "i",
+    "reaction_message": "q", "reaction_emoji": "i", "reaction_size": "q",
+    "reactor_reaction": "q", "reactor_user": "i",
+}
+ARRAY_DTYPES = {"b": np.int8, "i": np.int32, "q": np.int64}
+
+MICROS = 1_000_000
+
+
+def ts_micros(ts):
+    """A Slack ts ("1700000000.123456") in epoch microseconds, or None if it isn't in exactly that form."""
+    try:
+        seconds, _, fraction = ts.partition(".")
+        micros = int(seconds) * MICROS + int(fraction)
+    except (AttributeError, ValueError):
+        return None
+    return micros if micros >= 0 and ts_text(micros) == ts else None
+
+
+def ts_text(micros):
+    """The Slack ts of a time in epoch microseconds."""
+    return f"{micros // MICROS}.{micros % MICROS:06d}"
+
+
+def export_fingerprint(export):
+    """Hash of the export's member names, sizes and CRCs, read from the zip directory alone."""
+    digest = hashlib.sha256()
+    for info in export.zip_ref.infolist():
+        digest.update(f"{info.filename}\0{info.file_size}\0{info.CRC}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def ranges(starts, ends):
+    """Concatenate arange(start, end) for every pair, vectorized."""
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum(), dtype=np.int64)
+
+
+def first_seen_order(values):
+    """Unique values in order of first appearance, and each value's index into that list."""
+    unique, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind="stable")
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return unique[order], rank[inverse]
+
+
+class MessageTable:
+    """A Slack export decoded once into columns, cached as .npz next to the export.
+
+    Messages with a ts are rows in scan order (channels.json order, then day
+    file, then file order), with the table's own user IDs (-1 for no user).
+    Reactions are rows pointing at their message and reactors rows pointing
+    at their reaction. ts and thread_ts are int64 epoch microseconds, or
+    -1 - the index in odd_ts of a string that wouldn't be written back the
+    same (ts_texts() restores them). The table stands in for the SlackExport it was built
+    from (channels(), day_files, checksum()) and thread_parts() groups it
+    for the aggregators, so re-runs never parse the JSON again.
+    """
+
+    def __init__(self, arrays, fingerprint=""):
+        self.fingerprint = fingerprint
+        for name in COLUMNS:
+            setattr(self, name, arrays[name])
+
+        self.day_files = {dir_name: [] for dir_name in self.dirs.tolist()}
+        self._day_rows = {}
+        channel_names = self.channel_names.tolist()
+        for row, (channel, file_name) in enumerate(zip(self.day_channel.tolist(), self.day_names.tolist())):
+            self.day_files[channel_names[channel]].append(file_name)
+            self._day_rows[channel_names[channel], file_name] = row
+        self._thread_codes = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    @classmethod
+    def build(cls, export, report=None, stream_bytes=None):
+        """Decode every day file of the channels in channels.json into a table.
+
+        Day files over stream_bytes are decoded as they are read, and the
+        columns are filled as typed arrays, so building takes little more
+        memory than the table itself.
+        """
+        if report is None:
+            report = RunReport()
+        users, emoji = Interner(), Interner()
+        columns = {name: array(typecode) for name, typecode in ARRAY_COLUMNS.items()}
+        with export.open("users.json") as f:
+            user_ids, user_names = [], []
+            for user in json_decoder.load(f):
+                user_ids.append(user["id"])
+                user_names.append(user["name"])
+        channel_names = []
+
+        odd_ts = Interner()
+
+        def ts_code(ts):
+            """ts in epoch microseconds, or -1 - its index in odd_ts if it wouldn't come back the same."""
+            micros = ts_micros(ts)
+            return micros if micros is not None else -1 - odd_ts.intern(ts)
+
+        def ingest(messages):
+            """Append the messages to the columns; returns how many there were."""
+            ts_column, thread_ts_column, has_thread_ts_column = columns["ts"], columns["thread_ts"], columns["has_thread_ts"]
+            user_column = columns["user"]
+            count = 0
+            for message in messages:
+                count += 1
+                if "ts" not in message:
+                    continue
+                row = len(ts_column)
+                ts = ts_code(message["ts"])
+                ts_column.append(ts)
+                if "thread_ts" in message:
+                    thread_ts_column.append(ts_code(message["thread_ts"]))
+                    has_thread_ts_column.append(True)
+                else:
+                    thread_ts_column.append(ts)
+                    has_thread_ts_column.append(False)
+                user = message.get("user", "")
+                user_column.append(users.intern(user) if user else -1)
+                for reaction in message.get("reactions", []):
+                    reactors = reaction.get("users", [])
+                    columns["reactor_reaction"].extend([len(columns["reaction_message"])] * len(reactors))
+                    columns["reactor_user"].extend(users.intern(reactor) for reactor in reactors)
+                    columns["reaction_message"].append(row)
+                    columns["reaction_emoji"].append(emoji.intern(reaction["name"]))
+                    columns["reaction_size"].append(len(reactors))
+            return count
+
+        day_names = []
+        for channel_index, channel in enumerate(export.channels()):
+            channel_name = channel["name"]
+            channel_names.append(channel_name)
+            for file_name in export.day_files.get(channel_name, []):
+                columns["day_channel"].append(channel_index)
+                day_names.append(file_name)
+                columns["day_checksums"].append(export.checksum(channel_name, file_name))
+                columns["day_starts"].append(len(columns["ts"]))
+                if stream_bytes is not None and export.day_file_size(channel_name, file_name) > stream_bytes:
+                    # Decoding is pulled through ingest, so unzip time is part of decode
+                    decode_before = report.stages.get("decode", 0.0)
+                    start = time.perf_counter()
+                    with export.open_day_file(channel_name, file_name) as f:
+                        count = ingest(report.timed("decode", json_decoder.iter_messages(f)))
+                    decoding = report.stages["decode"] - decode_before
+                    report.stages["ingest"] = report.stages.get("ingest", 0.0) + time.perf_counter() - start - decoding
+                else:
+                    with report.stage("unzip"):
+                        data = export.read_day_file(channel_name, file_name)
+                    with report.stage("decode"):
+                        messages = json_decoder.decode_messages(data)
+                    del data
+                    with report.stage("ingest"):
+                        count = ingest(messages)
+                    del messages
+                columns["day_messages"].append(count)
+        columns["day_starts"].append(len(columns["ts"]))
+
+        arrays = {name: np.frombuffer(values, dtype=ARRAY_DTYPES[values.typecode]) for name, values in columns.items()}
+        arrays["has_thread_ts"] = arrays["has_thread_ts"].astype(bool)
+        for name, values in (
+            ("user_ids", user_ids), ("user_names", user_names), ("channel_names", channel_names),
+            ("dirs", list(export.day_files)), ("day_names", day_names), ("users", users.values), ("emoji", emoji.values), ("odd_ts", odd_ts.values),
+        ):
+            arrays[name] = np.array(values, dtype=str)
+        return cls(arrays, export_fingerprint(export))
+
+    def save(self, cache_file):
+        tmp_file = f"{cache_file}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez_compressed(
+                f,
+                version=np.array(TABLE_VERSION),
+                fingerprint=np.array(self.fingerprint),
+                **{name: getattr(self, name) for name in COLUMNS},
+            )
+        os.replace(tmp_file, cache_file)
+
+    @classmethod
+    def open(cls, zip_file_path, cache_file, report=None, stream_bytes=None):
+        """Load the table cached for this export, building (and caching) it if the export changed."""
+        with SlackExport(zip_file_path) as export:
+            fingerprint = export_fingerprint(export)
+            if os.path.exists(cache_file):
+                with np.load(cache_file) as cached:
+                    if int(cached["version"]) == TABLE_VERSION and str(cached["fingerprint"]) == fingerprint:
+                        return cls({name: cached[name] for name in COLUMNS}, fingerprint)
+            table = cls.build(export, report, stream_bytes)
+        table.save(cache_file)
+        return table
+
+    # The SlackExport methods the scans use
+
+    def channels(self):
+        return [{"name": channel_name} for channel_name in self.channel_names.tolist()]
+
+    def checksum(self, channel_name, file_name):
+        return int(self.day_checksums[self._day_rows[channel_name, file_name]])
+
+    def user_mappings(self):
+        return dict(zip(self.user_ids.tolist(), self.user_names.tolist()))
+
+    def ts_texts(self, codes):
+        """The ts strings of an array of ts or thread_ts codes."""
+        odd_ts = self.odd_ts.tolist()
+        return [ts_text(code) if code >= 0 else odd_ts[-1 - code] for code in codes.tolist()]
+
+    def seconds(self, codes):
+        """Whole epoch seconds of an array of ts codes, floored like the JSON scan does."""
+        seconds = codes // MICROS
+        odd = codes < 0
+        if odd.any():
+            odd_seconds = np.floor(self.odd_ts.astype(np.float64)).astype(np.int64)
+            seconds[odd] = odd_seconds[-1 - codes[odd]]
+        return seconds
+
+    def thread_codes(self):
+        """A number per message that is the same for the messages of one thread in one channel."""
+        if self._thread_codes is None:
+            _, thread_ts = np.unique(self.thread_ts, return_inverse=True)
+            channels = np.repeat(self.day_channel.astype(np.int64), np.diff(self.day_starts))
+            self._thread_codes = channels * (int(thread_ts.max(initial=0)) + 1) + thread_ts
+        return self._thread_codes
+
+    def thread_parts(self, pending, day_files_per_task, thread_indexes=None):
+        """Group the pending day files into thread parts, ordered and linked exactly like scan_export."""
+        return ThreadParts(self, pending, day_files_per_task, thread_indexes)
+
+
+class ThreadParts:
+    """The thread parts of a scan over a MessageTable, in the order scan_export would feed them.
+
+    Per part, in that order: positions, thread_ts, earlier (None or the
+    ThreadIndex entry, as passed to add_thread), started (earlier is None) and
+    message_starts into messages, the table rows of the parts back to back.
+    part_user_starts and part_users list each part's users in first-post order.
+    """
+
+    def __init__(self, table, pending, day_files_per_task, thread_indexes=None):
+        self.table = table
+        self.channel_names = [channel_name for channel_name, _ in pending]
+
+        # The scanned day files and the scan task of each
+        day_rows, day_positions, day_tasks = [], [], []
+        task = 0
+        for position, (channel_name, file_names) in enumerate(pending):
+            for file_number, file_name in enumerate(file_names):
+                day_rows.append(table._day_rows[channel_name, file_name])
+                day_positions.append(position)
+                day_tasks.append(task + file_number // day_files_per_task)
+            task += -(-len(file_names) // day_files_per_task)
+        day_rows = np.array(day_rows, dtype=np.int64)
+        self.files = len(day_rows)
+        self.message_count = int(table.day_messages[day_rows].sum()) if len(day_rows) else 0
+
+        # Messages in scan order, and the day file (in scan order) of each
+        starts, ends = table.day_starts[day_rows], table.day_starts[day_rows + 1]
+        rows = ranges(starts, ends)
+        row_days = np.repeat(np.arange(len(day_rows)), ends - starts)
+
+        # Thread parts: one per thread per day file, in order of their first message
+        _, threads = np.unique(table.thread_codes()[rows], return_inverse=True)
+        _, row_parts = first_seen_order(row_days * (int(threads.max(initial=0)) + 1) + threads)
+        by_part = np.argsort(row_parts, kind="stable")
+        part_rows = rows[by_part]
+        part_sizes = np.bincount(row_parts, minlength=int(row_parts.max(initial=-1)) + 1)
+        part_starts = np.concatenate(([0], np.cumsum(part_sizes)))
+        first_rows = part_rows[part_starts[:-1]]
+        part_days = row_days[by_part][part_starts[:-1]]
+
+        # Each part's users in first-post order
+        users = table.user[part_rows].astype(np.int64)
+        posted = users >= 0
+        user_parts = np.repeat(np.arange(len(part_sizes)), part_sizes)[posted]
+        pairs, first = np.unique(user_parts * (len(table.users) + 1) + users[posted], return_index=True)
+        pairs = pairs[np.argsort(first, kind="stable")]
+        pair_parts = pairs // (len(table.users) + 1)
+        pair_users = pairs % (len(table.users) + 1)
+        pair_starts = np.concatenate(([0], np.cumsum(np.bincount(pair_parts, minlength=len(part_sizes)))))
+
+        part_count = len(part_sizes)
+        part_tasks = np.array(day_tasks, dtype=np.int64)[part_days]
+        part_positions = np.array(day_positions, dtype=np.int64)[part_days]
+        root_first = table.ts[first_rows] == table.thread_ts[first_rows]
+
+        # A part is deferred to the end of its task unless it starts its thread or
+        # continues one started earlier in the task, which only matters for threads
+        # with several parts: any other part is deferred exactly when it isn't the
+        # thread's first message, and is never linked to earlier parts. With
+        # thread_indexes every part must be looked up and indexed.
+        part_threads = threads[by_part][part_starts[:-1]]
+        linked = np.bincount(part_threads, minlength=int(part_threads.max(initial=-1)) + 1)[part_threads] > 1
+        if thread_indexes is not None:
+            linked[:] = True
+        deferred = ~root_first
+        earlier_of = self._link_parts(
+            np.flatnonzero(linked), part_tasks, part_positions, root_first, deferred, thread_indexes,
+            table.thread_ts[first_rows], table.user[first_rows], part_sizes == 1, table.has_thread_ts[first_rows],
+            pair_users, pair_starts,
+        )
+
+        # Each task's parts in scan order, then its deferred parts
+        order = np.lexsort((np.arange(part_count), deferred, part_tasks))
+        self.earlier = [earlier_of.get(part) for part in order.tolist()]
+        self.started = np.array([earlier is None for earlier in self.earlier], dtype=bool)
+        self.positions = part_positions[order]
+        self.thread_ts = table.ts_texts(table.thread_ts[first_rows][order])
+        self.messages = part_rows[ranges(part_starts[:-1][order], part_starts[1:][order])]
+        self.message_starts = np.concatenate(([0], np.cumsum(part_sizes[order])))
+        self.part_users = pair_users[ranges(pair_starts[:-1][order], pair_starts[1:][order])]
+        self.part_user_starts = np.concatenate(([0], np.cumsum(np.diff(pair_starts)[order])))
+
+    def _link_parts(self, parts, part_tasks, part_positions, root_first, deferred, thread_indexes,
+                    thread_ts, first_users, single, has_thread_ts, pair_users, pair_starts):
+        """Run the scan's ThreadIndex bookkeeping over the given parts (in scan order).
+
+        Marks their deferred flags and returns {part: earlier} for the parts
+        that continue a thread.
+        """
+        user_names = self.table.users.tolist()
+        earlier_of = {}
+
+        def add(index, part, earlier):
+            user = int(first_users[part])
+            index.add_part(
+                thread_ts_of[part], user_names[user] if user >= 0 else "",
+                [user_names[user] for user in pair_users[pair_starts[part]:pair_starts[part + 1]].tolist()],
+                bool(single[part] and not has_thread_ts[part]), earlier,
+            )
+
+        parts = parts.tolist()
+        thread_ts_of = dict(zip(parts, self.table.ts_texts(thread_ts[parts])))
+        tasks = part_tasks[parts].tolist()
+        positions = part_positions[parts].tolist()
+        roots = root_first[parts].tolist()
+
+        i = 0
+        last_position = None
+        while i < len(parts):
+            task, position = tasks[i], positions[i]
+            if position != last_position:
+                if thread_indexes is None:
+                    channel_index = ThreadIndex()
+                else:
+                    channel_index = thread_indexes.setdefault(self.channel_names[position], ThreadIndex())
+                last_position = position
+
+            task_index, task_deferred = ThreadIndex(), []
+            while i < len(parts) and tasks[i] == task:
+                part = parts[i]
+                earlier = task_index.get(thread_ts_of[part])
+                if earlier is None and not roots[i]:
+                    task_deferred.append(part)
+                else:
+                    deferred[part] = False
+                    if earlier is not None:
+                        earlier_of[part] = earlier
+                    add(task_index, part, earlier)
+                i += 1
+
+            channel_index.update(task_index)
+            for part in task_deferred:
+                deferred[part] = True
+                earlier = channel_index.get(thread_ts_of[part])
+                if earlier is not None:
+                    earlier_of[part] = earlier
+                add(channel_index, part, earlier)
+        return earlier_of
+
+    def __len__(self):
+        return len(self.earlier)
+
+    def message_parts(self):
+        """The part of every entry of messages."""
+        return np.repeat(np.arange(len(self)), np.diff(self.message_starts))
+
+    def reactions(self):
+        """(reaction rows, message ranks): the reactions on the scanned messages, in scan order."""
+        table = self.table
+        ranks = np.full(len(table.ts), -1, dtype=np.int64)
+        ranks[self.messages] = np.arange(len(self.messages))
+        reaction_ranks = ranks[table.reaction_message]
+        reactions = np.flatnonzero(reaction_ranks >= 0)
+        reactions = reactions[np.argsort(reaction_ranks[reactions], kind="stable")]
+        return reactions, reaction_ranks[reactions]
+
+    def reactors(self):
+        """(reactor rows, message ranks): who reacted to the scanned messages, in scan order."""
+        reactions, reaction_ranks = self.reactions()
+        table = self.table
+        ranks = np.full(len(table.reaction_message), -1, dtype=np.int64)
+        ranks[reactions] = reaction_ranks
+        reactor_ranks = ranks[table.reactor_reaction]
+        reactors = np.flatnonzero(reactor_ranks >= 0)
+        reactors = reactors[np.argsort(reactor_ranks[reactors], kind="stable")]
+        return reactors, reactor_ranks[reactors]
+
+    def iter_threads(self):
+        """Yield add_thread arguments (position, channel_name, thread_ts, thread_messages, earlier) per part.
+
+        The messages are rebuilt as the slim dicts the JSON scan would have produced.
+        """
+        table = self.table
+        user_names = table.users.tolist()
+        emoji = table.emoji.tolist()
+        reaction_bounds = np.searchsorted(table.reaction_message, self.messages)
+        reaction_ends = np.searchsorted(table.reaction_message, self.messages, side="right")
+        reactor_bounds = np.searchsorted(table.reactor_reaction, np.arange(len(table.reaction_message) + 1)).tolist()
+        reaction_emoji = table.reaction_emoji.tolist()
+        reactor_user = table.reactor_user.tolist()
+
+        messages = []
+        for ts, thread_ts, has_thread_ts, user, reaction_start, reaction_end in zip(
+            table.ts_texts(table.ts[self.messages]),
+            table.ts_texts(table.thread_ts[self.messages]),
+            table.has_thread_ts[self.messages].tolist(),
+            table.user[self.messages].tolist(),
+            reaction_bounds.tolist(),
+            reaction_ends.tolist(),
+        ):
+            message = {"ts": ts}
+            if has_thread_ts:
+                message["thread_ts"] = thread_ts
+            if user >= 0:
+                message["user"] = user_names[user]
+            if reaction_end > reaction_start:
+                message["reactions"] = [
+                    {
+                        "name": emoji[reaction_emoji[reaction]],
+                        "users": [user_names[reactor] for reactor in reactor_user[reactor_bounds[reaction]:reactor_bounds[reaction + 1]]],
+                    }
+                    for reaction in range(reaction_start, reaction_end)
+                ]
+            messages.append(message)
+
+        starts = self.message_starts.tolist()
+        for part, (position, thread_ts, earlier) in enumerate(zip(self.positions.tolist(), self.thread_ts, self.earlier)):
+            yield position, self.channel_names[position], thread_ts, messages[starts[part]:starts[part + 1]], earlier
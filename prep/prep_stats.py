@@ -1,418 +1,484 @@
 import os
 import json
-from collections import Counter, defaultdict
-from datetime import datetime
-import zipfile
+import multiprocessing
+import time
 import numpy as np
 
+import json_decoder
+from aggregate_store import AggregateStore
+from aggregators import BaseStats, TopContributors, WrappedReports
+from message_table import MessageTable
+from run_report import RunReport
+from slack_export import SlackExport
+from thread_grouping import ThreadIndex, group_threads, thread_indexes_from_arrays, thread_indexes_to_arrays
+
 
 def load_users_mapping(users_file):
-    """Load the user mappings from users.json."""
-    with open(users_file, "r", encoding="utf-8") as f:
-        users = json.load(f)
+    """Load the user mappings from users.json (a path or an open file)."""
+    if isinstance(users_file, (str, os.PathLike)):
+        with open(users_file, "r", encoding="utf-8") as f:
+            return load_users_mapping(f)
+    users = json_decoder.load(users_file)
     return {user["id"]: user["name"] for user in users}
 
 
-def process_channel_messages(channel_dir, user_id, user_mappings):
-    """Process all messages in a given channel directory and extract user activity."""
-    user_posts = []
-    user_threads = Counter()
-    user_reactions_given = Counter()
-    reactions_received = Counter()
-    co_posters = Counter()
-    replies_per_thread = defaultdict(list)
-    ignored_users = []
+def open_export(zip_file_path, message_cache=None, report=None):
+    """Open the export, or with a message_cache file its MessageTable (built and cached on first use)."""
+    if message_cache:
+        return MessageTable.open(zip_file_path, message_cache, report, STREAM_DAY_FILE_BYTES)
+    return SlackExport(zip_file_path)
 
-    for file_name in os.listdir(channel_dir):
-        if not file_name.endswith(".json"):
-            continue
 
-        with open(os.path.join(channel_dir, file_name), "r", encoding="utf-8") as f:
-            messages = json.load(f)
+def generate_wrapped_reports(zip_file_path, user_ids=None, message_cache=None):
+    """Build generate_wrapped reports for many users in a single pass over the export.
 
-        threads = {}
-        for message in messages:
-            # Skip messages without a timestamp
-            if "ts" not in message:
-                continue
-
-            thread_ts = message.get("thread_ts", message["ts"])
-            if thread_ts not in threads:
-                threads[thread_ts] = []
-            threads[thread_ts].append(message)
-
-        for thread_ts, thread_messages in threads.items():
-            thread_users = set()
-            thread_owner = thread_messages[0].get("user", "")
-
-            for message in thread_messages:
-                user = message.get("user", "")
-                if user:
-                    thread_users.add(user)
-
-                if user == user_id:
-                    user_posts.append(message)
-                    if thread_owner == user_id and message["ts"] == thread_ts:
-                        user_threads["started"] += 1
-                        replies_per_thread[thread_ts] = []  # Track replies to this thread
-                    elif thread_owner == user_id:
-                        replies_per_thread[thread_ts].append(message)
-                    else:
-                        user_threads["replied"] += 1
-
-                    # Track reactions given by the user
-                    for reaction in message.get("reactions", []):
-                        for reactor in reaction.get("users", []):
-                            if reactor == user_id:
-                                user_reactions_given[reaction["name"]] += 1
-
-                # Track reactions received on the user's posts
-                if thread_owner == user_id and "reactions" in message:
-                    for reaction in message["reactions"]:
-                        reactions_received[reaction["name"]] += len(reaction["users"])
-
-            # Track co-posters, ignoring specific users
-            if user_id in thread_users:
-                thread_users.discard(user_id)  # Exclude the user themselves
-                for co_user in thread_users:
-                    if user_mappings.get(co_user, co_user) not in ignored_users:
-                        co_posters[co_user] += 1
-
-    return user_posts, user_threads, user_reactions_given, reactions_received, co_posters, replies_per_thread
-
-
-def generate_wrapped(zip_file_path, user_id):
-    # Unpack the zip file
-    extract_dir = "/tmp/slack_export"
-    os.makedirs(extract_dir, exist_ok=True)
-
-    with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
-        zip_ref.extractall(extract_dir)
-
-    # Load user mappings
-    users_file = os.path.join(extract_dir, "users.json")
-    if not os.path.exists(users_file):
-        raise FileNotFoundError(f"No 'users.json' file found in {zip_file_path}.")
-    user_mappings = load_users_mapping(users_file)
-
-    # Parse channels and analyze data
-    channels_file = os.path.join(extract_dir, "channels.json")
-    if not os.path.exists(channels_file):
-        raise FileNotFoundError(f"No 'channels.json' file found in {zip_file_path}.")
-    with open(channels_file, "r", encoding="utf-8") as f:
-        channels = json.load(f)
-
-    user_posts = []
-    user_threads = Counter()
-    user_reactions_given = Counter()
-    reactions_received = Counter()
-    co_posters = Counter()
-    channel_post_counts = Counter()
-    replies_per_thread = defaultdict(list)
-
-    for channel in channels:
-        channel_name = channel["name"]
-        channel_dir = os.path.join(extract_dir, channel_name)
-        if not os.path.exists(channel_dir):
-            continue
+    With user_ids=None, every user in users.json (and any other message author) gets a report.
+    """
+    reports = WrappedReports(user_ids)
+    with open_export(zip_file_path, message_cache) as export:
+        scan_export(export, [reports])
+    return reports.result()
 
-        (
-            posts,
-            threads,
-            reactions_given,
-            reactions_rcvd,
-            co_posters_in_channel,
-            replies_in_channel,
-        ) = process_channel_messages(channel_dir, user_id, user_mappings)
-
-        user_posts.extend(posts)
-        user_threads.update(threads)
-        user_reactions_given.update(reactions_given)
-        reactions_received.update(reactions_rcvd)
-        co_posters.update(co_posters_in_channel)
-        channel_post_counts[channel_name] += len(posts)
-        for thread, replies in replies_in_channel.items():
-            replies_per_thread[thread].extend(replies)
-
-    # Calculate average replies to threads started
-    total_replies = sum(len(replies) for replies in replies_per_thread.values())
-    threads_started = user_threads["started"]
-    avg_replies = total_replies / threads_started if threads_started > 0 else 0
-
-    # Generate the report
-    top_channels = channel_post_counts.most_common(5)
-    top_reaction_given = user_reactions_given.most_common(1)
-    top_reaction_received = reactions_received.most_common(1)
-    top_co_posters = [
-        (user_mappings.get(user, user), count)
-        for user, count in co_posters.most_common(3)
-    ]
-
-    report = {
-        "user": user_mappings.get(user_id, user_id),
-        "threads_started": threads_started,
-        "replies": user_threads["replied"],
-        "top_channels": top_channels,
-        "most_used_reaction": top_reaction_given[0] if top_reaction_given else None,
-        "most_reactions_received": top_reaction_received[0]
-        if top_reaction_received
-        else None,
-        "top_co_posters": top_co_posters,
-        "average_replies_to_threads_started": round(avg_replies, 2),
-        "engagement_received": sum(reactions_received.values()) + total_replies,
-    }
 
-    return report
+def generate_wrapped(zip_file_path, user_id, message_cache=None):
+    return generate_wrapped_reports(zip_file_path, [user_id], message_cache)[user_id]
 
-def find_top_contributors(zip_file_path):
-    # Unpack the zip file
-    extract_dir = "/tmp/slack_export"
-    os.makedirs(extract_dir, exist_ok=True)
-
-    with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
-        zip_ref.extractall(extract_dir)
-
-    # Load user mappings
-    users_file = os.path.join(extract_dir, "users.json")
-    if not os.path.exists(users_file):
-        raise FileNotFoundError(f"No 'users.json' file found in {zip_file_path}.")
-    user_mappings = load_users_mapping(users_file)
-
-    # Parse channels and analyze data
-    channels_file = os.path.join(extract_dir, "channels.json")
-    if not os.path.exists(channels_file):
-        raise FileNotFoundError(f"No 'channels.json' file found in {zip_file_path}.")
-    with open(channels_file, "r", encoding="utf-8") as f:
-        channels = json.load(f)
-
-    # Counters for thread creators and repliers
-    thread_creators = Counter()
-    repliers = Counter()
-    ignored_users = []
-
-    for channel in channels:
-        channel_name = channel["name"]
-        channel_dir = os.path.join(extract_dir, channel_name)
-        if not os.path.exists(channel_dir):
-            continue
 
-        for file_name in os.listdir(channel_dir):
-            if not file_name.endswith(".json"):
-                continue
-
-            with open(os.path.join(channel_dir, file_name), "r", encoding="utf-8") as f:
-                messages = json.load(f)
-
-            threads = {}
-            for message in messages:
-                # Skip messages without a timestamp
-                if "ts" not in message:
-                    continue
-
-                thread_ts = message.get("thread_ts", message["ts"])
-                if thread_ts not in threads:
-                    threads[thread_ts] = []
-                threads[thread_ts].append(message)
-
-            for thread_ts, thread_messages in threads.items():
-                thread_owner = thread_messages[0].get("user", "")
-                if thread_owner and thread_owner not in ignored_users:
-                    thread_creators[thread_owner] += 1
-
-                for message in thread_messages[1:]:  # Exclude the thread starter
-                    user = message.get("user", "")
-                    if user and user not in ignored_users:
-                        repliers[user] += 1
-
-    # Get top 5 thread creators and repliers
-    top_thread_creators = [
-        (user_mappings.get(user, user), count)
-        for user, count in thread_creators.most_common(5)
-    ]
-    top_repliers = [
-        (user_mappings.get(user, user), count)
-        for user, count in repliers.most_common(5)
-    ]
-
-    return {
-        "top_thread_creators": top_thread_creators,
-        "top_repliers": top_repliers,
-    }
+def find_top_contributors(zip_file_path, message_cache=None):
+    top_contributors = TopContributors()
+    with open_export(zip_file_path, message_cache) as export:
+        scan_export(export, [top_contributors])
+    return top_contributors.result()
 
 
-def calculate_base_stats(zip_file_path, excluded_user_ids):
-    """Calculate base stats for all users and save them."""
-    extract_dir = "/tmp/slack_export"
-    os.makedirs(extract_dir, exist_ok=True)
-
-    with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
-        zip_ref.extractall(extract_dir)
-
-    # Load user mappings
-    users_file = os.path.join(extract_dir, "users.json")
-    if not os.path.exists(users_file):
-        raise FileNotFoundError("No 'users.json' file found.")
-    user_mappings = load_users_mapping(users_file)
-
-    # Parse channels
-    channels_file = os.path.join(extract_dir, "channels.json")
-    if not os.path.exists(channels_file):
-        raise FileNotFoundError("No 'channels.json' file found.")
-    with open(channels_file, "r", encoding="utf-8") as f:
-        channels = json.load(f)
-
-    user_stats = defaultdict(lambda: {
-        "threads_started": 0,
-        "replies": 0,
-        "engagement_received": 0,
-        "reactions_received": Counter(),
-        "reactions_given": Counter(),
-        "co_posters": Counter(),
-        "top_channels": Counter(),
-    })
-
-    for channel in channels:
-        channel_name = channel["name"]
-        print("Processing channel:", channel_name)
-        channel_dir = os.path.join(extract_dir, channel_name)
-        if not os.path.exists(channel_dir):
+# Day files per scan task (and process-pool task), so one huge channel is still spread over several workers
+DAY_FILES_PER_TASK = 32
+
+# Day files larger than this (uncompressed) are streamed instead of read whole
+STREAM_DAY_FILE_BYTES = 64 * 1024 * 1024
+
+
+def _add_threads(aggregators, position, channel_name, threads, thread_index, deferred):
+    """Feed thread parts to the aggregators, deferring the parts of threads started before this task."""
+    for thread_ts, thread_messages in threads:
+        earlier = thread_index.get(thread_ts)
+        if earlier is None and thread_messages[0]["ts"] != thread_ts:
+            deferred.append((thread_ts, thread_messages))
             continue
+        for aggregator in aggregators:
+            aggregator.add_thread(position, channel_name, thread_ts, thread_messages, earlier)
+        thread_index.add(thread_ts, thread_messages, earlier)
+    for aggregator in aggregators:
+        aggregator.end_day_file()
+
+
+def _stream_day_file(aggregators, position, channel_name, export, file_name, report, thread_index, deferred):
+    """Scan one day file while it is decompressed and decoded, without holding it in memory.
+
+    Decoding, grouping and aggregating are interleaved here, so unzip time is
+    part of decode and the stage times are separated afterwards. Returns the
+    number of messages.
+    """
+    count = 0
+
+    def counted(messages):
+        nonlocal count
+        for message in messages:
+            count += 1
+            yield message
+
+    stages = report.stages
+    decode_before, group_before = stages["decode"], stages["group"]
+    start = time.perf_counter()
+    with export.open_day_file(channel_name, file_name) as f:
+        messages = report.timed("decode", counted(json_decoder.iter_messages(f)))
+        threads = report.timed("group", group_threads(messages))
+        _add_threads(aggregators, position, channel_name, threads, thread_index, deferred)
+    grouping = stages["group"] - group_before  # includes the decoding it pulled through
+    stages["group"] -= stages["decode"] - decode_before
+    stages["aggregate"] += time.perf_counter() - start - grouping
+    return count
+
+
+def _scan_day_files(aggregators, position, channel_name, export, file_names, report):
+    """Group each of a channel's day files into threads and feed them to the aggregators.
+
+    Returns the ThreadIndex of the threads started in these day files, and the
+    deferred parts of threads started before them, for _continue_threads.
+    """
+    thread_index = ThreadIndex()
+    deferred = []
+    for file_name in file_names:
+        start = time.perf_counter()
+        if export.day_file_size(channel_name, file_name) > STREAM_DAY_FILE_BYTES:
+            count = _stream_day_file(aggregators, position, channel_name, export, file_name, report, thread_index, deferred)
+        else:
+            with report.stage("unzip"):
+                data = export.read_day_file(channel_name, file_name)
+            with report.stage("decode"):
+                messages = json_decoder.decode_messages(data)
+            with report.stage("group"):
+                threads = list(group_threads(messages))
+            with report.stage("aggregate"):
+                _add_threads(aggregators, position, channel_name, threads, thread_index, deferred)
+            count = len(messages)
+        report.day_file(channel_name, file_name, count, time.perf_counter() - start)
+    return thread_index, deferred
+
+
+def _continue_threads(aggregators, position, channel_name, channel_index, thread_index, deferred):
+    """Add a task's threads to its channel's index, then feed the task's deferred parts against it."""
+    channel_index.update(thread_index)
+    for thread_ts, thread_messages in deferred:
+        earlier = channel_index.get(thread_ts)  # None if the thread's parent isn't in the export
+        for aggregator in aggregators:
+            aggregator.add_thread(position, channel_name, thread_ts, thread_messages, earlier)
+        channel_index.add(thread_ts, thread_messages, earlier)
+    if deferred:
+        for aggregator in aggregators:
+            aggregator.end_day_file()
+
+
+_worker_state = {}
+
+
+def _init_scan_worker(zip_file_path, prototypes):
+    _worker_state["export"] = SlackExport(zip_file_path)
+    _worker_state["prototypes"] = prototypes
+
+
+def _scan_task(task):
+    position, channel_name, file_names = task
+    aggregators = [prototype.empty() for prototype in _worker_state["prototypes"]]
+    report = RunReport()
+    thread_index, deferred = _scan_day_files(aggregators, position, channel_name, _worker_state["export"], file_names, report)
+    return aggregators, thread_index, deferred, report
+
+
+def _scan_serial(export, aggregators, tasks, report):
+    for position, channel_name, file_names in tasks:
+        yield _scan_day_files(aggregators, position, channel_name, export, file_names, report)
+
+
+def _scan_pool(export, aggregators, tasks, report, workers):
+    prototypes = [aggregator.empty() for aggregator in aggregators]
+    with multiprocessing.Pool(workers, _init_scan_worker, (export.zip_file_path, prototypes)) as pool:
+        for partials, thread_index, deferred, task_report in pool.imap(_scan_task, tasks):
+            with report.stage("aggregate"):
+                for aggregator, partial in zip(aggregators, partials):
+                    aggregator.merge(partial)
+            report.merge(task_report)
+            yield thread_index, deferred
+
+
+def scan_export(export, aggregators, pending=None, workers=1, verbose=False, report=None, thread_indexes=None):
+    """Run every aggregator over one shared pass of the export.
+
+    pending lists (channel_name, day_files) to scan, by default every day file
+    of every channel in channels.json. With workers > 1 (or None for one per
+    CPU) the day files are scanned in a process pool and the partial
+    aggregators are merged in scan order. Timings go to report, if given.
+
+    Either way the day files are scanned in tasks of DAY_FILES_PER_TASK, and
+    the parts of threads that started in an earlier task are fed to the
+    aggregators once the task is done, against the channel's ThreadIndex, so
+    the serial and parallel results are identical. Pass thread_indexes (a dict
+    of channel name to ThreadIndex) to start from and keep the indexes, e.g.
+    to resume on a later export; otherwise each one is dropped after its channel.
+
+    export can also be a MessageTable, which is scanned by scan_table.
+    """
+    if isinstance(export, MessageTable):
+        return scan_table(export, aggregators, pending, verbose, report, thread_indexes)
+
+    if report is None:
+        report = RunReport()
+    with export.open("users.json") as users_file:
+        user_mappings = load_users_mapping(users_file)
+    if pending is None:
+        pending = [(channel["name"], export.day_files.get(channel["name"], [])) for channel in export.channels()]
+
+    channel_names = [channel_name for channel_name, _ in pending]
+    for aggregator in aggregators:
+        aggregator.start(export, channel_names, user_mappings)
+
+    tasks = []
+    for position, (channel_name, file_names) in enumerate(pending):
+        for task_start in range(0, len(file_names), DAY_FILES_PER_TASK):
+            tasks.append((position, channel_name, file_names[task_start:task_start + DAY_FILES_PER_TASK]))
+
+    start = time.perf_counter()
+    with report.profiled():
+        if workers == 1:
+            scanned = _scan_serial(export, aggregators, tasks, report)
+        else:
+            scanned = _scan_pool(export, aggregators, tasks, report, workers)
+
+        last_position = None
+        for (position, channel_name, _), (thread_index, deferred) in zip(tasks, scanned):
+            if position != last_position:
+                if verbose:
+                    print("Processing channel:", channel_name)
+                if thread_indexes is None:
+                    channel_index = ThreadIndex()
+                else:
+                    channel_index = thread_indexes.setdefault(channel_name, ThreadIndex())
+                last_position = position
+            with report.stage("aggregate"):
+                _continue_threads(aggregators, position, channel_name, channel_index, thread_index, deferred)
+    report.scan_seconds += time.perf_counter() - start
+
+
+def scan_table(table, aggregators, pending=None, verbose=False, report=None, thread_indexes=None):
+    """scan_export over a MessageTable: the same thread parts in the same order, without any JSON.
+
+    Aggregators get every part at once through add_table, so the vectorized
+    ones (BaseStats, TopContributors) run as group-bys over the columns.
+    """
+    if report is None:
+        report = RunReport()
+    if pending is None:
+        pending = [(channel["name"], table.day_files.get(channel["name"], [])) for channel in table.channels()]
+
+    channel_names = [channel_name for channel_name, _ in pending]
+    for aggregator in aggregators:
+        aggregator.start(table, channel_names, table.user_mappings())
+
+    start = time.perf_counter()
+    with report.profiled():
+        with report.stage("group"):
+            parts = table.thread_parts(pending, DAY_FILES_PER_TASK, thread_indexes)
+        for aggregator in aggregators:
+            if verbose:
+                print("Running", type(aggregator).__name__)
+            with report.stage("aggregate"):
+                aggregator.add_table(parts)
+    report.files += parts.files
+    report.messages += parts.message_count
+    report.scan_seconds += time.perf_counter() - start
+
+
+def _dump_json_items(items, f):
+    """Write (key, value) pairs exactly like json.dump(dict(items), f, indent=2), without building the dict."""
+    separator = "{\n  "
+    for key, value in items:
+        f.write(separator)
+        f.write(json.dumps(key) + ": " + json.dumps(value, indent=2).replace("\n", "\n  "))
+        separator = ",\n  "
+    f.write("{}" if separator == "{\n  " else "\n}")
+
+
+def _load_base_state(state_file):
+    """Load the raw aggregates, day file manifest and thread indexes saved by a previous run, if any."""
+    if not state_file or not os.path.exists(state_file):
+        return AggregateStore(), {}, {}
+
+    with np.load(state_file) as state:
+        manifest = json.loads(state["manifest"].tobytes())
+        store = AggregateStore.from_arrays(state)
+        thread_indexes = thread_indexes_from_arrays(state) if "thread_ts" in state.files else {}
+    return store, manifest, thread_indexes
+
+
+def _save_base_state(state_file, store, manifest, thread_indexes):
+    """Save the unfinalized aggregates, the manifest of processed day files and the thread indexes."""
+    manifest = json.dumps(manifest).encode("utf-8")
+
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, "wb") as f:
+        np.savez_compressed(
+            f,
+            manifest=np.frombuffer(manifest, dtype=np.uint8),
+            **store.to_arrays(),
+            **thread_indexes_to_arrays(thread_indexes),
+        )
+    os.replace(tmp_file, state_file)
+
+
+def calculate_base_stats(
+    zip_file_path, excluded_user_ids, workers=1, state_file=None, aggregators=(), report=None, message_cache=None,
+    output_dir=".", verbose=True,
+):
+    """Calculate base stats for all users and save them.
+
+    With workers > 1 (or None for one per CPU) the channels are processed in a
+    process pool. Partial stats are merged in channel order, so base_stats.json
+    is identical to the serial run.
+
+    With a state_file, the raw aggregates, the manifest of processed day files
+    and the channels' thread indexes are kept there between runs, and a later
+    export only costs its new day files (replies to older threads included).
+
+    With a message_cache file, the export is scanned from its MessageTable,
+    which is built (parsing the JSON) only when the export changed.
+
+    base_stats.json, user_activity.json and channel_activity.json (the
+    activity histograms of every user and channel) and channel_posts.json
+    (each channel's posters by posts) are written to output_dir.
+    Extra aggregators (e.g. TopContributors) are filled on the same pass.
+    Stage timings and throughput go to report (a RunReport), if given.
+    """
+    if report is None:
+        report = RunReport()
+    store, manifest, thread_indexes = _load_base_state(state_file)
+    if aggregators and manifest:
+        raise ValueError("Extra aggregators need every day file, so they can't resume from a state file.")
+    base_stats = BaseStats(store)
+
+    with open_export(zip_file_path, message_cache, report) as export:
+        # Parse channels
+        channels = export.channels()
+
+        # Skip day files that a previous run already processed
+        pending = []
+        changed_files = 0
+        for channel in channels:
+            channel_name = channel["name"]
+            file_names = []
+            for file_name in export.day_files.get(channel_name, []):
+                day_key = f"{channel_name}/{file_name}"
+                checksum = export.checksum(channel_name, file_name)
+                if day_key not in manifest:
+                    manifest[day_key] = checksum
+                    file_names.append(file_name)
+                elif manifest[day_key] != checksum:
+                    changed_files += 1
+            pending.append((channel_name, file_names))
+
+        if changed_files:
+            print(f"Warning: {changed_files} day files changed since they were processed. "
+                  "Their earlier contents are kept; run without the state file to recount them.")
+
+        scan_export(
+            export, [base_stats, *aggregators], pending, workers, verbose=verbose, report=report,
+            thread_indexes=thread_indexes if state_file else None,
+        )
+
+    if state_file:
+        with report.stage("write"):
+            _save_base_state(state_file, store, manifest, thread_indexes)
+
+    # Finalize and save base stats, one user at a time
+    finalized_before = report.stages["finalize"]
+    with report.stage("write"), open(os.path.join(output_dir, "base_stats.json"), "w") as f:
+        _dump_json_items(report.timed("finalize", base_stats.result(excluded_user_ids)), f)
+    report.stages["write"] -= report.stages["finalize"] - finalized_before  # Finalizing ran inside the write
+
+    # Each user's and channel's activity by month, weekday and hour
+    with report.stage("write"), open(os.path.join(output_dir, "user_activity.json"), "w") as f:
+        _dump_json_items(base_stats.user_activity(), f)
+    with report.stage("write"), open(os.path.join(output_dir, "channel_activity.json"), "w") as f:
+        _dump_json_items(base_stats.channel_activity(), f)
+
+    # Every poster of each channel, for the per-channel leaderboards
+    with report.stage("write"), open(os.path.join(output_dir, "channel_posts.json"), "w") as f:
+        _dump_json_items(base_stats.channel_posts(), f)
+
+
+def calculate_percentiles(base_stats_file, excluded_user_ids, report=None, output_dir="."):
+    """Calculate percentile stats, excluding certain users from percentile contributions.
+
+    A user's percentile is their rank among the active, non-excluded users (one
+    more than the number of them with a higher value) as a share of those users,
+    rounded up: tied users share the best rank of their group and inactive users
+    get 100. The leader gets 100 / active users rounded up, so they are only in
+    the top 1% with at least 100 active users (with 4 they get 25).
+    """
+    if report is None:
+        report = RunReport()
+    with report.stage("percentiles"):
+        base_stats = _rank_percentiles(base_stats_file, excluded_user_ids)
+
+    # Save final stats
+    with report.stage("write"), open(os.path.join(output_dir, "final_stats.json"), "w") as f:
+        json.dump(base_stats, f, indent=2)
+
 
-        for file_name in os.listdir(channel_dir):
-            if not file_name.endswith(".json"):
-                continue
-
-            with open(os.path.join(channel_dir, file_name), "r", encoding="utf-8") as f:
-                messages = json.load(f)
-
-            threads = {}
-            for message in messages:
-                if "ts" not in message:
-                    continue
-                thread_ts = message.get("thread_ts", message["ts"])
-                threads.setdefault(thread_ts, []).append(message)
-
-            for thread_ts, thread_messages in threads.items():
-                thread_owner = thread_messages[0].get("user", "")
-                if thread_owner:
-                    user_stats[thread_owner]["threads_started"] += 1
-                    user_stats[thread_owner]["top_channels"][channel_name] += 1
-
-                thread_users = set()
-                for message in thread_messages:
-                    user = message.get("user", "")
-                    if user:
-                        thread_users.add(user)
-                        user_stats[user]["replies"] += 1
-                        user_stats[user]["top_channels"][channel_name] += 1
-
-                    # Track reactions received
-                    for reaction in message.get("reactions", []):
-                        if user:
-                            user_stats[message.get("user", "")]["reactions_received"][reaction["name"]] += len(reaction["users"])
-
-                    # Track reactions given
-                    for reaction in message.get("reactions", []):
-                        for reactor in reaction.get("users", []):
-                            user_stats[reactor]["reactions_given"][reaction["name"]] += 1
-
-                # Track co-posters
-                for user in thread_users:
-                    for other_user in thread_users:
-                        if user != other_user and other_user not in excluded_user_ids:
-                            user_stats[user]["co_posters"][other_user] += 1
-
-    # Finalize stats
-    for user, stats in user_stats.items():
-        stats["most_reactions_received"] = stats["reactions_received"].most_common(1)
-        stats["most_used_reaction"] = stats["reactions_given"].most_common(1)
-        stats["top_channels"] = stats["top_channels"].most_common(5)
-        stats["top_co_posters"] = stats["co_posters"].most_common(3)
-
-        # Calculate total engagement (replies + reactions received)
-        total_replies = stats["replies"]
-        total_reactions = sum(stats["reactions_received"].values())
-        stats["engagement_received"] = total_replies + total_reactions
-
-        # Simplify reaction stats
-        stats.pop("reactions_received", None)
-        stats.pop("reactions_given", None)
-        stats.pop("co_posters", None)
-
-
-    # Save base stats
-    with open("base_stats.json", "w") as f:
-        json.dump(user_stats, f, indent=2)
-
-
-
-def calculate_percentiles(base_stats_file, excluded_user_ids):
-    """Calculate percentile stats, excluding certain users from percentile contributions."""
+def _rank_percentiles(base_stats_file, excluded_user_ids):
     with open(base_stats_file, "r") as f:
         base_stats = json.load(f)
 
     stats_keys = ["threads_started", "replies", "engagement_received"]
+    users = list(base_stats)
+    values = {
+        key: np.fromiter((base_stats[user].get(key, 0) for user in users), dtype=np.int64, count=len(users))
+        for key in stats_keys
+    }
 
-    # Prepare lists for active users only, excluding specified user IDs
-    active_stats_data = {key: [] for key in stats_keys}
-    for user, stats in base_stats.items():
-        if user not in excluded_user_ids and (stats["threads_started"] > 0 or stats["replies"] > 0):
-            for key in stats_keys:
-                active_stats_data[key].append(stats.get(key, 0))
-
-    # Calculate percentiles based on non-excluded users
-    percentiles = {key: np.percentile(active_stats_data[key], np.arange(0, 101)) for key in stats_keys}
-
-    # Assign percentile ranks for all users, including excluded ones
-    for user, stats in base_stats.items():
-        if stats["threads_started"] > 0 or stats["replies"] > 0:
-            for key in stats_keys:
-                user_value = stats.get(key, 0)
-                # Percentile is calculated based on non-excluded users
-                stats[f"{key}_percentile"] = 101 - int(np.searchsorted(percentiles[key], user_value, side="right"))
+    # Rank everyone against the active users only, leaving out the excluded IDs
+    excluded_user_ids = set(excluded_user_ids)
+    active = (values["threads_started"] > 0) | (values["replies"] > 0)
+    excluded = np.fromiter((user in excluded_user_ids for user in users), dtype=bool, count=len(users))
+    reference = active & ~excluded
+
+    for key in stats_keys:
+        ranked = np.sort(values[key][reference])
+        if len(ranked):
+            # Tied users all get the best rank of their group: one more than the users strictly above them
+            strictly_above = len(ranked) - np.searchsorted(ranked, values[key], side="right")
+            percentiles = np.clip((100 * (strictly_above + 1) + len(ranked) - 1) // len(ranked), 1, 100)
         else:
-            # Inactive users get 0 for all percentile stats
-            for key in stats_keys:
-                stats[f"{key}_percentile"] = 0
+            percentiles = np.full(len(users), 100)
+        percentiles[~active] = 100
+
+        for user, percentile in zip(users, percentiles.tolist()):
+            base_stats[user][f"{key}_percentile"] = percentile
+    return base_stats
+
+
+def prep_export(
+    zip_file_path, output_dir=".", excluded_user_ids=(), workers=1, state_file=None, message_cache=None,
+    profile_file=None, verbose=True,
+):
+    """Run every prep step for one export and return its RunReport.
+
+    Writes base_stats.json, user_activity.json, channel_activity.json,
+    channel_posts.json, top_contributors.json, final_stats.json and
+    run_report.json to output_dir, so exports prepped into different
+    directories never touch each other's files.
+    """
+    report = RunReport(profile_file)
+
+    ## Step 1: Calculate base stats
+    # The workspace leaderboards ride along on the same pass (they need every day file,
+    # so they are skipped when resuming from a state file)
+    top_contributors = TopContributors()
+    calculate_base_stats(
+        zip_file_path, excluded_user_ids, workers, state_file, [] if state_file else [top_contributors], report,
+        message_cache, output_dir, verbose,
+    )
+    if not state_file:
+        with open(os.path.join(output_dir, "top_contributors.json"), "w") as f:
+            json.dump(top_contributors.result(), f, indent=2)
+
+    # Step 2: Calculate percentiles
+    calculate_percentiles(os.path.join(output_dir, "base_stats.json"), excluded_user_ids, report, output_dir)
+
+    report.write(os.path.join(output_dir, "run_report.json"))
+    return report
 
-    # Save final stats
-    with open("final_stats.json", "w") as f:
-        json.dump(base_stats, f, indent=2)
 
-def fix_zeros():
-    with open("final_stats.json", "r") as f:
-        final_stats = json.load(f)
-    
-    for user, stats in final_stats.items():
-        if stats['engagement_received_percentile'] == 0:
-            if stats['engagement_received'] > 0:
-                stats['engagement_received_percentile'] = 1
-            else:
-                stats['engagement_received_percentile'] = 100
-        if stats['replies_percentile'] == 0:
-            if stats['replies'] > 0:
-                stats['replies_percentile'] = 1
-            else:
-                stats['replies_percentile'] = 100
-        if stats['threads_started_percentile'] == 0:
-            if stats['threads_started'] > 0:
-                stats['threads_started_percentile'] = 1
-            else:
-                stats['threads_started_percentile'] = 100
-    
-    with open("final_stats.json", "w") as f:
-        json.dump(final_stats, f, indent=2)
-
-
-# If you want to exclude any users from calculations, add their user IDs to this list
-excluded_user_ids = []
-
-## Step 1: Calculate base stats
-zip_file_path = "exports/slack_workspace.zip"
-calculate_base_stats(zip_file_path, excluded_user_ids)
-
-# Step 2: Calculate percentiles
-calculate_percentiles("base_stats.json", excluded_user_ids)
-fix_zeros()
-
-# Output is saved in final_stats.json
+if __name__ == "__main__":
+    # If you want to exclude any users from calculations, add their user IDs to this list
+    excluded_user_ids = []
+
+    # Worker processes for step 1 (None uses one per CPU core)
+    workers = 1
+
+    # Set a state file (e.g. "base_state.npz") to keep raw aggregates between runs,
+    # so re-running on a newer export only processes the new day files
+    state_file = None
+
+    # Set a cache file (e.g. "slack_workspace.messages.npz") to parse the export only once:
+    # later runs on the same export read its message table instead of the JSON
+    message_cache = None
+
+    # Set a file name (e.g. "prep.prof") to run the scan under cProfile
+    profile_file = None
+
+    zip_file_path = "exports/slack_workspace.zip"
+    report = prep_export(zip_file_path, ".", excluded_user_ids, workers, state_file, message_cache, profile_file)
+
+    # Output is saved in final_stats.json, with timings and throughput in run_report.json
+    # (to prep several exports at once, see batch_prep.py)
+    print(report.summary())
@@ -0,0 +1,159 @@
+import heapq
+import json
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ("unzip", "decode", "ingest", "group", "aggregate", "finalize", "percentiles", "write")
+
+# Slowest day files kept in the report
+SLOWEST_DAY_FILES = 20
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and of its finished children (pool workers), or None where unsupported."""
+    if resource is None:
+        return None
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # bytes on macOS, KB elsewhere
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return round(peak / scale, 1)
+
+
+class RunReport:
+    """Timings and throughput of a prep run, written out as a JSON run report.
+
+    Stage times are summed over every process, so with a process pool they add
+    up to more than the wall time. Pool workers fill their own RunReport per
+    task, which is merged into the parent's.
+    """
+
+    def __init__(self, profile_file=None):
+        self.profile_file = profile_file
+        self.started = time.time()
+        self.scan_seconds = 0.0  # wall time of the scans over the export
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.files = 0
+        self.messages = 0
+        self.channels = {}  # channel name -> [day files, messages, seconds]
+        self.slowest = []  # min-heap of (seconds, channel, day file, messages)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def timed(self, name, items):
+        """Iterate items, charging the time spent producing each one to a stage."""
+        items = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+            yield item
+
+    def day_file(self, channel_name, file_name, messages, seconds):
+        self.files += 1
+        self.messages += messages
+        totals = self.channels.setdefault(channel_name, [0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += messages
+        totals[2] += seconds
+        self._keep_slowest((seconds, channel_name, file_name, messages))
+
+    def _keep_slowest(self, entry):
+        if len(self.slowest) < SLOWEST_DAY_FILES:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def merge(self, other):
+        for name, seconds in other.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.files += other.files
+        self.messages += other.messages
+        for channel_name, (files, messages, seconds) in other.channels.items():
+            totals = self.channels.setdefault(channel_name, [0, 0, 0.0])
+            totals[0] += files
+            totals[1] += messages
+            totals[2] += seconds
+        for entry in other.slowest:
+            self._keep_slowest(entry)
+
+    @contextmanager
+    def profiled(self):
+        """Run the block under cProfile when a profile_file was given (for pstats or snakeviz)."""
+        if not self.profile_file:
+            yield
+            return
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(self.profile_file)
+
+    def to_dict(self):
+        wall = time.time() - self.started
+        busy = sum(self.stages[name] for name in ("unzip", "decode", "ingest", "group", "aggregate"))
+
+        def rate(count, seconds):
+            return round(count / seconds, 1) if seconds else None
+
+        channels = [
+            {
+                "channel": channel_name,
+                "files": files,
+                "messages": messages,
+                "seconds": round(seconds, 3),
+                "messages_per_second": rate(messages, seconds),
+            }
+            for channel_name, (files, messages, seconds) in self.channels.items()
+        ]
+        return {
+            "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            "wall_seconds": round(wall, 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "files": self.files,
+            "messages": self.messages,
+            "scan_seconds": round(self.scan_seconds, 3),
+            "files_per_second": rate(self.files, self.scan_seconds),
+            "messages_per_second": rate(self.messages, self.scan_seconds),
+            "messages_per_process_second": rate(self.messages, busy),
+            "stages": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+            "channels": sorted(channels, key=lambda channel: -channel["seconds"]),
+            "slowest_day_files": [
+                {"channel": channel_name, "file": file_name, "messages": messages, "seconds": round(seconds, 3)}
+                for seconds, channel_name, file_name, messages in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary(self):
+        report = self.to_dict()
+        stages = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in report["stages"].items() if seconds)
+        return (
+            f"{report['files']} day files, {report['messages']} messages in {report['wall_seconds']:.1f}s "
+            f"({report['messages_per_second']} messages/s while scanning); {stages}; peak RSS {report['peak_rss_mb']} MB"
+        )
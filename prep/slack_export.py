@@ -0,0 +1,89 @@
+import zipfile
+from collections import defaultdict
+
+import json_decoder
+
+
+class SlackExport:
+    """Read a Slack export zip in place, without extracting it to disk.
+
+    Day files are decoded one at a time straight from the zip members, so the
+    export never needs scratch space and concurrent runs share no state.
+    """
+
+    def __init__(self, zip_file_path):
+        self.zip_file_path = zip_file_path
+        self.zip_ref = zipfile.ZipFile(zip_file_path, "r")
+
+        # Map each channel directory to its day files, in date order (they are named YYYY-MM-DD.json):
+        # threads carrying on into later days must be seen from their first day on
+        self.day_files = defaultdict(list)
+        for name in self.zip_ref.namelist():
+            parts = name.split("/")
+            if len(parts) < 2:
+                continue
+            channel_files = self.day_files[parts[0]]
+            if len(parts) == 2 and parts[1].endswith(".json"):
+                channel_files.append(parts[1])
+        for channel_files in self.day_files.values():
+            channel_files.sort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.zip_ref.close()
+
+    def open(self, name):
+        """Open a top-level export file such as users.json as a binary stream."""
+        try:
+            return self.zip_ref.open(name)
+        except KeyError:
+            raise FileNotFoundError(f"No '{name}' file found in {self.zip_file_path}.") from None
+
+    def read_json(self, name):
+        with self.open(name) as f:
+            return json_decoder.load(f)
+
+    def channels(self):
+        return self.read_json("channels.json")
+
+    def checksum(self, channel_name, file_name):
+        """CRC-32 of a day file as recorded in the zip, to tell whether it changed between exports."""
+        return self.zip_ref.getinfo(f"{channel_name}/{file_name}").CRC
+
+    def day_file_size(self, channel_name, file_name):
+        """Uncompressed size of a day file in bytes."""
+        return self.zip_ref.getinfo(f"{channel_name}/{file_name}").file_size
+
+    def read_day_file(self, channel_name, file_name):
+        """Return the raw bytes of one day file."""
+        return self.zip_ref.read(f"{channel_name}/{file_name}")
+
+    def open_day_file(self, channel_name, file_name):
+        """Open one day file as a binary stream, decompressed as it is read."""
+        return self.zip_ref.open(f"{channel_name}/{file_name}")
+
+    def iter_channel(self, channel_name, file_names=None, fields=json_decoder.MESSAGE_FIELDS):
+        """Yield (day_file, messages) for the day files of one channel (all of them by default).
+
+        Messages only carry `fields`; pass fields=None for the full payloads.
+        """
+        if file_names is None:
+            file_names = self.day_files.get(channel_name, [])
+        for file_name in file_names:
+            with self.zip_ref.open(f"{channel_name}/{file_name}") as f:
+                messages = json_decoder.load_messages(f, fields)
+            yield file_name, messages
+
+    def iter_messages(self, channels=None, fields=json_decoder.MESSAGE_FIELDS):
+        """Yield (channel, day_file, messages) for every day file in the export."""
+        if channels is None:
+            channels = self.channels()
+        for channel in channels:
+            channel_name = channel["name"]
+            for file_name, messages in self.iter_channel(channel_name, fields=fields):
+                yield channel_name, file_name, messages
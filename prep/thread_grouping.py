@@ -0,0 +1,184 @@
+import heapq
+import os
+import pickle
+import sys
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+
+# Messages grouped in memory before spilling to disk; slim messages take a
+# few hundred bytes each, so this is roughly a 250 MB budget
+MAX_GROUPED_MESSAGES = 500_000
+
+# Records per pickle in a spill file, i.e. what each run holds in memory while merging
+SPILL_BLOCK = 4096
+
+_record_key = itemgetter(0, 1)
+
+
+def _thread_ts(message):
+    return message.get("thread_ts", message["ts"])
+
+
+def group_threads(messages, max_grouped=None, spill_dir=None):
+    """Yield (thread_ts, thread_messages) for a day file's messages, skipping messages without a ts.
+
+    Threads come out in the order of their first message, each thread's
+    messages in file order. Up to max_grouped (default MAX_GROUPED_MESSAGES)
+    messages are grouped in memory; past that they are spilled to sorted runs
+    in a temporary directory (under spill_dir, if given) and merged back, so
+    memory stays bounded however large the day file is.
+    """
+    if max_grouped is None:
+        max_grouped = MAX_GROUPED_MESSAGES
+    messages = iter(messages)
+    threads = {}
+    grouped = 0
+    for message in messages:
+        if "ts" not in message:
+            continue
+        threads.setdefault(_thread_ts(message), []).append(message)
+        grouped += 1
+        if grouped >= max_grouped:
+            yield from _group_spilled(threads, messages, max_grouped, spill_dir)
+            return
+    yield from threads.items()
+
+
+def _read_run(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                block = pickle.load(f)
+            except EOFError:
+                return
+            yield from block
+
+
+def _group_spilled(threads, messages, max_grouped, spill_dir):
+    """External group-by: sort (thread number, message number, message) records into runs, then merge the runs."""
+    # Only the thread numbers stay in memory: thread_ts -> order of the thread's first message
+    thread_numbers = {}
+    buffer = []
+    for thread_ts, thread_messages in threads.items():
+        thread_number = thread_numbers[thread_ts] = len(thread_numbers)
+        for message in thread_messages:
+            buffer.append((thread_number, len(buffer), message))
+    threads.clear()
+    sequence = len(buffer)
+
+    with tempfile.TemporaryDirectory(prefix="slack-wrapped-", dir=spill_dir) as spill_path:
+        runs = []
+
+        def spill():
+            buffer.sort(key=_record_key)
+            path = os.path.join(spill_path, f"run-{len(runs)}.pickle")
+            with open(path, "wb") as f:
+                for start in range(0, len(buffer), SPILL_BLOCK):
+                    pickle.dump(buffer[start:start + SPILL_BLOCK], f, pickle.HIGHEST_PROTOCOL)
+            runs.append(path)
+            buffer.clear()
+
+        spill()
+        for message in messages:
+            if "ts" not in message:
+                continue
+            thread_ts = _thread_ts(message)
+            thread_number = thread_numbers.get(thread_ts)
+            if thread_number is None:
+                thread_number = thread_numbers[thread_ts] = len(thread_numbers)
+            buffer.append((thread_number, sequence, message))
+            sequence += 1
+            if len(buffer) >= max_grouped:
+                spill()
+        thread_numbers.clear()
+        buffer.sort(key=_record_key)
+
+        merged = heapq.merge(*(_read_run(path) for path in runs), buffer, key=_record_key)
+        for _, records in groupby(merged, key=itemgetter(0)):
+            thread_messages = [record[2] for record in records]
+            yield _thread_ts(thread_messages[0]), thread_messages
+
+
+class ThreadIndex:
+    """Owner and participants of the threads seen so far in one channel, keyed by thread_ts.
+
+    Day files are grouped one at a time, so a reply posted days after its
+    parent lands in a later thread part. The scan looks the part up here to
+    attribute it to the thread's real owner, and every aggregator gets the
+    same (owner, participants) of the earlier parts. Slack only sets
+    thread_ts on messages that have replies, so lone messages are never
+    stored and the index grows with the channel's threads, not its messages.
+    """
+
+    def __init__(self, threads=None):
+        self.threads = {} if threads is None else threads  # thread_ts -> (owner, participants)
+
+    def __len__(self):
+        return len(self.threads)
+
+    def get(self, thread_ts):
+        return self.threads.get(thread_ts)
+
+    def add(self, thread_ts, thread_messages, earlier=None):
+        """Record a thread part; earlier is what get() returned for it (None for a new thread)."""
+        lone = len(thread_messages) == 1 and "thread_ts" not in thread_messages[0]
+        users = (message.get("user", "") for message in thread_messages)
+        self.add_part(thread_ts, thread_messages[0].get("user", ""), users, lone, earlier)
+
+    def add_part(self, thread_ts, first_user, users, lone=False, earlier=None):
+        """add() for a part given as its first message's user, its users in order and whether it is a lone message."""
+        if earlier is None:
+            if lone:
+                return
+            owner = sys.intern(first_user)
+            participants = {}
+        else:
+            owner, participants = earlier[0], dict.fromkeys(earlier[1])
+        for user in users:
+            if user and user not in participants:
+                participants[sys.intern(user)] = None
+        self.threads[thread_ts] = (owner, tuple(participants))
+
+    def update(self, other):
+        self.threads.update(other.threads)
+
+
+def thread_indexes_to_arrays(thread_indexes):
+    """Flatten {channel_name: ThreadIndex} into NumPy arrays, e.g. for np.savez."""
+    channels, thread_ts, owners, participants, participant_ends = [], [], [], [], []
+    for channel_name, thread_index in thread_indexes.items():
+        for ts, (owner, users) in thread_index.threads.items():
+            channels.append(channel_name)
+            thread_ts.append(ts)
+            owners.append(owner)
+            participants.extend(users)
+            participant_ends.append(len(participants))
+    return {
+        "thread_channels": np.array(channels, dtype=str),
+        "thread_ts": np.array(thread_ts, dtype=str),
+        "thread_owners": np.array(owners, dtype=str),
+        "thread_participants": np.array(participants, dtype=str),
+        "thread_participant_ends": np.array(participant_ends, dtype=np.int64),
+    }
+
+
+def thread_indexes_from_arrays(arrays):
+    """Rebuild {channel_name: ThreadIndex} from the arrays returned by thread_indexes_to_arrays."""
+    thread_indexes = {}
+    participants = arrays["thread_participants"].tolist()
+    start = 0
+    for channel_name, ts, owner, end in zip(
+        arrays["thread_channels"].tolist(),
+        arrays["thread_ts"].tolist(),
+        arrays["thread_owners"].tolist(),
+        arrays["thread_participant_ends"].tolist(),
+    ):
+        thread_index = thread_indexes.get(channel_name)
+        if thread_index is None:
+            thread_index = thread_indexes[channel_name] = ThreadIndex()
+        thread_index.threads[ts] = (owner, tuple(participants[start:end]))
+        start = end
+    return thread_indexes
@@ -0,0 +1,48 @@
+import os
+import random
+import sys
+import zipfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "prep"), os.path.join(ROOT, "bench"), os.path.join(ROOT, "app")]
+
+from make_export import make_export  # noqa: E402
+
+# Small enough to prep in well under a second, with threads carrying on into later days
+SMALL_EXPORT = dict(users=25, channels=4, days=12, messages_per_day=40, thread_fanout=3.0, payload=False, seed=7)
+
+# What calculate_base_stats writes
+BASE_OUTPUTS = ("base_stats.json", "user_activity.json", "channel_activity.json", "channel_posts.json")
+
+
+@pytest.fixture
+def small_export(tmp_path):
+    """Path of a small synthetic export zip; pass make_export settings to override the defaults."""
+
+    def build(name="export.zip", **settings):
+        path = str(tmp_path / name)
+        make_export(path, **{**SMALL_EXPORT, **settings})
+        return path
+
+    return build
+
+
+def read_outputs(directory, names):
+    """{file name: contents} of prep output files in a directory."""
+    outputs = {}
+    for name in names:
+        with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+            outputs[name] = f.read()
+    return outputs
+
+
+def shuffled_copy(zip_file_path, shuffled_path, seed=0):
+    """Rewrite an export with its zip members in random order and nothing else changed."""
+    with zipfile.ZipFile(zip_file_path) as source, zipfile.ZipFile(shuffled_path, "w", zipfile.ZIP_DEFLATED) as target:
+        infos = source.infolist()
+        random.Random(seed).shuffle(infos)
+        for info in infos:
+            target.writestr(info, source.read(info))
+    return shuffled_path
@@ -0,0 +1,18 @@
+import contextlib
+import io
+import os
+
+from batch_prep import run_batch
+from conftest import read_outputs
+
+
+def test_incremental_batch_rerun_without_new_day_files(small_export, tmp_path):
+    zip_file_path = small_export()
+    output_dir = str(tmp_path / "batch")
+    with contextlib.redirect_stdout(io.StringIO()):
+        first = run_batch([zip_file_path], output_dir, workers=1, incremental=True)
+        first_outputs = read_outputs(os.path.join(output_dir, "export"), ("final_stats.json",))
+        second = run_batch([zip_file_path], output_dir, workers=1, incremental=True)
+    assert [job["ok"] for job in first["jobs"] + second["jobs"]] == [True, True]
+    assert second["jobs"][0]["reused_cache"]
+    assert read_outputs(os.path.join(output_dir, "export"), ("final_stats.json",)) == first_outputs
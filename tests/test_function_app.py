@@ -0,0 +1,79 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+import azure.functions as func
+import pytest
+
+import function_app
+from load_test import ACKNOWLEDGEMENT, StubTransport
+from slack_http import ResponseUrlClient
+
+RESPONSE_URL = "https://hooks.slack.com/commands/T1/1/abc"
+
+
+@pytest.fixture
+def app(monkeypatch):
+    """function_app with lookups that take `app.lookup_seconds` and follow-ups going to a StubTransport."""
+    app = SimpleNamespace(lookup_seconds=0.0, transport=StubTransport())
+    monkeypatch.setattr(function_app, "response_client", ResponseUrlClient(transport=app.transport))
+
+    def build_response(user_id, text=""):
+        time.sleep(app.lookup_seconds)
+        return json.dumps({"response_type": "ephemeral", "text": f"Stats for {user_id}"})
+
+    monkeypatch.setattr(function_app, "build_response", build_response)
+    return app
+
+
+def _command(response_url=RESPONSE_URL, headers=None):
+    """Run one /wrapped request through the handler, then wait for its follow-ups; returns (response, seconds to respond)."""
+    body = urlencode({"user_id": "U1", "command": "/wrapped", "response_url": response_url}).encode("utf-8")
+    req = func.HttpRequest(method="POST", url="/api/slack_command", body=body, headers=headers or {})
+
+    async def run():
+        start = time.perf_counter()
+        response = await function_app.slack_command(req)
+        elapsed = time.perf_counter() - start
+        await asyncio.gather(*list(function_app._follow_ups))
+        return response, elapsed
+
+    return asyncio.run(run())
+
+
+def test_fast_lookup_answers_inline(app):
+    response, _ = _command()
+    assert response.status_code == 200
+    assert json.loads(response.get_body())["text"] == "Stats for U1"
+    assert app.transport.posts == 0
+
+
+def test_slow_lookup_is_acknowledged_and_followed_up(app):
+    app.lookup_seconds = 1.0
+    response, elapsed = _command()
+    assert response.status_code == 200
+    assert ACKNOWLEDGEMENT in response.get_body()
+    assert function_app.INLINE_DEADLINE <= elapsed < function_app.INLINE_DEADLINE + 0.3
+    assert app.transport.posts == 1
+
+
+def test_slow_lookup_for_disallowed_url_answers_inline(app):
+    app.lookup_seconds = 0.7
+    response, elapsed = _command("https://example.com/x")
+    assert json.loads(response.get_body())["text"] == "Stats for U1"
+    assert elapsed >= app.lookup_seconds
+    assert app.transport.posts == 0
+
+
+def test_inline_deadline_leaves_time_to_acknowledge():
+    now = 1_700_000_000.0
+    deadline = function_app.inline_deadline
+    assert deadline({}, now) == function_app.INLINE_DEADLINE
+    assert deadline({"X-Slack-Request-Timestamp": "soon"}, now) == function_app.INLINE_DEADLINE
+    assert deadline({"X-Slack-Request-Timestamp": str(now)}, now) == function_app.INLINE_DEADLINE
+    assert deadline({"X-Slack-Request-Timestamp": str(now + 5)}, now) == function_app.INLINE_DEADLINE  # Clock skew
+    spent = function_app.SLACK_TIMEOUT - function_app.ACK_MARGIN - 0.2
+    assert deadline({"X-Slack-Request-Timestamp": str(now - spent)}, now) == pytest.approx(0.2)
+    assert deadline({"X-Slack-Request-Timestamp": str(now - 10)}, now) == 0.0
@@ -0,0 +1,20 @@
+import contextlib
+import io
+import os
+
+from conftest import BASE_OUTPUTS, read_outputs
+from prep_stats import calculate_base_stats
+
+
+def _base_stats(zip_file_path, output_dir, **kwargs):
+    os.makedirs(output_dir, exist_ok=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        calculate_base_stats(zip_file_path, [], output_dir=output_dir, **kwargs)
+    return read_outputs(output_dir, BASE_OUTPUTS)
+
+
+def test_cache_of_export_without_reactions(small_export, tmp_path):
+    zip_file_path = small_export(reaction_density=0)
+    scanned = _base_stats(zip_file_path, str(tmp_path / "json"))
+    assert _base_stats(zip_file_path, str(tmp_path / "table"), message_cache=str(tmp_path / "messages.npz")) == scanned
+
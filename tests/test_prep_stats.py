@@ -0,0 +1,56 @@
+import json
+import math
+from datetime import datetime, timezone
+
+from prep_stats import calculate_base_stats, calculate_percentiles
+from slack_export import SlackExport
+
+
+def test_percentiles_with_ties_and_inactive_users(tmp_path):
+    def user(threads_started, replies, engagement_received):
+        return {"threads_started": threads_started, "replies": replies, "engagement_received": engagement_received}
+
+    base_stats = {
+        "LEADER": user(10, 1, 0),
+        "TIED1": user(5, 1, 7),
+        "TIED2": user(5, 1, 7),
+        "LAST": user(1, 1, 3),
+        "IDLE": user(0, 0, 50),  # Inactive, so not ranked
+        "BOT": user(90, 90, 90),  # Excluded from the ranking, but still given a percentile
+    }
+    base_stats_file = tmp_path / "base_stats.json"
+    base_stats_file.write_text(json.dumps(base_stats))
+    calculate_percentiles(str(base_stats_file), ["BOT"], output_dir=str(tmp_path))
+    final_stats = json.loads((tmp_path / "final_stats.json").read_text())
+
+    def percentiles(key):
+        return {user_id: user_stats[f"{key}_percentile"] for user_id, user_stats in final_stats.items()}
+
+    # Four ranked users: the leader is in the top 25%, and tied users share the better rank
+    assert percentiles("threads_started") == {"LEADER": 25, "TIED1": 50, "TIED2": 50, "LAST": 100, "IDLE": 100, "BOT": 25}
+    assert percentiles("replies") == {"LEADER": 25, "TIED1": 25, "TIED2": 25, "LAST": 25, "IDLE": 100, "BOT": 25}
+    assert percentiles("engagement_received") == {"LEADER": 100, "TIED1": 25, "TIED2": 25, "LAST": 75, "IDLE": 100, "BOT": 25}
+
+
+def test_activity_histograms_match_datetime(small_export, tmp_path):
+    zip_file_path = small_export(days=40, messages_per_day=10)  # Into a second month
+    calculate_base_stats(zip_file_path, [], output_dir=str(tmp_path), verbose=False)
+
+    # Month, weekday and hour in UTC of every message with a ts and a user, the slow way
+    expected = {"user": {}, "channel": {}}
+    with SlackExport(zip_file_path) as export:
+        for channel_name, _, messages in export.iter_messages():
+            for message in messages:
+                if not message.get("ts") or not message.get("user"):
+                    continue
+                posted = datetime.fromtimestamp(math.floor(float(message["ts"])), timezone.utc)
+                for kind, key in (("user", message["user"]), ("channel", channel_name)):
+                    histograms = expected[kind].setdefault(key, {"month": [0] * 12, "weekday": [0] * 7, "hour": [0] * 24})
+                    histograms["month"][posted.month - 1] += 1
+                    histograms["weekday"][posted.weekday()] += 1
+                    histograms["hour"][posted.hour] += 1
+
+    for kind in expected:
+        activity = json.loads((tmp_path / f"{kind}_activity.json").read_text())
+        assert expected[kind]
+        assert {key: histograms for key, histograms in activity.items() if any(histograms["hour"])} == expected[kind]
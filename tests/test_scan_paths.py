@@ -0,0 +1,102 @@
+import contextlib
+import io
+import json
+import os
+import zipfile
+
+import pytest
+
+from conftest import BASE_OUTPUTS, read_outputs, shuffled_copy
+import prep_stats
+import thread_grouping
+from prep_stats import prep_export
+
+PREP_OUTPUTS = BASE_OUTPUTS + ("top_contributors.json", "final_stats.json")
+
+
+@pytest.fixture(autouse=True)
+def small_tasks(monkeypatch):
+    monkeypatch.setattr(prep_stats, "DAY_FILES_PER_TASK", 3)  # Threads carry on across scan tasks
+
+
+@pytest.fixture(params=["plain", "no_reactions", "shuffled"])
+def export(request, small_export, tmp_path):
+    """(export, reference) zips: a small export, one without reactions or one with its members shuffled,
+    and the export whose serial run every path must reproduce (for the shuffled one, the original)."""
+    if request.param == "no_reactions":
+        zip_file_path = small_export(reaction_density=0)
+        return zip_file_path, zip_file_path
+    zip_file_path = small_export()
+    if request.param == "shuffled":
+        return shuffled_copy(zip_file_path, str(tmp_path / "shuffled.zip")), zip_file_path
+    return zip_file_path, zip_file_path
+
+
+def _prep(zip_file_path, output_dir, names=PREP_OUTPUTS, **kwargs):
+    os.makedirs(output_dir, exist_ok=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        prep_export(zip_file_path, output_dir, verbose=False, **kwargs)
+    return read_outputs(output_dir, names)
+
+
+def _first_days(zip_file_path, path):
+    """Copy an export without the day files of its second half, as an earlier export of the same workspace."""
+    with zipfile.ZipFile(zip_file_path) as source, zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as target:
+        days = sorted({os.path.basename(name) for name in source.namelist() if "/" in name})
+        cutoff = days[len(days) // 2]
+        for info in source.infolist():
+            if "/" not in info.filename or os.path.basename(info.filename) < cutoff:
+                target.writestr(info, source.read(info))
+    return path
+
+
+def test_pool_and_table_match_serial(export, tmp_path):
+    export, reference = export
+    serial = _prep(reference, str(tmp_path / "serial"))
+    assert _prep(export, str(tmp_path / "export"), workers=1) == serial
+    assert _prep(export, str(tmp_path / "pool"), workers=2) == serial
+    cache = str(tmp_path / "messages.npz")
+    assert _prep(export, str(tmp_path / "table"), message_cache=cache) == serial
+    assert _prep(export, str(tmp_path / "cached"), message_cache=cache) == serial
+
+
+def test_streaming_and_spilling_match_serial(export, tmp_path, monkeypatch):
+    export, reference = export
+    serial = _prep(reference, str(tmp_path / "serial"))
+    monkeypatch.setattr(prep_stats, "STREAM_DAY_FILE_BYTES", 0)  # Stream every day file
+    monkeypatch.setattr(thread_grouping, "MAX_GROUPED_MESSAGES", 5)  # Spill every busy day file's threads
+    assert _prep(export, str(tmp_path / "streamed"), workers=2) == serial
+    assert _prep(export, str(tmp_path / "table"), message_cache=str(tmp_path / "messages.npz")) == serial
+
+
+def test_incremental_matches_full(export, tmp_path):
+    export, reference = export
+    first_days = _first_days(export, str(tmp_path / "first_days.zip"))
+    names = BASE_OUTPUTS + ("final_stats.json",)  # top_contributors.json needs a full run
+    runs = {}
+    for mode in ("json", "table"):
+        output_dir, state_file = str(tmp_path / mode), str(tmp_path / f"{mode}.npz")
+        for zip_file_path in (first_days, export):
+            cache = str(tmp_path / f"{os.path.basename(zip_file_path)}.npz") if mode == "table" else None
+            runs[mode] = _prep(zip_file_path, output_dir, names, state_file=state_file, message_cache=cache)
+    assert runs["table"] == runs["json"]
+
+    # Resuming only changes the order of entries tied on their counts (they rank in first-seen order)
+    full = _prep(reference, str(tmp_path / "full"), names)
+    for name in names:
+        resumed, expected = json.loads(runs["json"][name]), json.loads(full[name])
+        if name == "channel_posts.json":  # Every poster is listed, so compare them as mappings
+            assert {channel: dict(posters) for channel, posters in resumed.items()} == {
+                channel: dict(posters) for channel, posters in expected.items()
+            }
+        else:
+            assert _counts_only(resumed) == _counts_only(expected), name
+
+
+def _counts_only(outputs):
+    """Prep outputs with every ranked [[name, count], ...] list reduced to its counts."""
+    if isinstance(outputs, dict):
+        return {key: _counts_only(value) for key, value in outputs.items()}
+    if isinstance(outputs, list) and all(isinstance(entry, list) and len(entry) == 2 and isinstance(entry[1], int) for entry in outputs):
+        return [count for _, count in outputs]
+    return outputs
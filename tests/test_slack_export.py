@@ -0,0 +1,26 @@
+import contextlib
+import io
+
+from conftest import BASE_OUTPUTS, read_outputs, shuffled_copy
+import prep_stats
+from prep_stats import calculate_base_stats
+from slack_export import SlackExport
+
+
+def test_day_files_in_date_order(small_export, tmp_path):
+    with SlackExport(shuffled_copy(small_export(), str(tmp_path / "shuffled.zip"))) as export:
+        for file_names in export.day_files.values():
+            assert file_names == sorted(file_names)
+
+
+def test_member_order_does_not_change_stats(small_export, tmp_path, monkeypatch):
+    monkeypatch.setattr(prep_stats, "DAY_FILES_PER_TASK", 3)  # Threads carry on across scan tasks
+    zip_file_path = small_export()
+    outputs = []
+    for path in (zip_file_path, shuffled_copy(zip_file_path, str(tmp_path / "shuffled.zip"))):
+        output_dir = tmp_path / f"out-{len(outputs)}"
+        output_dir.mkdir()
+        with contextlib.redirect_stdout(io.StringIO()):
+            calculate_base_stats(path, [], output_dir=str(output_dir))
+        outputs.append(read_outputs(str(output_dir), BASE_OUTPUTS))
+    assert outputs[0] == outputs[1]
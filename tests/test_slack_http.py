@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from slack_http import DeliveryError, ResponseUrlClient
+
+RESPONSE_URL = "https://hooks.slack.com/commands/T1/1/abc"
+
+
+class ScriptedTransport:
+    """Answers each POST with the next (status, headers, body) of a script, recording the URLs posted to."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.urls = []
+
+    async def post_json(self, url, payload):
+        self.urls.append(url)
+        return self.responses.pop(0)
+
+
+def _client(responses, **settings):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    transport = ScriptedTransport(responses)
+    return ResponseUrlClient(transport=transport, sleep=sleep, **settings), transport, delays
+
+
+def test_unavailable_is_retried():
+    client, transport, delays = _client([(503, {}, b"busy"), (503, {}, b"busy"), (200, {}, b"ok")])
+    asyncio.run(client.post(RESPONSE_URL, {"text": "hi"}))
+    assert transport.urls == [RESPONSE_URL] * 3
+    assert len(delays) == 2
+
+    client, transport, delays = _client([(503, {}, b"busy")] * 3, retries=2)
+    with pytest.raises(DeliveryError) as error:
+        asyncio.run(client.post(RESPONSE_URL, {"text": "hi"}))
+    assert error.value.status == 503
+    assert len(transport.urls) == 3
+
+    client, transport, delays = _client([(404, {}, b"no_service")])
+    with pytest.raises(DeliveryError):
+        asyncio.run(client.post(RESPONSE_URL, {"text": "hi"}))
+    assert len(transport.urls) == 1 and not delays
+
+
+def test_rate_limit_waits_retry_after():
+    client, transport, delays = _client([(429, {"Retry-After": "7"}, b""), (429, {}, b""), (200, {}, b"ok")], max_backoff=1.0)
+    asyncio.run(client.post(RESPONSE_URL, {"text": "hi"}))
+    assert delays[0] == 7.0
+    assert 0 <= delays[1] <= 1.0  # No Retry-After: jittered backoff
+
+
+@pytest.mark.parametrize("url", ["https://example.com/x", "http://hooks.slack.com/x", "https://hooks.slack.com.example.com/x"])
+def test_disallowed_url_is_rejected(url):
+    client, transport, _ = _client([(200, {}, b"ok")])
+    with pytest.raises(DeliveryError):
+        asyncio.run(client.post(url, {"text": "hi"}))
+    assert not transport.urls
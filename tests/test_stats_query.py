@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+
+import stats_query
+from stats_query import StatsQuery, build_query_index, query_records
+from stats_store import IndexedRecords
+
+
+def _user(threads_started, replies, engagement_received, top_co_posters=()):
+    return {
+        "threads_started": threads_started,
+        "replies": replies,
+        "engagement_received": engagement_received,
+        "top_co_posters": [list(entry) for entry in top_co_posters],
+    }
+
+
+def test_excluded_users_are_left_off_every_leaderboard():
+    stats = {
+        "U1": _user(5, 1, 3, [("BOT", 4), ("U2", 2)]),
+        "U2": _user(2, 7, 9),
+        "BOT": _user(90, 90, 90, [("U1", 4)]),
+    }
+    channel_posts = {"general": [["BOT", 50], ["U1", 3]], "bots": [["BOT", 20]]}
+    records = dict(query_records(stats, channel_posts, ["BOT"]))
+
+    assert records["top:threads_started"] == [("U1", 5), ("U2", 2)]
+    assert records["top:replies"] == [("U2", 7), ("U1", 1)]
+    assert records["top:posts:general"] == [("U1", 3)]
+    assert "top:posts:bots" not in records
+    assert records["co:U1"] == [("U2", 2)]
+    assert records["co:U2"] == [("U1", 2)]
+    assert "co:BOT" not in records
+
+
+def test_replaced_channel_posts_are_picked_up(tmp_path):
+    stats_file, query_file = str(tmp_path / "final_stats.json"), str(tmp_path / "final_query.idx")
+    channel_posts_file = str(tmp_path / "channel_posts.json")
+    with open(stats_file, "w") as f:
+        json.dump({"U1": _user(1, 1, 1), "U2": _user(2, 2, 2)}, f)
+    _replace_json(channel_posts_file, {"general": [["U1", 3]]})
+    build_query_index(stats_file, query_file, channel_posts_file, [])
+    query = StatsQuery(stats_file, query_file, channel_posts_file, [], check_interval=0)
+    assert query.top("posts", 10, "general") == [("U1", 3)]
+
+    # The index was built from the old channel_posts.json, so the leaderboards are computed from the new one
+    _replace_json(channel_posts_file, {"general": [["U2", 5], ["U1", 3]]})
+    assert query.top("posts", 10, "general") == [("U2", 5), ("U1", 3)]
+    _replace_json(channel_posts_file, {"general": [["U2", 6], ["U1", 3]]})
+    assert query.top("posts", 10, "general") == [("U2", 6), ("U1", 3)]
+
+    build_query_index(stats_file, query_file, channel_posts_file, [])
+    assert isinstance(query._store.stats(), IndexedRecords)
+    assert query.top("posts", 10, "general") == [("U2", 6), ("U1", 3)]
+
+
+def test_concurrent_lookups_see_one_snapshot_while_stats_are_replaced(tmp_path, monkeypatch):
+    stats_file, channel_posts_file = str(tmp_path / "final_stats.json"), str(tmp_path / "channel_posts.json")
+    snapshots = [
+        {f"U{number}": _user(number, 10 - number, 0, [("U0", number)]) for number in range(1, 6)},
+        {f"U{number}": _user(10 - number, number, 0, [("U0", 10 - number)]) for number in range(1, 8)},
+    ]
+    _replace_json(stats_file, snapshots[0])
+    _replace_json(channel_posts_file, {"general": [["U1", 3]]})
+    expected = [
+        {key: [tuple(entry) for entry in entries] for key, entries in query_records(stats, {"general": [["U1", 3]]})}
+        for stats in snapshots
+    ]
+
+    computed = []
+
+    def slow_query_records(*args):
+        computed.append(args[0])
+        time.sleep(0.01)  # Long enough for other threads to pile up on the lock
+        return query_records(*args)
+
+    monkeypatch.setattr(stats_query, "query_records", slow_query_records)
+    query = StatsQuery(stats_file, str(tmp_path / "missing.idx"), channel_posts_file, [], check_interval=0)
+    swapped = threading.Event()
+    results = []  # (whether the swap had happened before the lookup, the snapshot each leaderboard came from)
+
+    def look_up():
+        for _ in range(300):
+            before = swapped.is_set()
+            leaderboards = {
+                "top:threads_started": query.top("threads_started", 100),
+                "top:replies": query.top("replies", 100),
+                "co:U0": query.co_posters("U0", 100),
+            }
+            results.append((before, [
+                next(number for number, records in enumerate(expected) if records[key] == entries)
+                for key, entries in leaderboards.items()
+            ]))
+
+    threads = [threading.Thread(target=look_up) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while len(results) < 100:
+        time.sleep(0.001)
+    _replace_json(stats_file, snapshots[1])
+    swapped.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 8 * 300
+    # Each leaderboard matches one snapshot exactly, and once the new file is seen no lookup goes back to the old one
+    assert all(origins[0] == 1 for before, origins in results if before)
+    assert {origin for _, origins in results for origin in origins} == {0, 1}
+    assert len(computed) == 2  # Once per snapshot, however many threads asked at the same time
+
+
+def _replace_json(path, data):
+    """Replace a JSON file the way a deploy would: a new file with a new mtime (and size)."""
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(f"{path}.tmp", path)
+    os.utime(path, ns=(time.time_ns(), time.time_ns()))
@@ -0,0 +1,55 @@
+import json
+import os
+
+import pytest
+
+import stats_store
+from stats_store import IndexedRecords, StatsStore, build_index, index_source, write_index
+
+
+def _write_stats(path, stats, mtime_ns):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(stats, f)
+    os.replace(tmp_path, path)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_stale_index_is_not_served_until_rebuilt(tmp_path):
+    stats_file = str(tmp_path / "final_stats.json")
+    index_file = str(tmp_path / "final_stats.idx")
+    messages_file = str(tmp_path / "final_messages.idx")
+    _write_stats(stats_file, {"U1": {"replies": 1}}, 1_000_000_000)
+    build_index(stats_file, index_file)
+    write_index([("U1", b'"Hi U1"')], messages_file, [index_source(stats_file)])
+
+    store = StatsStore(stats_file, index_file, check_interval=0)
+    messages_store = StatsStore(None, messages_file, check_interval=0, source_files=[stats_file])
+    assert isinstance(store.stats(), IndexedRecords)
+    assert messages_store.get("U1") == "Hi U1"
+
+    # Replaced: the old index is ignored, and the stats come from the JSON file
+    _write_stats(stats_file, {"U1": {"replies": 2}, "U2": {"replies": 3}}, 2_000_000_000)
+    assert isinstance(store.stats(), dict)
+    assert store.get("U1") == {"replies": 2}
+    with pytest.raises(FileNotFoundError):
+        messages_store.stats()  # Nothing to fall back to
+
+    build_index(stats_file, index_file)
+    assert isinstance(store.stats(), IndexedRecords)
+    assert store.get("U2") == {"replies": 3}
+
+
+def test_touched_source_is_hashed_once(tmp_path, monkeypatch):
+    stats_file = str(tmp_path / "final_stats.json")
+    index_file = str(tmp_path / "final_stats.idx")
+    _write_stats(stats_file, {"U1": {"replies": 1}}, 1_000_000_000)
+    build_index(stats_file, index_file)
+    os.utime(stats_file, ns=(2_000_000_000, 2_000_000_000))  # Same contents, new mtime
+
+    hashed = []
+    file_digest = stats_store._file_digest
+    monkeypatch.setattr(stats_store, "_file_digest", lambda path: hashed.append(path) or file_digest(path))
+    stores = [StatsStore(stats_file, index_file, check_interval=0) for _ in range(3)]
+    assert all(isinstance(store.stats(), IndexedRecords) for store in stores)
+    assert hashed == [stats_file]
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+import stats_store
+import wrapped
+from prep_stats import calculate_base_stats, calculate_percentiles
+from stats_store import StatsStore
+
+
+@pytest.fixture
+def stats_file(small_export, tmp_path):
+    """final_stats.json prepped from a small export."""
+    calculate_base_stats(small_export(), [], output_dir=str(tmp_path), verbose=False)
+    calculate_percentiles(str(tmp_path / "base_stats.json"), [], output_dir=str(tmp_path))
+    return str(tmp_path / "final_stats.json")
+
+
+def test_render_messages_is_deterministic(stats_file, tmp_path):
+    first, second = str(tmp_path / "first.idx"), str(tmp_path / "second.idx")
+    wrapped.render_messages(stats_file, first)
+    wrapped.render_messages(stats_file, second)
+    with open(first, "rb") as f, open(second, "rb") as g:
+        assert f.read() == g.read()
+
+
+def test_rendered_messages_match_the_fallback(stats_file, tmp_path, monkeypatch):
+    messages_file = str(tmp_path / "final_messages.idx")
+    wrapped.render_messages(stats_file, messages_file)
+    with open(stats_file, "r", encoding="utf-8") as f:
+        user_ids = list(json.load(f))
+    monkeypatch.setattr(stats_store, "_default_store", StatsStore(stats_file, None))
+
+    monkeypatch.setattr(wrapped, "_messages_store", StatsStore(None, messages_file, source_files=[stats_file]))
+    indexed = {user_id: wrapped.get_wrapped_response(user_id) for user_id in user_ids}
+    monkeypatch.setattr(wrapped, "_messages_store", StatsStore(None, str(tmp_path / "missing.idx"), source_files=[stats_file]))
+    rendered = {user_id: wrapped.get_wrapped_response(user_id) for user_id in user_ids}
+
+    assert user_ids and all(isinstance(body, bytes) for body in indexed.values())
+    assert {user_id: json.loads(body) for user_id, body in indexed.items()} == {
+        user_id: json.loads(body) for user_id, body in rendered.items()
+    }
+    assert wrapped.get_wrapped_response("UNKNOWN") is None